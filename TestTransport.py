@@ -0,0 +1,14 @@
+#!/usr/bin/python
+import sys
+import unittest
+from teststransport import CoalescerTest, CongestionTest, PackTest, PacketTest, RegistryTest, RttTest, SackTest, SessionTest, TimerTest
+
+
+def tests_to_run(loader):
+    modules = (CoalescerTest, CongestionTest, PackTest, PacketTest, RegistryTest, RttTest, SackTest, SessionTest, TimerTest)
+    return unittest.TestSuite([loader.loadTestsFromModule(module) for module in modules])
+
+
+if __name__ == "__main__":
+    RESULT = unittest.TextTestRunner(verbosity=2).run(tests_to_run(unittest.defaultTestLoader))
+    sys.exit(not RESULT.wasSuccessful())
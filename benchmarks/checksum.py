@@ -0,0 +1,69 @@
+'''
+Microbenchmark of checking and parsing a received datagram.
+Run from the repository root: python3 -m benchmarks.checksum
+
+"before" is the old pair: decode the datagram, validate_checksum() it the old way (split off the
+checksum, encode the body again, format the CRC as text and compare strings) and then parse_packet()
+it. "validate" is util.validate_checksum on the raw bytes, "text" is util.parse_packet_bytes, which
+checks and parses the bytes in one go (splitting a copy of datagrams up to util.SMALL_PACKET bytes, and
+slicing memoryviews of larger ones), and the binary columns are util.parse_binary_packet with every
+checksum that is available here. Each figure is the best of REPEAT runs, as other processes on the
+machine only ever make a run slower.
+'''
+import binascii
+import timeit
+import util
+
+SIZES = [0, 100, 1400]  # Payload bytes, an ACK, a short message and a full chunk
+NUMBER = 20000
+REPEAT = 15
+
+
+def old_generate_checksum(message):
+    return str(binascii.crc32(message) & 0xffffffff)
+
+
+def old_validate_checksum(message):
+    try:
+        msg, checksum = message.rsplit('|', 1)
+        msg += '|'
+        return old_generate_checksum(msg.encode()) == checksum
+    except BaseException:
+        return False
+
+
+def before(data):
+    message = data.decode('utf-8')
+    if not old_validate_checksum(message):
+        return None
+    msg_type, seqno, data, _ = util.parse_packet(message)
+    return msg_type, int(seqno), data
+
+
+def per_call(steps):
+    '''
+    Mean time of every step(data) of steps in microseconds, the best of REPEAT rounds that take turns
+    between them, so a slow stretch of the machine hits all of them alike
+    '''
+    best = [float("inf")] * len(steps)
+    for _ in range(REPEAT):
+        for idx, (step, data) in enumerate(steps):
+            best[idx] = min(best[idx], timeit.timeit(lambda: step(data), number=NUMBER) / NUMBER * 1e6)
+    return best
+
+
+if __name__ == "__main__":
+    names = ["before", "validate", "text"] + ["bin " + name for name in util.CHECKSUMS]
+    print("microseconds per datagram")
+    print("%8s" % "bytes" + "".join("%14s" % name for name in names))
+    for size in SIZES:
+        payload = b"x" * size
+        text = util.make_packet_bytes("data", 123456, payload)
+        assert before(text) is not None and util.validate_checksum(text) and util.parse_packet_bytes(text)
+        steps = [(before, text), (util.validate_checksum, text), (util.parse_packet_bytes, text)]
+        for name in util.CHECKSUMS:
+            binary = util.make_binary_packet("data", 123456, payload, checksum=name)
+            assert util.parse_binary_packet(binary) is not None
+            steps.append((util.parse_binary_packet, binary))
+        row = per_call(steps)
+        print("%8d" % size + "".join("%14.2f" % value for value in row))
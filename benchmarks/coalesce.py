@@ -0,0 +1,108 @@
+'''
+Benchmark of sending bursts of short chat messages with and without coalescing.
+Run from the repository root: python3 -m benchmarks.coalesce [NUM_MSGS]
+
+A client endpoint sends a burst of NUM_MSGS (200 by default) short send_message commands to a server
+endpoint over loopback, with every datagram held back for DELAY ms on the way to emulate a link.
+"plain" is what Client.send_packet does without coalescing, one transfer per message, each waited on
+before the next. "coalesced" queues every message on a Coalescer and waits for the last batch.
+Reported is the rate at which messages came out of the server queue, along with the datagrams sent.
+'''
+import heapq
+import logging
+import socket
+import sys
+import threading
+import time
+import transport
+import util
+
+DELAYS = [0, 5, 20]  # ms added to every datagram, one way
+COALESCE = 0.005  # 5ms
+
+
+class DelaySocket:
+    '''
+    Wraps a UDP socket, counts the datagrams sent and puts each on the wire `delay` seconds later
+    '''
+
+    def __init__(self, delay):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.delay = delay
+        self.sent = 0
+        self.heap = []  # (due time, order, datagram, address)
+        self.cond = threading.Condition()
+        thread = threading.Thread(target=self.deliver)
+        thread.daemon = True
+        thread.start()
+
+    def deliver(self):
+        while True:
+            self.cond.acquire()
+            while not self.heap or self.heap[0][0] > time.time():
+                self.cond.wait(self.heap[0][0] - time.time() if self.heap else None)
+            _, _, data, address = heapq.heappop(self.heap)
+            self.cond.release()
+            self.sock.sendto(data, address)
+
+    def sendto(self, data, address):
+        self.sent += 1
+        if self.delay == 0:
+            return self.sock.sendto(data, address)
+        self.cond.acquire()
+        heapq.heappush(self.heap, (time.time() + self.delay, self.sent, data, address))
+        self.cond.notify()
+        self.cond.release()
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def endpoint(delay, coalesce=0):
+    '''
+    An Endpoint on its own receive thread
+    '''
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    ep = transport.Endpoint(DelaySocket(delay), logger, 3, coalesce=coalesce)
+    thread = threading.Thread(target=ep.recv_packet)
+    thread.daemon = True
+    thread.start()
+    return ep
+
+
+def burst(num_msgs, delay, coalesce):
+    '''
+    Send num_msgs messages, returns (messages per second, datagrams sent by both ends)
+    '''
+    client = endpoint(delay, coalesce)
+    server = endpoint(delay)
+    address = server.sock.getsockname()
+    msgs = [util.make_message("send_message", 4, "1 bob hi there number " + str(idx)) for idx in range(num_msgs)]
+    start = time.perf_counter()
+    for msg in msgs:
+        if coalesce:
+            batch = client.queue_message(msg, address)
+        else:
+            client.send_packet(msg, address).done.wait()
+    for msg in msgs:
+        assert server.queue.get(timeout=60)[0] == msg
+    elapsed = time.perf_counter() - start
+    if coalesce:
+        batch.done.wait()
+    sent = client.sock.sent + server.sock.sent
+    client.sock.close()
+    server.sock.close()
+    return num_msgs / elapsed, sent
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print("%d messages per burst, coalescing delay %dms" % (num_msgs, COALESCE * 1000))
+    print("%10s %14s %10s %14s %10s" % ("delay ms", "plain msg/s", "datagrams", "coalesced msg/s", "datagrams"))
+    for delay in DELAYS:
+        plain, plain_sent = burst(num_msgs, delay / 1000.0, 0)
+        coalesced, coalesced_sent = burst(num_msgs, delay / 1000.0, COALESCE)
+        print("%10d %14.0f %10d %14.0f %10d" % (delay, plain, plain_sent, coalesced, coalesced_sent))
@@ -0,0 +1,99 @@
+'''
+Benchmark of sending large chat messages with and without compression under packet loss.
+Run from the repository root: python3 -m benchmarks.compress [NUM_MSGS]
+
+A client endpoint sends NUM_MSGS (20 by default) messages of MSG_LEN characters one by one to a server
+endpoint over loopback, while LOSS of the DATA packets are dropped on the way like PacketLossTest does.
+"letters" are random letters like the messages of PacketLossTest, "words" are random common words,
+closer to what people type. Level 0 is no compression (-z 0), the others are offered with -z LEVEL.
+Reported are the DATA packets put on the wire, the ms per message and, from Endpoint.compress_stats(),
+the compression ratio and the CPU microseconds per message spent on each side.
+'''
+import logging
+import random
+import sys
+import threading
+import time
+import transport
+import util
+from benchmarks.coalesce import DelaySocket
+
+MSG_LEN = 5000  # Characters, five chunks as they are
+LOSS = 0.2
+LEVELS = [0, 1, 6]
+WORDS = ["hello", "the", "meeting", "is", "at", "noon", "see", "you", "there", "thanks", "for", "lunch",
+         "tomorrow", "sounds", "good", "to", "me", "project", "update", "is", "done", "ok", "and", "we"]
+
+
+class LossySocket(DelaySocket):
+    '''
+    A DelaySocket that drops LOSS of the DATA packets and counts the ones sent, lost or not
+    '''
+
+    def __init__(self):
+        DelaySocket.__init__(self, 0)
+        self.data_sent = 0
+
+    def sendto(self, data, address):
+        if util.is_binary_packet(data):
+            is_data = data[1] == util.PACKET_TYPE_CODES["data"]
+        else:
+            is_data = data.startswith(b"data|")
+        if is_data:
+            self.data_sent += 1
+            if random.random() < LOSS:
+                return len(data)
+        return DelaySocket.sendto(self, data, address)
+
+
+def endpoint(sock, options):
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    ep = transport.Endpoint(sock, logger, 3, options=options)
+    thread = threading.Thread(target=ep.recv_packet)
+    thread.daemon = True
+    thread.start()
+    return ep
+
+
+def letters():
+    return "".join(random.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(MSG_LEN))
+
+
+def words():
+    text = ""
+    while len(text) < MSG_LEN:
+        text += random.choice(WORDS) + " "
+    return text[:MSG_LEN]
+
+
+def run(num_msgs, make, level):
+    '''
+    Send num_msgs messages one by one, returns (DATA packets sent, ms per message, client stats, server stats)
+    '''
+    random.seed(1)
+    client = endpoint(LossySocket(), transport.Options(compress=level))
+    server = endpoint(LossySocket(), transport.Options())
+    address = server.sock.getsockname()
+    msgs = [util.make_message("send_message", 4, "1 bob " + make()) for _ in range(num_msgs)]
+    start = time.perf_counter()
+    for msg in msgs:
+        transfer = client.send_packet(msg, address)
+        transfer.done.wait()
+        assert not transfer.failed
+        assert server.queue.get(timeout=60)[0] == msg
+    elapsed = time.perf_counter() - start
+    client.sock.close()
+    server.sock.close()
+    return client.sock.data_sent, elapsed / num_msgs * 1000, client.compress_stats(), server.compress_stats()
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("%d messages of %d characters, %d%% of the DATA packets lost" % (num_msgs, MSG_LEN, LOSS * 100))
+    print("%8s %6s %8s %8s %8s %12s %14s" % ("text", "level", "DATA", "ms/msg", "ratio", "compress us", "decompress us"))
+    for name, make in [("letters", letters), ("words", words)]:
+        for level in LEVELS:
+            data_sent, per_msg, sent, received = run(num_msgs, make, level)
+            print("%8s %6d %8d %8.2f %8.2f %12.1f %14.1f" % (
+                name, level, data_sent, per_msg, sent["ratio"], sent["compress_us"], received["decompress_us"]))
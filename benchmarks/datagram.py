@@ -0,0 +1,77 @@
+'''
+Benchmark of chunk sizes: packets per message, largest datagram and time per message.
+Run from the repository root: python3 -m benchmarks.datagram [NUM_MSGS]
+
+A client endpoint sends NUM_MSGS (20 by default) messages of MSG_LEN characters one by one to a server
+endpoint over loopback, every datagram held back for DELAY ms on the way to emulate a link.
+"ascii" messages are one byte per character, "multibyte" ones are three. "before" cuts every message
+into CHUNK_SIZE characters like send_packet used to, which puts up to three times util.CHUNK_SIZE bytes
+in a multibyte packet, past the 1500 bytes the tests allow. "bytes" cuts CHUNK_SIZE bytes, and "auto"
+offers -x auto, which on loopback takes chunks of up to util.MAX_CHUNK_SIZE bytes.
+'''
+import sys
+import time
+import transport
+import util
+from benchmarks.coalesce import DelaySocket
+from benchmarks.compress import endpoint
+
+MSG_LEN = 20000  # Characters
+DELAY = 0.002  # 2ms one way
+TEXTS = {"ascii": "x", "multibyte": "€"}
+
+
+class SizeSocket(DelaySocket):
+    '''
+    A DelaySocket that also records the largest datagram sent
+    '''
+
+    def __init__(self, delay):
+        DelaySocket.__init__(self, delay)
+        self.largest = 0
+
+    def sendto(self, data, address):
+        self.largest = max(self.largest, len(data))
+        return DelaySocket.sendto(self, data, address)
+
+
+class CharPayload(transport.Payload):
+    '''
+    A Payload cut into CHUNK_SIZE characters, what send_packet did before chunks were cut from the bytes
+    '''
+
+    def __init__(self, msg):
+        transport.Payload.__init__(self, msg)
+        self.chunks = [msg[i:i + util.CHUNK_SIZE].encode('utf-8') for i in range(0, len(msg), util.CHUNK_SIZE)]
+        self.sized[util.CHUNK_SIZE] = self.chunks
+
+
+def run(num_msgs, char, how):
+    '''
+    Send num_msgs messages one by one, returns (datagrams sent by the client, largest datagram, ms per message)
+    '''
+    options = transport.Options(datagram=transport.AUTO_DATAGRAM if how == "auto" else 0)
+    client = endpoint(SizeSocket(DELAY), options)
+    server = endpoint(DelaySocket(DELAY), transport.Options())
+    address = server.sock.getsockname()
+    msg = char * MSG_LEN
+    start = time.perf_counter()
+    for _ in range(num_msgs):
+        transfer = client.send_packet(CharPayload(msg) if how == "before" else msg, address)
+        transfer.done.wait()
+        assert not transfer.failed
+        assert server.queue.get(timeout=60)[0] == msg
+    elapsed = time.perf_counter() - start
+    client.sock.close()
+    server.sock.close()
+    return client.sock.sent / num_msgs, client.sock.largest, elapsed / num_msgs * 1000
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("%d messages of %d characters, %dms delay" % (num_msgs, MSG_LEN, DELAY * 1000))
+    print("%10s %8s %12s %16s %8s" % ("text", "chunks", "packets/msg", "largest bytes", "ms/msg"))
+    for name, char in TEXTS.items():
+        for how in ["before", "bytes", "auto"]:
+            packets, largest, per_msg = run(num_msgs, char, how)
+            print("%10s %8s %12.1f %16d %8.2f" % (name, how, packets, largest, per_msg))
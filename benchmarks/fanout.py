@@ -0,0 +1,115 @@
+'''
+Benchmark of building the packets of a forward message for many recipients.
+Run from the repository root: python3 -m benchmarks.fanout
+
+"before" is the old Server.send_msg_to_user: for every recipient, make_message() the forward message,
+cut it into string chunks and make_packet().encode() every DATA packet. "after" is the path it takes now:
+one transport.Payload for all recipients, and per recipient only a header and a checksum that carries on
+over the shared chunk. "server" is the whole of Server.send_all_msgs() with a START ACK coming back from
+every recipient, so that each transfer builds its DATA packets.
+'''
+import contextlib
+import io
+import logging
+import random
+import string
+import time
+import transport
+import util
+import server_2
+
+MSG_LEN = 5000
+FANOUTS = [1, 10, 100, 1000]
+REPEAT = 5
+
+
+def before(sender, msg_to_send, num_recipients):
+    '''
+    Every DATA packet of the forward message for num_recipients, the old way
+    '''
+    pkts = []
+    for _ in range(num_recipients):
+        msg_content = "1 " + sender + " " + msg_to_send
+        msg = util.make_message(msg_type="forward_message", msg_format=4, message=msg_content)
+        seqno = random.randint(10000, 10000000)
+        for i in range(0, len(msg), util.CHUNK_SIZE):
+            chunk = msg[i:min(i+util.CHUNK_SIZE, len(msg))]
+            seqno += 1
+            pkts.append(util.make_packet("data", seqno, chunk).encode('utf-8'))
+    return pkts
+
+
+def after(sender, msg_to_send, num_recipients):
+    '''
+    Every DATA packet of the forward message for num_recipients, the way transfers build them now
+    '''
+    msg_content = "1 " + sender + " " + msg_to_send
+    payload = transport.Payload(
+        util.make_message(msg_type="forward_message", msg_format=4, message=msg_content))
+    pkts = []
+    for _ in range(num_recipients):
+        seqno = random.randint(10000, 10000000)
+        for chunk in payload.chunks:
+            seqno += 1
+            pkts.append(util.make_packet_bytes("data", seqno, chunk))
+    return pkts
+
+
+class NullSocket:
+    '''
+    Stands in for the server socket and swallows whatever is sent
+    '''
+
+    def sendto(self, data, address):
+        return len(data)
+
+    def settimeout(self, timeout):
+        pass
+
+
+def server(srv, msg):
+    '''
+    Fan a send_message out through the Server and ACK every START so the DATA packets get built
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):  # The Server prints every send_message
+        srv.send_all_msgs(msg, ("127.0.0.1", 1))
+    for transfer in list(srv.transfers):
+        transfer.on_ack(transfer.starting_seq_num + 1)
+    for transfer in list(srv.transfers):
+        transfer.abort()
+
+
+def timed(step, *args):
+    '''
+    Best of REPEAT runs of step(*args), in seconds
+    '''
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        step(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    msg_to_send = ''.join(random.choice(string.ascii_letters) for _ in range(MSG_LEN))
+    srv = server_2.Server("localhost", 0, 3, capacity=max(FANOUTS) + 1)
+    srv.logger.setLevel(logging.WARNING)
+    srv.sock.close()
+    srv.sock = NullSocket()
+    srv.users.join("alice", ("127.0.0.1", 1))
+    for idx in range(max(FANOUTS)):
+        srv.users.join("user%d" % idx, ("127.0.0.2", 1024 + idx))
+    # Both ways have to build the very same packets
+    random.seed(0)
+    old = before("alice", msg_to_send, 3)
+    random.seed(0)
+    assert after("alice", msg_to_send, 3) == old
+    print("%10s %12s %12s %12s" % ("recipients", "before ms", "after ms", "server ms"))
+    for fanout in FANOUTS:
+        recipients = ["user%d" % idx for idx in range(fanout)]
+        msg = ["send_message", str(MSG_LEN), str(fanout)] + recipients + [msg_to_send]
+        print("%10d %12.2f %12.2f %12.2f" % (
+            fanout, timed(before, "alice", msg_to_send, fanout) * 1000,
+            timed(after, "alice", msg_to_send, fanout) * 1000, timed(server, srv, msg) * 1000))
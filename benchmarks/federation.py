@@ -0,0 +1,87 @@
+'''
+Benchmark of a federation of servers against a single one.
+Run from the repository root: python3 -m benchmarks.federation [NUM_CLIENTS] [NUM_MSGS]
+
+A cluster of 1, 2 and 3 server_2 servers is started on free loopback ports, each federated (-f) with
+the others. NUM_CLIENTS (8 by default) client processes join the servers round robin and wait until
+the users list of their server shows all of them, which checks that presence went around. Then each
+sends NUM_MSGS (200 by default) send_message commands to the next client, which is homed on another
+server as soon as there are two, one after the other like Client.send_packet does. Every forward then
+crosses the trunk between two servers. Reported is the rate at which forwards reached their recipients.
+Servers only add throughput with as many free cores, and the clients need cores of their own too.
+'''
+import multiprocessing
+import os
+import sys
+import time
+import server_2
+import util
+from benchmarks.coalesce import endpoint
+from benchmarks.workers import free_port
+
+NODES = [1, 2, 3]
+
+
+def serve(port, peers):
+    '''
+    Body of a server process, keeps its output off the terminal
+    '''
+    sys.stdout = open(os.devnull, "w")
+    server_2.Server("127.0.0.1", port, 3, capacity=1000, peers=peers).start()
+
+
+def client(idx, port, num_clients, num_msgs, ready, go, results):
+    '''
+    Body of a client process, puts the seconds it took to send its messages and receive as many on results
+    '''
+    ep = endpoint(0)
+    address = ("127.0.0.1", port)
+    ep.send_packet(util.make_message("join", 1, "user%d" % idx), address).done.wait()
+    while True:  # Until the other servers told ours about everyone
+        ep.send_packet(util.make_message("request_users_list", 2), address).done.wait()
+        if ep.queue.get(timeout=60)[0].split()[2] == str(num_clients):
+            break
+        time.sleep(0.1)
+    ready.put(idx)
+    go.wait()
+    msg = util.make_message("send_message", 4, "1 user%d hello there" % ((idx + 1) % num_clients))
+    start = time.perf_counter()
+    for _ in range(num_msgs):
+        ep.send_packet(msg, address).done.wait()
+    for _ in range(num_msgs):
+        ep.queue.get(timeout=120)
+    results.put(time.perf_counter() - start)
+
+
+def run(num_nodes, num_clients, num_msgs):
+    '''
+    Returns the forwards delivered per second with num_nodes servers
+    '''
+    ports = [free_port() for _ in range(num_nodes)]
+    servers = [multiprocessing.Process(target=serve, args=(
+        port, [("127.0.0.1", peer) for peer in ports if peer != port])) for port in ports]
+    for process in servers:
+        process.start()
+    time.sleep(1)  # Let every server bind
+    ready, results, go = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+    clients = [multiprocessing.Process(target=client, args=(
+        idx, ports[idx % num_nodes], num_clients, num_msgs, ready, go, results)) for idx in range(num_clients)]
+    for process in clients:
+        process.start()
+    for _ in clients:
+        ready.get(timeout=60)
+    go.set()
+    elapsed = max(results.get(timeout=300) for _ in clients)
+    for process in clients + servers:
+        process.terminate()
+        process.join()
+    return num_clients * num_msgs / elapsed
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_msgs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print("%d clients, %d messages each, %d cores" % (num_clients, num_msgs, os.cpu_count()))
+    print("%10s %12s" % ("servers", "forwards/s"))
+    for num_nodes in NODES:
+        print("%10d %12.0f" % (num_nodes, run(num_nodes, num_clients, num_msgs)))
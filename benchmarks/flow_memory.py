@@ -0,0 +1,91 @@
+'''
+Memory growth benchmark of the receive path.
+Run from the repository root: python3 -m benchmarks.flow_memory [NUM_MSGS]
+
+Pushes NUM_MSGS messages (a million by default) from a pool of peers through Server.recv_packet,
+with every ABANDON_EVERY-th message never finished, and samples the number of live Python
+allocations along the way. Once the first flow_ttl has passed the footprint has to stay flat.
+'''
+import logging
+import random
+import sys
+import time
+import util
+import server_2
+
+NUM_PEERS = 1000
+ABANDON_EVERY = 1000
+NUM_SAMPLES = 20
+FLOW_TTL = 1.0
+TOLERANCE = 0.25  # Allowed growth of the steady state footprint, a leak of one block per message is 10x that
+
+
+class FeedSocket:
+    '''
+    Stands in for the server socket: hands recv_packet() one datagram after the other,
+    swallows whatever the server sends back and stops the loop once everything was fed
+    '''
+
+    def __init__(self, server, num_msgs):
+        self.server = server
+        self.num_msgs = num_msgs
+        self.samples = []  # (messages so far, seconds so far, live allocations, live flows)
+        self.feed = self.datagrams()
+
+    def datagrams(self):
+        start = time.time()
+        peers = [("127.0.0.1", 20000 + i) for i in range(NUM_PEERS)]
+        every = max(1, self.num_msgs // NUM_SAMPLES)
+        for idx in range(self.num_msgs):
+            address = peers[idx % NUM_PEERS]
+            seqno = random.randint(10000, 10000000)
+            msg = util.make_message("send_message", 4, "1 bob message number " + str(idx))
+            yield util.make_packet("start", seqno, "").encode('utf-8'), address
+            yield util.make_packet("data", seqno + 1, msg).encode('utf-8'), address
+            if idx % ABANDON_EVERY != 0:
+                yield util.make_packet("end", seqno + 2, "").encode('utf-8'), address
+            if (idx + 1) % every == 0:
+                while not self.server.queue.empty():  # Nobody dispatches here
+                    self.server.queue.get_nowait()
+                self.samples.append((idx + 1, time.time() - start,
+                                     sys.getallocatedblocks(), len(self.server.flows)))
+
+    def recvfrom_into(self, buf):
+        try:
+            data, address = next(self.feed)
+        except StopIteration:
+            raise OSError("Nothing left to feed")
+        buf[:len(data)] = data
+        return len(data), address
+
+    def sendto(self, data, address):
+        return len(data)
+
+    def settimeout(self, timeout):
+        pass
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    server = server_2.Server("localhost", 0, 3)
+    server.logger.setLevel(logging.WARNING)
+    server.sock.close()
+    server.flow_ttl = FLOW_TTL
+    feed = FeedSocket(server, num_msgs)
+    server.sock = feed
+    server.recv_packet()
+    print("%10s %8s %12s %8s" % ("messages", "seconds", "allocations", "flows"))
+    for sample in feed.samples:
+        print("%10d %8.1f %12d %8d" % sample)
+    # Steady state starts once abandoned flows had the time to be reaped
+    steady = [blocks for msgs, secs, blocks, flows in feed.samples
+              if secs > FLOW_TTL + util.REAP_INTERVAL]
+    if len(steady) < 4:
+        print("Too few messages to reach the steady state")
+        sys.exit(1)
+    # Reaping comes in sweeps, so compare the averages of both halves of the steady state
+    half = len(steady) // 2
+    first = sum(steady[:half]) / half
+    growth = (sum(steady[half:]) / (len(steady) - half) - first) / first
+    print("Steady state growth: %.2f%%" % (growth * 100))
+    assert growth < TOLERANCE, "Footprint keeps growing"
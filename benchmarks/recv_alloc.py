@@ -0,0 +1,142 @@
+'''
+Benchmark of the memory the receive path allocates per packet.
+Run from the repository root: python3 -m benchmarks.recv_alloc
+
+"before" is the old path: recvfrom() a new bytes object, decode it, validate_checksum() and parse_packet() on the text,
+then prepend every chunk to the message. "after" is the path Endpoint.handle_packet() takes now:
+recv_into a preallocated buffer, parse and check it through memoryviews, copy the payload once
+and join and decode when the message is complete.
+"bytes" are tracemalloc peaks above the memory in use before each step, i.e. what a packet allocates
+on its way through, including the reassembly. "blocks" come from sys.getallocatedblocks(), which counts
+the memory blocks in use rather than every allocation, so they are the blocks a packet leaves allocated
+until its message completes. Times are the best of REPEAT runs.
+'''
+import random
+import string
+import sys
+import time
+import tracemalloc
+import util
+
+NUM_MSGS = 500
+MSG_LEN = 5000
+SMALL_MSG_LEN = 300 # Fits one DATA datagram under util.SMALL_PACKET
+REPEAT = 5
+
+
+def make_datagrams(binary, msg_len=MSG_LEN):
+    '''
+    Every packet of NUM_MSGS messages of msg_len characters, as raw datagrams
+    '''
+    msgs = []
+    for _ in range(NUM_MSGS):
+        msg = ''.join(random.choice(string.ascii_letters) for _ in range(msg_len))
+        seqno = random.randint(10000, 10000000)
+        pkts = [util.make_packet("start", seqno, "").encode('utf-8')]
+        for i in range(0, len(msg), util.CHUNK_SIZE):
+            seqno += 1
+            chunk = msg[i:i + util.CHUNK_SIZE]
+            if binary:
+                pkts.append(util.make_binary_packet("data", seqno, chunk.encode('utf-8')))
+            else:
+                pkts.append(util.make_packet("data", seqno, chunk).encode('utf-8'))
+        pkts.append(util.make_packet("end", seqno + 1, "").encode('utf-8'))
+        msgs.append(pkts)
+    return msgs
+
+
+class Before:
+    '''
+    The old receive path
+    '''
+
+    def __init__(self):
+        self.recv_pkts = []
+
+    def packet(self, datagram):
+        datagram = bytes(memoryview(datagram))  # The new bytes object recvfrom() returns
+        decoded_msg = datagram.decode('utf-8')
+        msg_type, seq_no, data, checksum = util.parse_packet(decoded_msg)
+        seq_no = int(seq_no)
+        if util.validate_checksum(decoded_msg):
+            self.recv_pkts.append(data)
+
+    def finish(self):
+        current_msg = ""
+        for data in reversed(self.recv_pkts):
+            current_msg = data + current_msg
+        self.recv_pkts = []
+        return current_msg
+
+
+class After:
+    '''
+    The current receive path
+    '''
+
+    def __init__(self):
+        self.buf = bytearray(util.RECV_BUFFER_SIZE)
+        self.recv_pkts = []
+
+    def packet(self, datagram):
+        nbytes = len(datagram)
+        self.buf[:nbytes] = datagram  # What recvfrom_into() does in the kernel
+        if util.is_binary_packet(self.buf):
+            parsed = util.parse_binary_packet(self.buf, nbytes)
+        else:
+            parsed = util.parse_packet_bytes(self.buf, nbytes)
+        if parsed is not None:
+            self.recv_pkts.append(bytes(parsed[2]))
+
+    def finish(self):
+        current_msg = b"".join(self.recv_pkts).decode('utf-8')
+        self.recv_pkts = []
+        return current_msg
+
+
+def measure(name, msgs, path):
+    '''
+    Run every message through a path, printing bytes allocated, blocks held and time per packet
+    '''
+    num_pkts = sum(len(pkts) for pkts in msgs)
+    tracemalloc.start()
+    allocated = 0
+    for pkts in msgs:
+        for datagram in pkts:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            path.packet(datagram)
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        path.finish()
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    blocks = 0
+    for pkts in msgs:
+        for datagram in pkts:
+            before = sys.getallocatedblocks()
+            path.packet(datagram)
+            blocks += sys.getallocatedblocks() - before
+        path.finish()
+    elapsed = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for pkts in msgs:
+            for datagram in pkts:
+                path.packet(datagram)
+            path.finish()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print("%-22s %10.0f bytes/pkt %6.2f blocks/pkt %8.2f us/pkt" %
+          (name, allocated / num_pkts, blocks / num_pkts, elapsed / num_pkts * 1e6))
+
+
+if __name__ == "__main__":
+    text_msgs = make_datagrams(binary=False)
+    binary_msgs = make_datagrams(binary=True)
+    small_msgs = make_datagrams(binary=False, msg_len=SMALL_MSG_LEN)
+    measure("before (text)", text_msgs, Before())
+    measure("after (text)", text_msgs, After())
+    measure("after (binary)", binary_msgs, After())
+    measure("before (small text)", small_msgs, Before())
+    measure("after (small text)", small_msgs, After())
@@ -0,0 +1,77 @@
+'''
+Benchmark of the user registry of the Server.
+Run from the repository root: python3 -m benchmarks.registry [NUM_USERS]
+
+Joins NUM_USERS users (50k by default), looks every one of them up by address and by name,
+lists them and disconnects them all, timing each step. "before" is the old dict from username
+to address with a scan over every user to find a username, which is too slow to run on all
+users, so it is only timed on SCAN_LOOKUPS addresses and reported per lookup.
+'''
+import random
+import sys
+import time
+import registry
+
+SCAN_LOOKUPS = 200
+
+
+def scan_username(usernames, client_address):
+    '''
+    The old Server.get_username
+    '''
+    for username in usernames.keys():
+        address, port = usernames[username]
+        if address == client_address[0] and port == client_address[1]:
+            return username
+    return ""
+
+
+def timed(label, num_ops, step):
+    '''
+    Run step() and print how long it took in total and per operation
+    '''
+    start = time.perf_counter()
+    step()
+    elapsed = time.perf_counter() - start
+    print("%-24s %10.3f s %10.2f us/op" % (label, elapsed, elapsed / num_ops * 1e6))
+
+
+if __name__ == "__main__":
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    users = [("user%d" % idx, ("127.0.0.%d" % (1 + idx // 60000), 1024 + idx % 60000))
+             for idx in range(num_users)]
+    random.shuffle(users)
+    reg = registry.Registry(capacity=num_users)
+
+    def join():
+        for name, address in users:
+            assert reg.join(name, address) == registry.JOINED
+
+    def lookup_address():
+        for name, address in users:
+            assert reg.name_of(address) == name
+
+    def lookup_name():
+        for name, address in users:
+            assert reg.address_of(name) == address
+
+    def disconnect():
+        for name, _ in users:
+            assert reg.remove(name)
+
+    old = dict(users)
+    sample = random.sample(users, min(SCAN_LOOKUPS, num_users))
+
+    def scan():
+        for name, address in sample:
+            assert scan_username(old, address) == name
+
+    print("%d users" % num_users)
+    timed("join", num_users, join)
+    timed("name_of", num_users, lookup_address)
+    timed("address_of", num_users, lookup_name)
+    timed("usernames", 1, reg.usernames)
+    assert reg.join("overflow", ("127.0.0.254", 1)) == registry.FULL
+    timed("remove", num_users, disconnect)
+    assert len(reg) == 0
+    timed("before: get_username", len(sample), scan)
@@ -0,0 +1,105 @@
+'''
+Benchmark of the CPU time a server spends with its clients behind relays against talking to them directly.
+Run from the repository root: python3 -m benchmarks.relay [NUM_CLIENTS] [NUM_MSGS]
+
+A server_2 server is started on a free loopback port, and either nothing or 2 and 4 relay processes
+in front of it. NUM_CLIENTS (16 by default) client processes join, directly or through the relays round
+robin, and once all of them are in, each sends NUM_MSGS (100 by default) send_message commands to the
+next client, one after the other like Client.send_packet does. Reported is the CPU time the server
+process used from then on, per forward, along with the rate at which forwards reached their recipients.
+The relays and clients share the cores with the server, so only the CPU time says what a server saves.
+'''
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import relay
+import server_2
+import util
+from benchmarks.coalesce import endpoint
+from benchmarks.workers import free_port
+
+RELAYS = [0, 2, 4]
+
+
+def serve(port, relay_ports, go, stop, results):
+    '''
+    Body of the server process, puts the CPU seconds it used between go and stop on results
+    '''
+    sys.stdout = open(os.devnull, "w")
+    server = server_2.Server("127.0.0.1", port, 3, capacity=1000,
+                             relays=[("127.0.0.1", relay_port) for relay_port in relay_ports])
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    go.wait()
+    start = time.process_time()
+    stop.wait()
+    results.put(time.process_time() - start)
+
+
+def run_relay(port, upstream):
+    '''
+    Body of a relay process
+    '''
+    relay.Relay("127.0.0.1", port, ("127.0.0.1", upstream), 3).start()
+
+
+def client(idx, port, num_clients, num_msgs, ready, go, results):
+    '''
+    Body of a client process, puts the seconds it took to send its messages and receive as many on results
+    '''
+    ep = endpoint(0)
+    address = ("127.0.0.1", port)
+    ep.send_packet(util.make_message("join", 1, "user%d" % idx), address).done.wait()
+    ready.put(idx)
+    go.wait()
+    msg = util.make_message("send_message", 4, "1 user%d hello there" % ((idx + 1) % num_clients))
+    start = time.perf_counter()
+    for _ in range(num_msgs):
+        ep.send_packet(msg, address).done.wait()
+    for _ in range(num_msgs):
+        ep.queue.get(timeout=120)
+    results.put(time.perf_counter() - start)
+
+
+def run(num_relays, num_clients, num_msgs):
+    '''
+    Returns (server CPU ms per forward, forwards delivered per second) with num_relays relays
+    '''
+    port = free_port()
+    ready, results, go, stop = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Event()
+    cpu = multiprocessing.Queue()
+    relay_ports = [free_port() for _ in range(num_relays)]
+    server = multiprocessing.Process(target=serve, args=(port, relay_ports, go, stop, cpu))
+    server.start()
+    relays = [multiprocessing.Process(target=run_relay, args=(relay_port, port)) for relay_port in relay_ports]
+    for process in relays:
+        process.start()
+    time.sleep(1)  # Let everyone bind
+    ports = relay_ports or [port]
+    clients = [multiprocessing.Process(target=client, args=(
+        idx, ports[idx % len(ports)], num_clients, num_msgs, ready, go, results)) for idx in range(num_clients)]
+    for process in clients:
+        process.start()
+    for _ in clients:
+        ready.get(timeout=60)
+    go.set()
+    elapsed = max(results.get(timeout=300) for _ in clients)
+    stop.set()
+    used = cpu.get(timeout=60)
+    for process in clients + relays + [server]:
+        process.terminate()
+        process.join()
+    return used / (num_clients * num_msgs) * 1000, num_clients * num_msgs / elapsed
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    num_msgs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print("%d clients, %d messages each, %d cores" % (num_clients, num_msgs, os.cpu_count()))
+    print("%10s %18s %12s" % ("relays", "server CPU ms/fwd", "forwards/s"))
+    for num_relays in RELAYS:
+        cpu_ms, rate = run(num_relays, num_clients, num_msgs)
+        print("%10d %18.3f %12.0f" % (num_relays, cpu_ms, rate))
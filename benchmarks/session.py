@@ -0,0 +1,57 @@
+'''
+Benchmark of sending messages over a session against a START/END handshake per message.
+Run from the repository root: python3 -m benchmarks.session [NUM_MSGS]
+
+A client endpoint sends NUM_MSGS (50 by default) send_message commands of MSG_LEN characters to a
+server endpoint over loopback, every datagram held back for DELAY ms on the way to emulate a link.
+"one by one" waits for each message before sending the next, like Client.send_packet does, and
+"pipelined" sends them all and then waits for the last one. Without a session every message is
+its own transfer, with one (-n) the first message opens the session and all of them share it.
+'''
+import sys
+import time
+import transport
+import util
+from benchmarks.coalesce import endpoint
+
+DELAYS = [0, 5, 20]  # ms added to every datagram, one way
+MSG_LEN = 3000  # Characters, three chunks
+
+
+def run(num_msgs, delay, session, pipelined):
+    '''
+    Send num_msgs messages, returns the mean ms per message
+    '''
+    client = endpoint(delay)
+    client.options = transport.Options(session=session)
+    server = endpoint(delay)
+    address = server.sock.getsockname()
+    msgs = [util.make_message("send_message", 4, "1 bob %d " % idx + "x" * MSG_LEN) for idx in range(num_msgs)]
+    start = time.perf_counter()
+    sent = []
+    for msg in msgs:
+        sent.append(client.send_packet(msg, address))
+        if not pipelined:
+            sent[-1].done.wait()
+    for handle in sent:
+        handle.done.wait()
+        assert not handle.failed
+    elapsed = time.perf_counter() - start
+    received = [server.queue.get(timeout=60)[0] for _ in msgs]
+    if session:  # Pipelined transfers of their own may arrive in any order, a session keeps it
+        assert received == msgs
+    else:
+        assert sorted(received) == sorted(msgs)
+    client.sock.close()
+    server.sock.close()
+    return elapsed / num_msgs * 1000
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print("%d messages of %d characters, ms per message" % (num_msgs, MSG_LEN))
+    print("%10s %14s %14s %14s %14s" % ("delay ms", "one by one", "+ session", "pipelined", "+ session"))
+    for delay in DELAYS:
+        print("%10d %14.2f %14.2f %14.2f %14.2f" % (
+            delay, run(num_msgs, delay / 1000.0, False, False), run(num_msgs, delay / 1000.0, True, False),
+            run(num_msgs, delay / 1000.0, False, True), run(num_msgs, delay / 1000.0, True, True)))
@@ -0,0 +1,53 @@
+'''
+Benchmark of the latency of short control messages with and without single-datagram messages.
+Run from the repository root: python3 -m benchmarks.single_datagram [NUM_MSGS]
+
+A client endpoint sends NUM_MSGS (50 by default) request_users_list messages one after the other to a
+server endpoint over loopback, every datagram held back for DELAY ms on the way to emulate a link,
+and waits for the last ACK of each before sending the next, like Client.send_packet does.
+"three phases" is the plain START, DATA, END exchange, "one packet" offers msg=1 so that, after the
+first message learned the server takes it, every message goes out as a single msg packet.
+'''
+import sys
+import time
+import transport
+import util
+from benchmarks.coalesce import endpoint
+
+DELAYS = [0, 5, 20]  # ms added to every datagram, one way
+
+
+def latency(num_msgs, delay, single):
+    '''
+    Send num_msgs messages one by one, returns (mean ms per message, datagrams sent by both ends)
+    '''
+    client = endpoint(delay)
+    client.options = transport.Options(single=single)
+    server = endpoint(delay)
+    address = server.sock.getsockname()
+    msg = util.make_message("request_users_list", 2)
+    client.send_packet(msg, address).done.wait()  # First contact, which learns what the server takes
+    server.queue.get(timeout=60)
+    client.sock.sent = server.sock.sent = 0
+    start = time.perf_counter()
+    for _ in range(num_msgs):
+        transfer = client.send_packet(msg, address)
+        transfer.done.wait()
+        assert not transfer.failed and transfer.single == single
+    elapsed = time.perf_counter() - start
+    for _ in range(num_msgs):
+        assert server.queue.get(timeout=60)[0] == msg
+    sent = client.sock.sent + server.sock.sent
+    client.sock.close()
+    server.sock.close()
+    return elapsed / num_msgs * 1000, sent
+
+
+if __name__ == "__main__":
+    num_msgs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print("%d messages" % num_msgs)
+    print("%10s %16s %10s %16s %10s" % ("delay ms", "three phases ms", "datagrams", "one packet ms", "datagrams"))
+    for delay in DELAYS:
+        plain, plain_sent = latency(num_msgs, delay / 1000.0, False)
+        single, single_sent = latency(num_msgs, delay / 1000.0, True)
+        print("%10d %16.2f %10d %16.2f %10d" % (delay, plain, plain_sent, single, single_sent))
@@ -0,0 +1,88 @@
+'''
+Benchmark of server throughput against the number of worker processes.
+Run from the repository root: python3 -m benchmarks.workers [NUM_CLIENTS] [NUM_MSGS]
+
+A server_2 server is started with 1, 2 and 4 workers (-j) on a free loopback port. NUM_CLIENTS
+(8 by default) client processes join it, and once all of them are in, each sends NUM_MSGS (200 by
+default) send_message commands to the next client, one after the other like Client.send_packet does.
+Since the kernel spreads the clients over the workers, most forwards cross from one worker to another.
+Reported is the rate at which forwards reached their recipients. Workers only add throughput with
+as many free cores, and the clients need cores of their own too.
+'''
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import server_2
+import util
+from benchmarks.coalesce import endpoint
+
+WORKERS = [1, 2, 4]
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def serve(num_workers, port):
+    '''
+    Body of the server process, keeps its output off the terminal
+    '''
+    sys.stdout = open(os.devnull, "w")
+    server_2.serve_workers(num_workers, "127.0.0.1", port, 3, capacity=1000)
+
+
+def client(idx, port, num_clients, num_msgs, ready, go, results):
+    '''
+    Body of a client process, puts the seconds it took to send its messages and receive as many on results
+    '''
+    ep = endpoint(0)
+    address = ("127.0.0.1", port)
+    ep.send_packet(util.make_message("join", 1, "user%d" % idx), address).done.wait()
+    ready.put(idx)
+    go.wait()
+    msg = util.make_message("send_message", 4, "1 user%d hello there" % ((idx + 1) % num_clients))
+    start = time.perf_counter()
+    for _ in range(num_msgs):
+        ep.send_packet(msg, address).done.wait()
+    for _ in range(num_msgs):
+        ep.queue.get(timeout=120)
+    results.put(time.perf_counter() - start)
+
+
+def run(num_workers, num_clients, num_msgs):
+    '''
+    Returns the forwards delivered per second with num_workers workers
+    '''
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(num_workers, port))
+    server.start()
+    time.sleep(1)  # Let every worker bind
+    ready, results, go = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+    clients = [multiprocessing.Process(target=client, args=(idx, port, num_clients, num_msgs, ready, go, results))
+               for idx in range(num_clients)]
+    for process in clients:
+        process.start()
+    for _ in clients:
+        ready.get(timeout=60)
+    go.set()
+    elapsed = max(results.get(timeout=300) for _ in clients)
+    for process in clients:
+        process.join()
+    server.terminate()
+    server.join()
+    return num_clients * num_msgs / elapsed
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_msgs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print("%d clients, %d messages each, %d cores" % (num_clients, num_msgs, os.cpu_count()))
+    print("%10s %12s" % ("workers", "forwards/s"))
+    for num_workers in WORKERS:
+        print("%10d %12.0f" % (num_workers, run(num_workers, num_clients, num_msgs)))
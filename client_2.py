@@ -6,13 +6,17 @@ import getopt
 import socket
 import random
 from threading import Thread
-import threading
 import os
 import util
 import time
 import logging
+import logconfig
 import random
-import queue
+import transport
+
+# Message types counted on their own when dispatched, any other counts as unknown
+MESSAGE_TYPES = {"response_users_list", "forward_message", "err_unknown_message", "err_server_full",
+                 "err_username_unavailable"}
 
 
 '''
@@ -23,31 +27,25 @@ for incoming messages in this function.
 '''
 
 
-class Client:
+class Client(transport.Endpoint):
     '''
     This is the main Client Class.
     '''
 
-    def __init__(self, username, dest, port, window_size):
+    def __init__(self, username, dest, port, window_size, mode=transport.SELECTIVE_REPEAT, options=None,
+                 ack_delay=0, congestion=transport.RENO, coalesce=0, log=None, ack_every=util.DELAYED_ACK_COUNT):
         self.server_addr = dest
         self.server_port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, util.SOCKET_BUFFER_SIZE)
         self.sock.bind(('', random.randint(10000, 40000)))
         self.username = username
-        self.window_size = window_size
         self.logger = logging.getLogger(__name__)
-        logging.basicConfig(filename='./logs/client_' + str(username) +
-                            '.log', encoding='utf-8', level=logging.DEBUG)
-        self.recv_pkts = dict()  # Mappings from seqno to pkts
-        self.pkt_types = dict()  # Mappings from seqno to pkt type
-        self.recv_starts = dict()  # Mappings from seqno to pkts
-        self.recv_ends = dict()  # Mappings from seqno to pkts
-        self.sent_pkts = dict()  # Mappings from seqno to pkts
-        self.recv_acks = set()
-        self.completed_pkts = set()
-        self.mutex = threading.Lock()
-        self.queue = queue.Queue()
+        logconfig.setup(self.logger, './logs/client_' + str(username) + '.log', log)
+        transport.Endpoint.__init__(
+            self, self.sock, self.logger, window_size, mode, options, ack_delay, congestion, coalesce, ack_every)
+        self.last_batch = None  # Batch of the last message queued when coalescing
+        self.dispatched = self.metrics.counter("messages_dispatched", labeled=True)  # By type
 
     def start(self):
         '''
@@ -76,6 +74,9 @@ class Client:
                 self.logger.debug('[INPUT_MSG]: List')
                 list_msg = util.make_message("request_users_list", 2)
                 self.send_packet(msg=list_msg)
+            elif cmd == "stats":
+                self.logger.debug('[INPUT_MSG]: Stats')
+                print("stats: " + self.metrics.to_json())
             elif cmd == "help":
                 self.logger.debug('[INPUT_MSG]: Help')
                 self.print_help()
@@ -117,6 +118,7 @@ class Client:
                 self.logger.debug('[RECV_MSG]: packet')
                 self.logger.debug(segments)
                 msg = segments # Split the message into individual strings
+                self.dispatched.inc(msg[0] if msg[0] in MESSAGE_TYPES else "unknown")
                 if msg[0] == "response_users_list":
                     self.logger.debug('[RECV_MSG]: response_users_list')
                     sent_message_whole = segments
@@ -151,160 +153,15 @@ class Client:
 
     def send_packet(self, msg):
         '''
-        Send a packet and wait for the appropriate ACKs
-        '''
-        chunks = [] # Split up message into chunks
-        for i in range(0, len(msg), util.CHUNK_SIZE):
-            chunks.append(msg[i:min(i+util.CHUNK_SIZE, len(msg))])
-        starting_seq_num = random.randint(10000, 10000000) # Choose random seq_no
-        pkts_sent = 0 # Keep track of packets sent
-        # Create START packet and wait for ACK
-        start_pkt = util.make_packet(
-            msg_type="start", msg="", seqno=starting_seq_num + pkts_sent)
-        self.sock.sendto(str(start_pkt).encode('utf-8'),
-                         (self.server_addr, self.server_port))
-        time.sleep(0.05)
-        # While ACK has not arrived, just keep sending in interval
-        while starting_seq_num + pkts_sent + 1 not in self.recv_acks:
-            self.logger.debug('[PKT]: Sending Start Packet')
-            time.sleep(0.5)
-            self.sock.sendto(str(start_pkt).encode('utf-8'),
-                             (self.server_addr, self.server_port))
-        pkts_sent += 1
-        seqs = [] # Keep track of seq_no's that we are expecting
-        self.mutex.acquire()
-        # For every chunk, send a packet
-        for _, chunk in enumerate(chunks):
-            data_pkt = util.make_packet(msg_type="data",
-                                        msg=chunk, seqno=starting_seq_num + pkts_sent)
-            self.sent_pkts.update({starting_seq_num + pkts_sent: data_pkt})
-            self.sock.sendto(str(data_pkt).encode('utf-8'),
-                             (self.server_addr, self.server_port))
-            seqs.append(starting_seq_num + pkts_sent + 1) # Keep track of expected ACKs
-            pkts_sent += 1
-        self.mutex.release()
-        all_found = False
-        self.logger.debug('[PKT]: Starting to check that all ACKs arrived')
-        time.sleep(0.05)
-        # Check if we got all the ACKS
-        while all_found == False:
-            self.logger.debug('[PKT]: Checking that all ACKS arrived')
-            all_found = True
-            for seq in seqs: # Go through all the ACKs that we are expecting
-                if seq not in self.recv_acks:
-                    all_found = False # If we don't find all the ACKs, we need to resend
-                    self.logger.debug(
-                        '[PKT]: ACK Not Arrived: ' + str(seq - 1))
-                    data_pkt = self.sent_pkts[seq - 1]
-                    self.sock.sendto(str(data_pkt).encode('utf-8'),
-                                     (self.server_addr, self.server_port))
-            if all_found == False:
-                time.sleep(0.5) # Sleep interval
-        # Create and send the END packet
-        end_pkt = util.make_packet(msg_type="end",
-                                   msg="", seqno=starting_seq_num + pkts_sent)
-        self.logger.debug('[PKT]: Starting to send END PKT')
-        self.sock.sendto(str(end_pkt).encode('utf-8'),
-                         (self.server_addr, self.server_port))
-        time.sleep(0.05)
-        # If we don't get the packet, we should resend it 
-        while starting_seq_num + pkts_sent + 1 not in self.recv_acks:
-            self.sock.sendto(str(end_pkt).encode('utf-8'),
-                             (self.server_addr, self.server_port))
-            time.sleep(0.5)
-            self.logger.debug('[PKT]: Sending END PKT')
-
-    def recv_packet(self):
-        '''
-        Handle all incoming packets, will combine them and send to packet handler when the END packet has arrived
+        Send a msg to the server and wait until its last ACK came back.
+        When coalescing, the msg is only queued and goes out with whatever else comes along shortly.
         '''
-        self.logger.debug('[PKT]: Starting to read in packets')
-        while True:
-            # Maybe use client address instead of seq_no's
-            data, client_address = self.sock.recvfrom(2048)
-            self.logger.debug('[PKT]: Received a packet')
-            decoded_msg = data.decode('utf-8')
-            msg_type, seq_no, data, checksum = util.parse_packet(decoded_msg)
-            seq_no = int(seq_no)
-            # Check the checksum
-            # Want to track each packet that arrived, the packet type and send an ACK for START and DATA packets
-            if util.validate_checksum(decoded_msg):
-                self.logger.debug('[PKT]: Valid Packet Received')
-                if msg_type == "start":
-                    self.logger.debug('[PKT]: Start Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    self.pkt_types.update({seq_no: "start"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    self.send_ack(seq_no + 1) # Send an ACK for what we recieved
-                elif msg_type == "data":
-                    self.logger.debug('[PKT]: Data Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    self.pkt_types.update({seq_no: "data"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    self.send_ack(seq_no + 1) # Send an ACK for what we recieved
-                elif msg_type == "end":
-                    self.logger.debug('[PKT]: End Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    self.pkt_types.update({seq_no: "end"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    current_msg = self.get_msg_from_seqs(seq_no) # Try and reconstruct our message
-                    if current_msg == "": # If here, that means we didn't get a complete message, some packets are missing
-                        continue
-                    self.logger.debug('[PKT]: Concatenated MSG together')
-                    self.send_ack(seq_no + 1) # Send an ACK for what we recieved
-                    self.mutex.acquire()
-                    self.queue.put(
-                        (str(current_msg), client_address)) # Otherwise, put the compelte message into queue
-                    self.mutex.release()
-                    self.logger.debug(
-                        "[PKT]: Completed message, " + str(current_msg))
-                elif msg_type == "ack":
-                    self.logger.debug('[PKT]: Received ACK' + str(seq_no))
-                    self.mutex.acquire()
-                    self.recv_acks.add(seq_no) # Want to track the ACKS that we have sent
-                    self.mutex.release()
-
-    def get_msg_from_seqs(self, seq_no):
-        '''
-        From the sequence number of the ACK, reconstruct the data 
-        '''
-        current_msg = "" # Reconstructed string from the message
-        curr_seq = seq_no # Out current sequence number
-        self.mutex.acquire()
-        # Will go until missing packet or START packet
-        while curr_seq in self.pkt_types.keys(): # Starting FROM END packet SEQ_NO combine the data section
-            self.logger.debug('[MSG_FROM_SEQS]: Looking for' + str(curr_seq))
-            current_msg = self.recv_pkts[curr_seq] + current_msg
-            if self.pkt_types[curr_seq] == "start": # Break if we are at the start packet
-                break
-            curr_seq -= 1
-        # If we don't land on the START packet, we are missing some packets
-        if curr_seq not in self.pkt_types or self.pkt_types[curr_seq] != "start":
-            self.logger.debug('[MSG_FROM_SEQS]: Hmm... missing packets')
-            self.mutex.release()
-            return ""
-        # If we have already put the same packet in the queueu, don't do it again
-        if curr_seq in self.completed_pkts:
-            self.logger.debug(
-                '[MSG_FROM_SEQS]: Already have processed this completed packet, will not send upward')
-            self.mutex.release()
-            return ""
-        # Keep track of our competed packets
-        self.completed_pkts.add(curr_seq)
-        self.mutex.release()
-        return current_msg
-
-    def send_ack(self, seqno):
-        '''
-        Send an ACK, given a sequence number
-        '''
-        ack_pkt = util.make_packet(msg_type="ack",
-                                   msg="", seqno=seqno)
-        self.sock.sendto(str(ack_pkt).encode('utf-8'),
-                         (self.server_addr, self.server_port))
+        if self.coalescer is not None:
+            self.last_batch = self.queue_message(msg, (self.server_addr, self.server_port))
+            return
+        transfer = transport.Endpoint.send_packet(
+            self, msg, (self.server_addr, self.server_port))
+        transfer.done.wait()
 
     def exit_client(self):
         '''
@@ -312,6 +169,9 @@ class Client:
         '''
         disconnect_msg = util.make_message("disconnect", 1, self.username)
         self.send_packet(msg=disconnect_msg)
+        if self.last_batch is not None:  # Everything queued before the disconnect goes out ahead of it
+            self.last_batch.done.wait()
+        self.close_session((self.server_addr, self.server_port))
         self.logger.debug(
             "[SERVER]: Just sent disconnect packet, will it make it")
         time.sleep(0.5) # Wait slightly to avoid some timing issues
@@ -327,6 +187,19 @@ class Client:
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
         print("-w WINDOW_SIZE | --window=WINDOW_SIZE The window_size, defaults to 3")
+        print("-m MODE | --mode=MODE The window mode, gbn or sr, defaults to sr")
+        print("-b | --binary Offer the binary packet format when sending")
+        print("-k SUM | --checksum=SUM The checksum to offer for binary packets, " + ", ".join(util.CHECKSUMS) + ", default is crc32")
+        print("-s | --sack Offer cumulative and selective ACKs when sending")
+        print("-o | --one Offer single-datagram messages when sending")
+        print("-n | --session Send everything to a peer over one session, set up by a single START")
+        print("-z LEVEL | --compress=LEVEL Offer zlib compression of large messages at LEVEL, 1 (fast) to 9, default is off")
+        print("-x SIZE | --datagram=SIZE Offer packets of up to SIZE payload bytes, auto for the largest on loopback, default is 1400")
+        print("-d DELAY | --delay=DELAY Hold in-order SACK ACKs back for up to DELAY ms, default is 0")
+        print("-y COUNT | --every=COUNT Send held back ACKs at the latest with the COUNT-th packet owed one, default is %d" % util.DELAYED_ACK_COUNT)
+        print("-g CC | --congestion=CC The congestion control, reno, cubic or none, default is reno")
+        print("-c DELAY | --coalesce=DELAY Send messages issued within DELAY ms together, default is 0")
+        print("-l SPEC | --log=SPEC How to log, e.g. async,info,packet=warning,sample=100, default is debug")
         print("-h | --help Print this help")
 
 
@@ -341,10 +214,23 @@ if __name__ == "__main__":
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
         print("-w WINDOW_SIZE | --window=WINDOW_SIZE The window_size, defaults to 3")
+        print("-m MODE | --mode=MODE The window mode, gbn or sr, defaults to sr")
+        print("-b | --binary Offer the binary packet format when sending")
+        print("-k SUM | --checksum=SUM The checksum to offer for binary packets, " + ", ".join(util.CHECKSUMS) + ", default is crc32")
+        print("-s | --sack Offer cumulative and selective ACKs when sending")
+        print("-o | --one Offer single-datagram messages when sending")
+        print("-n | --session Send everything to a peer over one session, set up by a single START")
+        print("-z LEVEL | --compress=LEVEL Offer zlib compression of large messages at LEVEL, 1 (fast) to 9, default is off")
+        print("-x SIZE | --datagram=SIZE Offer packets of up to SIZE payload bytes, auto for the largest on loopback, default is 1400")
+        print("-d DELAY | --delay=DELAY Hold in-order SACK ACKs back for up to DELAY ms, default is 0")
+        print("-y COUNT | --every=COUNT Send held back ACKs at the latest with the COUNT-th packet owed one, default is %d" % util.DELAYED_ACK_COUNT)
+        print("-g CC | --congestion=CC The congestion control, reno, cubic or none, default is reno")
+        print("-c DELAY | --coalesce=DELAY Send messages issued within DELAY ms together, default is 0")
+        print("-l SPEC | --log=SPEC How to log, e.g. async,info,packet=warning,sample=100, default is debug")
         print("-h | --help Print this help")
     try:
         OPTS, ARGS = getopt.getopt(sys.argv[1:],
-                                   "u:p:a:w", ["user=", "port=", "address=", "window="])
+                                   "u:p:a:w:m:bk:sonz:x:d:y:g:c:l:", ["user=", "port=", "address=", "window=", "mode=", "binary", "checksum=", "sack", "one", "session", "compress=", "datagram=", "delay=", "every=", "congestion=", "coalesce=", "log="])
     except getopt.error:
         helper()
         exit(1)
@@ -353,22 +239,63 @@ if __name__ == "__main__":
     DEST = "localhost"
     USER_NAME = None
     WINDOW_SIZE = 3
+    MODE = transport.SELECTIVE_REPEAT
+    OPTIONS = transport.Options()
+    DELAY = 0
+    ACK_EVERY = util.DELAYED_ACK_COUNT
+    CONGESTION = transport.RENO
+    COALESCE = 0
+    LOG = logconfig.LogConfig()
     for o, a in OPTS:
-        if o in ("-u", "--user="):
+        if o in ("-u", "--user"):
             USER_NAME = a
-        elif o in ("-p", "--port="):
+        elif o in ("-p", "--port"):
             PORT = int(a)
-        elif o in ("-a", "--address="):
+        elif o in ("-a", "--address"):
             DEST = a
-        elif o in ("-w", "--window="):
-            WINDOW_SIZE = a
+        elif o in ("-w", "--window"):
+            WINDOW_SIZE = int(a)
+        elif o in ("-m", "--mode"):
+            MODE = a
+        elif o in ("-b", "--binary"):
+            OPTIONS.binary = True
+        elif o in ("-k", "--checksum"):
+            OPTIONS.checksum = a
+        elif o in ("-s", "--sack"):
+            OPTIONS.sack = True
+        elif o in ("-o", "--one"):
+            OPTIONS.single = True
+        elif o in ("-n", "--session"):
+            OPTIONS.session = True
+        elif o in ("-z", "--compress"):
+            OPTIONS.compress = int(a)
+        elif o in ("-x", "--datagram"):
+            OPTIONS.datagram = a if a == transport.AUTO_DATAGRAM else int(a)
+        elif o in ("-d", "--delay"):
+            DELAY = int(a)
+        elif o in ("-y", "--every"):
+            ACK_EVERY = int(a)
+        elif o in ("-g", "--congestion"):
+            CONGESTION = a
+        elif o in ("-c", "--coalesce"):
+            COALESCE = int(a)
+        elif o in ("-l", "--log"):
+            LOG = logconfig.parse(a)
 
     if USER_NAME is None:
         print("Missing Username.")
         helper()
         exit(1)
 
-    S = Client(USER_NAME, DEST, PORT, WINDOW_SIZE)
+    if MODE not in transport.WINDOW_MODES or CONGESTION not in transport.CONGESTION_CONTROLS or \
+            OPTIONS.checksum not in util.CHECKSUMS or not 0 <= OPTIONS.compress <= 9 or \
+            OPTIONS.datagram != transport.AUTO_DATAGRAM and not 0 <= OPTIONS.datagram <= util.MAX_CHUNK_SIZE or \
+            LOG is None or ACK_EVERY < 1:
+        helper()
+        exit(1)
+
+    S = Client(USER_NAME, DEST, PORT, WINDOW_SIZE, MODE, OPTIONS, DELAY / 1000.0, CONGESTION,
+               COALESCE / 1000.0, LOG, ACK_EVERY)
     try:
         # Start receiving Messages
         T = Thread(target=S.receive_handler)
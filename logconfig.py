@@ -0,0 +1,144 @@
+'''
+This module sets up where the log records of a Server, Client or Relay go, and how many of them
+'''
+import atexit
+import logging
+import logging.handlers
+import queue
+import signal
+import threading
+
+APP = "app"  # The Server, Client or Relay itself
+TRANSPORT = "transport"  # Flows, transfers and sessions of the Endpoint
+PACKET = "packet"  # Every single packet the Endpoint sends or receives
+SUBSYSTEMS = [APP, TRANSPORT, PACKET]
+BACKGROUND = "async"  # Write the records from a thread of their own
+LEVELS = ["debug", "info", "warning", "error", "critical"]
+
+
+class LogConfig:
+    '''
+    How to log. By default every record of every subsystem is written right away, as basicConfig did.
+    '''
+
+    def __init__(self, background=False, level="debug", levels=None, sample=1):
+        self.background = background  # Hand records to a QueueListener thread that does the file I/O
+        self.level = level  # Level of every subsystem without one of its own
+        self.levels = levels if levels is not None else dict()  # Mappings from subsystem to its level
+        self.sample = sample  # Keep only one in this many records of the packet subsystem
+
+    def level_of(self, subsystem):
+        return getattr(logging, self.levels.get(subsystem, self.level).upper())
+
+
+def parse(spec):
+    '''
+    LogConfig of a comma-separated spec such as "async,info,packet=warning,sample=100", None if it is invalid
+    '''
+    config = LogConfig()
+    for item in spec.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == BACKGROUND and not value:
+            config.background = True
+        elif key in LEVELS and not value:
+            config.level = key
+        elif key in SUBSYSTEMS and value in LEVELS:
+            config.levels[key] = value
+        elif key == "sample" and value.isdigit() and int(value) > 0:
+            config.sample = int(value)
+        else:
+            return None
+    return config
+
+
+class Sampler(logging.LoggerAdapter):
+    '''
+    The logger of the packet subsystem, which lets one in every `every` records through, the first one
+    included. The others are dropped before a record is even made, which is where most of their cost goes.
+    '''
+
+    def __init__(self, logger, every=1):
+        logging.LoggerAdapter.__init__(self, logger, None)
+        self.every = every
+        self.count = 0
+
+    def isEnabledFor(self, level):
+        if not self.logger.isEnabledFor(level):
+            return False
+        if self.every == 1:
+            return True
+        self.count += 1
+        return self.count % self.every == 1
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+
+SAMPLERS = dict()  # Mappings from logger name to the Sampler of that packet subsystem
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Puts records on the queue as they are, so the message is only formatted with its arguments
+    by the listener thread. The arguments must not change afterwards, ours are numbers, strings and tuples.
+    '''
+
+    def prepare(self, record):
+        return record
+
+
+def transport_logger(logger):
+    '''
+    Logger of the transport subsystem of an app logger
+    '''
+    return logger.getChild(TRANSPORT)
+
+
+def packet_logger(logger):
+    '''
+    Sampler of the packet subsystem of an app logger, the same one every time
+    '''
+    packets = transport_logger(logger).getChild(PACKET)
+    return SAMPLERS.setdefault(packets.name, Sampler(packets))
+
+
+def apply_levels(logger, config):
+    '''
+    Set the level of every subsystem of an app logger, and the sampling of its packets.
+    A subsystem at the level of the one above it is left NOTSET, so that setting the level of the app
+    logger later on still sets the whole tree, as it did before there were subsystems.
+    '''
+    sampler = packet_logger(logger)
+    logger.setLevel(config.level_of(APP))
+    for parent, subsystem, sub_logger in ((APP, TRANSPORT, transport_logger(logger)), (TRANSPORT, PACKET, sampler.logger)):
+        level = config.level_of(subsystem)
+        sub_logger.setLevel(level if level != config.level_of(parent) else logging.NOTSET)
+    sampler.every = config.sample
+
+
+def setup(logger, filename, config=None):
+    '''
+    Log the records of an app logger, along with those of its Endpoint, to filename as config says.
+    Only the first call in a process sets up the file, like basicConfig. SIGUSR1 turns every subsystem
+    up to DEBUG without sampling at runtime, and SIGUSR2 back to config.
+    Returns the QueueListener it started, if it did.
+    '''
+    config = config if config is not None else LogConfig()
+    root = logging.getLogger()
+    listener = None
+    if not root.handlers:
+        handler = logging.FileHandler(filename, encoding='utf-8')
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        if config.background:
+            records = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(records, handler)
+            listener.start()
+            atexit.register(listener.stop)  # Write out what is still queued
+            handler = LazyQueueHandler(records)
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+    apply_levels(logger, config)
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: apply_levels(logger, LogConfig()))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: apply_levels(logger, config))
+    return listener
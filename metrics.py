@@ -0,0 +1,144 @@
+'''
+This module keeps the metrics of a Server, Client or Relay and serves them as JSON
+'''
+import bisect
+import json
+import os
+import socket
+import threading
+import time
+
+
+class Counter:
+    '''
+    A count that only goes up, in total and, if labeled, per label such as the packet type.
+    Increments never take a lock, two threads counting at the very same time may lose one.
+    '''
+
+    def __init__(self, labeled=False):
+        self.labeled = labeled
+        self.total = 0
+        self.by_label = dict()  # Mappings from label to its count
+
+    def inc(self, label=None, n=1):
+        self.total += n
+        if label is not None:
+            self.by_label[label] = self.by_label.get(label, 0) + n
+
+    def get(self, label=None):
+        '''
+        Count of a label, the total without one
+        '''
+        return self.total if label is None else self.by_label.get(label, 0)
+
+    def snapshot(self):
+        if not self.labeled:
+            return self.total
+        counts = dict(self.by_label)
+        counts["total"] = self.total
+        return counts
+
+
+class Histogram:
+    '''
+    How many observed values fell at or below each bucket bound, plus the ones above the last
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)  # Upper bounds in ascending order
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one counts what is above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        counts = dict(("%g" % bound, count) for bound, count in zip(self.buckets, self.counts))
+        counts["inf"] = self.counts[-1]
+        return {"buckets": counts, "count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0}
+
+
+class Metrics:
+    '''
+    The counters, gauges and histograms of one endpoint by name. A gauge is a function
+    read whenever a snapshot is taken, so it costs nothing in between.
+    '''
+
+    def __init__(self):
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+
+    def counter(self, name, labeled=False):
+        '''
+        The Counter called name, created the first time
+        '''
+        return self.counters.setdefault(name, Counter(labeled))
+
+    def gauge(self, name, read):
+        '''
+        Report read() as the gauge called name
+        '''
+        self.gauges[name] = read
+
+    def histogram(self, name, buckets):
+        '''
+        The Histogram called name, created the first time with these bucket bounds
+        '''
+        return self.histograms.setdefault(name, Histogram(buckets))
+
+    def snapshot(self):
+        '''
+        Every metric as a dict that json can take
+        '''
+        return {"time": time.time(),
+                "counters": dict((name, counter.snapshot()) for name, counter in self.counters.items()),
+                "gauges": dict((name, read()) for name, read in self.gauges.items()),
+                "histograms": dict((name, hist.snapshot()) for name, hist in self.histograms.items())}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
+def worker_address(where, worker):
+    '''
+    Where worker of a multi-process server serves its own metrics, the next ports or numbered socket paths
+    '''
+    return str(int(where) + worker) if where.isdigit() else "%s.%d" % (where, worker)
+
+
+def serve(metrics, where):
+    '''
+    Answer every connection to where, a TCP port on localhost or else the path of a UNIX socket, with
+    a snapshot of metrics as one line of JSON. Runs on a thread of its own, returns the listening socket.
+    '''
+    if where.isdigit():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", int(where)))
+    else:
+        if os.path.exists(where):  # Left behind by an earlier run
+            os.unlink(where)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(where)
+    sock.listen()
+
+    def answer():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:  # Closed
+                return
+            try:
+                conn.sendall(metrics.to_json().encode('utf-8') + b"\n")
+            except OSError:
+                pass
+            conn.close()
+    T = threading.Thread(target=answer)
+    T.daemon = True
+    T.start()
+    return sock
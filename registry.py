@@ -0,0 +1,260 @@
+'''
+This module keeps track of the users connected to a Server
+'''
+import bisect
+import sys
+import threading
+from multiprocessing.managers import BaseManager
+import util
+
+JOINED = "joined"
+FULL = "full"
+TAKEN = "taken"
+
+
+class Registry:
+    '''
+    Connected users indexed both ways, from username to address and from address to username,
+    so every lookup is O(1). The names are also kept sorted for the users list.
+    Safe to use from the receive thread and the dispatch loop at the same time.
+    '''
+
+    def __init__(self, capacity=util.MAX_NUM_CLIENTS):
+        self.capacity = int(capacity)
+        self.by_name = dict()  # Mappings from username to address
+        self.by_address = dict()  # Mappings from address to username
+        self.sorted_names = []  # Every username in ascending order
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def join(self, name, address):
+        '''
+        Register a user, returns JOINED, or FULL / TAKEN if the user could not be added
+        '''
+        address = (address[0], address[1])
+        self.lock.acquire()
+        try:
+            if len(self.by_name) >= self.capacity:
+                return FULL
+            if name in self.by_name:
+                return TAKEN
+            self.by_name[name] = address
+            self.by_address[address] = name
+            bisect.insort(self.sorted_names, name)
+            return JOINED
+        finally:
+            self.lock.release()
+
+    def remove(self, name):
+        '''
+        Forget a user, returns False if there was no such user
+        '''
+        self.lock.acquire()
+        try:
+            address = self.by_name.pop(name, None)
+            if address is None:
+                return False
+            if self.by_address.get(address) == name:  # The address may have joined again under another name
+                del self.by_address[address]
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+            return True
+        finally:
+            self.lock.release()
+
+    def address_of(self, name):
+        '''
+        Address of a user, or None
+        '''
+        return self.by_name.get(name)
+
+    def name_of(self, address):
+        '''
+        Username registered from an address, or "" if there is none
+        '''
+        return self.by_address.get((address[0], address[1]), "")
+
+    def usernames(self):
+        '''
+        Every username in ascending order
+        '''
+        self.lock.acquire()
+        names = list(self.sorted_names)
+        self.lock.release()
+        return names
+
+
+class Directory(Registry):
+    '''
+    The Registry of every user of a multi-process server, kept by a coordinator process that the workers
+    call into. It also knows which worker each user is homed on, the one its datagrams reach.
+    '''
+
+    def __init__(self, capacity=util.MAX_NUM_CLIENTS):
+        Registry.__init__(self, capacity)
+        self.homes = dict()  # Mappings from username to the worker it joined through
+
+    def join(self, name, address, worker=0):
+        '''
+        Register a user homed on a worker, returns JOINED, or FULL / TAKEN if the user could not be added
+        '''
+        joined = Registry.join(self, name, address)
+        if joined == JOINED:
+            self.homes[name] = worker
+        return joined
+
+    def remove(self, name):
+        '''
+        Forget a user, returns False if there was no such user
+        '''
+        self.homes.pop(name, None)
+        return Registry.remove(self, name)
+
+    def home_of(self, name):
+        '''
+        Worker a user is homed on, or None
+        '''
+        return self.homes.get(name)
+
+
+class DirectoryManager(BaseManager):
+    '''
+    Runs the coordinator process, manager.Directory(capacity) there returns a proxy that workers share
+    '''
+
+
+DirectoryManager.register("Directory", Directory, exposed=["join", "remove", "home_of", "usernames"])
+
+
+class SharedRegistry:
+    '''
+    What one worker of a multi-process server sees of the Directory, with the same interface as a Registry.
+    The kernel hands every datagram of a client to the same worker, so the users homed here are also kept
+    in a local Registry, and looking up the sender of a message or the address of a local user never
+    leaves the process. Only joins, disconnects, the users list and users homed elsewhere go to the Directory.
+    '''
+
+    def __init__(self, directory, worker):
+        self.directory = directory  # Proxy of the coordinator's Directory
+        self.worker = worker  # Index of this worker
+        self.local = Registry(sys.maxsize)  # Users homed on this worker, the Directory enforces the capacity
+
+    def __len__(self):
+        return len(self.directory.usernames())
+
+    def __contains__(self, name):
+        return self.home_of(name) is not None
+
+    def join(self, name, address):
+        '''
+        Register a user homed on this worker, returns JOINED, or FULL / TAKEN if the user could not be added
+        '''
+        joined = self.directory.join(name, (address[0], address[1]), self.worker)
+        if joined == JOINED:
+            self.local.join(name, address)
+        return joined
+
+    def remove(self, name):
+        '''
+        Forget a user, returns False if there was no such user
+        '''
+        self.local.remove(name)
+        return self.directory.remove(name)
+
+    def address_of(self, name):
+        '''
+        Address of a user homed on this worker, or None
+        '''
+        return self.local.address_of(name)
+
+    def name_of(self, address):
+        '''
+        Username registered from an address homed on this worker, or "" if there is none
+        '''
+        return self.local.name_of(address)
+
+    def home_of(self, name):
+        '''
+        Worker a user is homed on, or None
+        '''
+        if name in self.local:
+            return self.worker
+        return self.directory.home_of(name)
+
+    def usernames(self):
+        '''
+        Every username of every worker in ascending order
+        '''
+        return self.directory.usernames()
+
+
+class RemoteUsers:
+    '''
+    The users homed on the other servers of a federation, from username to the address of its server,
+    with the names kept sorted so that they merge into the users list. Every server tells the others
+    who joined and left it, the trunk to each delivers that in order.
+    '''
+
+    def __init__(self):
+        self.by_name = dict()  # Mappings from username to the server it joined
+        self.sorted_names = []  # Every username in ascending order
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def add(self, name, node):
+        '''
+        Note a user that joined another server
+        '''
+        node = (node[0], node[1])
+        self.lock.acquire()
+        if name not in self.by_name:
+            bisect.insort(self.sorted_names, name)
+        self.by_name[name] = node
+        self.lock.release()
+
+    def remove(self, name, node):
+        '''
+        Forget a user that left another server, unless it is homed on some other one by now
+        '''
+        self.lock.acquire()
+        if self.by_name.get(name) == (node[0], node[1]):
+            del self.by_name[name]
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+        self.lock.release()
+
+    def sync(self, node, names):
+        '''
+        Replace whatever we knew of the users of a server with its full list
+        '''
+        node = (node[0], node[1])
+        self.lock.acquire()
+        for name in [name for name, home in self.by_name.items() if home == node]:
+            del self.by_name[name]
+        for name in names:
+            self.by_name[name] = node
+        self.sorted_names = sorted(self.by_name)
+        self.lock.release()
+
+    def node_of(self, name):
+        '''
+        Address of the server a user is homed on, or None
+        '''
+        return self.by_name.get(name)
+
+    def usernames(self):
+        '''
+        Every username in ascending order
+        '''
+        self.lock.acquire()
+        names = list(self.sorted_names)
+        self.lock.release()
+        return names
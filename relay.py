@@ -0,0 +1,152 @@
+'''
+This module defines an edge relay, which Clients near it talk to in place of the Server
+'''
+import sys
+import getopt
+import socket
+import util
+import logging
+import logconfig
+import threading
+import transport
+
+
+class Relay(transport.Endpoint):
+    '''
+    Takes clients with the usual protocol and puts every message of theirs on one session to the Server,
+    each tagged with the number the client has here. The Server sends what it has for them back over the
+    session to us, once per message with the numbers of every recipient, and the relay hands it to each.
+    The Server then does the retransmissions and ACKs of one peer instead of those of every client.
+    '''
+
+    def __init__(self, dest, port, upstream, window, mode=transport.SELECTIVE_REPEAT, options=None,
+                 ack_delay=0, congestion=transport.RENO, log=None):
+        self.relay_addr = dest
+        self.relay_port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, util.SOCKET_BUFFER_SIZE)
+        self.sock.bind((self.relay_addr, self.relay_port))
+        self.upstream = (socket.gethostbyname(upstream[0]), upstream[1])  # Address of the Server
+        self.ids = dict()  # Mappings from client address to its number
+        self.clients = dict()  # Mappings from number to client address
+        self.next_id = 0
+        self.logger = logging.getLogger(__name__)
+        logconfig.setup(self.logger, './logs/relay.log', log)
+        transport.Endpoint.__init__(
+            self, self.sock, self.logger, window, mode, options, ack_delay, congestion)
+
+    def start(self):
+        '''
+        Main loop, hands every message of a client up and every message of the Server down
+        '''
+        self.logger.debug('Starting Relay')
+        T = threading.Thread(target=self.recv_packet)
+        T.daemon = True
+        T.start()
+        # The Server forgets whoever it had behind us from a previous run
+        self.send_session(transport.Payload(util.make_message("relay_hello", 2)), self.upstream)
+        try:
+            while True:
+                data, client_address = self.queue.get()
+                if (client_address[0], client_address[1]) == self.upstream:
+                    self.handle_upstream(data)
+                else:
+                    self.handle_client(data, client_address)
+        except Exception as e:
+            self.logger.debug("[RELAY]: Ending relay due to exception.")
+            self.logger.debug(e)
+            self.sock.close()
+
+    def handle_client(self, data, client_address):
+        '''
+        Send a message of a client up to the Server, along with its number
+        '''
+        address = (client_address[0], client_address[1])
+        client_id = self.ids.get(address)
+        if client_id is None:
+            client_id = self.next_id
+            self.next_id += 1
+            self.ids[address] = client_id
+            self.clients[client_id] = address
+        msg = util.make_message("relay_message", 4, "%d %s" % (client_id, data))
+        self.send_session(transport.Payload(msg), self.upstream)
+        if data.split(" ", 1)[0] == "disconnect":  # The Server learns it from the message itself
+            del self.ids[address]
+            del self.clients[client_id]
+            self.close_session(address)
+
+    def handle_upstream(self, data):
+        '''
+        Send a message of the Server down to every client it names
+        '''
+        msg = data.split()
+        if msg[0] != "relay_forward":
+            self.logger.debug('[RELAY]: Unknown message from the server')
+            return
+        num_ids = int(msg[2])
+        # Encoded and cut once, however many clients it goes to
+        forward = transport.Payload(data.split(" ", 3 + num_ids)[-1])
+        for client_id in msg[3: 3 + num_ids]:
+            address = self.clients.get(int(client_id))
+            if address is None:
+                self.logger.debug('[RELAY]: Client left, %s', client_id)
+            else:
+                self.send_packet(forward, address)
+
+
+if __name__ == "__main__":
+    def helper():
+        '''
+        This function is just for the sake of our module completion
+        '''
+        print("Relay")
+        print("-p PORT | --port=PORT The relay port, defaults to 15001")
+        print("-a ADDRESS | --address=ADDRESS The relay ip or hostname, defaults to localhost")
+        print("-u SERVER | --upstream=SERVER The server as HOST:PORT, defaults to localhost:15000")
+        print("-w WINDOW | --window=WINDOW The window size, default is 3")
+        print("-m MODE | --mode=MODE The window mode, gbn or sr, default is sr")
+        print("-g CC | --congestion=CC The congestion control, reno, cubic or none, default is reno")
+        print("-l SPEC | --log=SPEC How to log, e.g. async,info,packet=warning,sample=100, default is debug")
+        print("-h | --help Print this help")
+
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:],
+                                   "p:a:u:w:m:g:l:", ["port=", "address=", "upstream=", "window=", "mode=", "congestion=", "log="])
+    except getopt.GetoptError:
+        helper()
+        exit()
+
+    PORT = 15001
+    DEST = "localhost"
+    UPSTREAM = ("localhost", 15000)
+    WINDOW = 3
+    MODE = transport.SELECTIVE_REPEAT
+    CONGESTION = transport.RENO
+    LOG = logconfig.LogConfig()
+
+    for o, a in OPTS:
+        if o in ("-p", "--port"):
+            PORT = int(a)
+        elif o in ("-a", "--address"):
+            DEST = a
+        elif o in ("-u", "--upstream"):
+            UPSTREAM = (a.rsplit(":", 1)[0], int(a.rsplit(":", 1)[1]))
+        elif o in ("-w", "--window"):
+            WINDOW = int(a)
+        elif o in ("-m", "--mode"):
+            MODE = a
+        elif o in ("-g", "--congestion"):
+            CONGESTION = a
+        elif o in ("-l", "--log"):
+            LOG = logconfig.parse(a)
+
+    if MODE not in transport.WINDOW_MODES or CONGESTION not in transport.CONGESTION_CONTROLS or LOG is None:
+        helper()
+        exit()
+
+    RELAY = Relay(DEST, PORT, UPSTREAM, WINDOW, MODE, congestion=CONGESTION, log=LOG)
+    try:
+        RELAY.start()
+    except (KeyboardInterrupt, SystemExit):
+        exit()
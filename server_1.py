@@ -5,6 +5,7 @@ import sys
 import getopt
 import socket
 import util
+import registry
 import logging
 import threading
 import time
@@ -15,14 +16,14 @@ class Server:
     '''
     This is the main Server Class. You will  write Server code inside this class.
     '''
-    def __init__(self, dest, port, window):
+    def __init__(self, dest, port, window, capacity=util.MAX_NUM_CLIENTS):
         self.server_addr = dest
         self.server_port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.settimeout(None)
         self.sock.bind((self.server_addr, self.server_port))
-        self.usernames = dict()
+        self.users = registry.Registry(capacity) # Connected users, indexed by name and by address
         self.window = window
         self.logger = logging.getLogger(__name__) # Set up logging to files inside a folder called logs
         logging.basicConfig(filename='./logs/server.log', encoding='utf-8', level=logging.DEBUG)
@@ -54,20 +55,19 @@ class Server:
                         self.logger.debug('[ERROR]: Join messsage has less than 3 items')
                         continue
                     name = msg[2]
-                    if len(self.usernames) == util.MAX_NUM_CLIENTS: # Max client issue
+                    joined = self.users.join(name, client_address)
+                    if joined == registry.FULL: # Max client issue
                         self.logger.debug('[SERVER]: Max clients hit in JOIN')
                         full_serv_msg = util.make_message(msg_type="err_server_full", msg_format=2)
                         pkt = util.make_packet(msg=full_serv_msg)
                         self.sock.sendto(pkt.encode('utf-8'), (client_address[0], client_address[1]))
-                        continue
-                    if name in self.usernames.keys(): # Already existing user
+                    elif joined == registry.TAKEN: # Already existing user
                         self.logger.debug('[SERVER]: Name found in usernames')
                         used_msg = util.make_message(msg_type="err_username_unavailable", msg_format=2)
                         pkt = util.make_packet(msg=used_msg)
                         self.sock.sendto(pkt.encode('utf-8'), (client_address[0], client_address[1]))
                     else: # Otherwise successful
-                        self.logger.debug('Adding this username to list of usernames')
-                        self.usernames.update({name: client_address})
+                        self.logger.debug('Added this username to list of usernames')
                         print("join: " + str(name))
                 elif msg[0] == "request_users_list":
                     self.logger.debug('[MSG]: Request Users List')
@@ -112,6 +112,7 @@ class Server:
         self.logger.debug(recipients) 
         sender = self.get_username(client_address=client_address) # Get username of sender
         print("msg: " + str(sender))
+        pkt = self.make_forward(sender, msg_to_send) # Same packet for everyone, so only built once
         for idx in range(0, num_recipients):
             user = recipients[idx]
             if user in sent_to: # If we already sent to soemone, we don't want to send to them again
@@ -119,53 +120,48 @@ class Server:
                 pass
             else:
                 sent_to.add(user)
-                if user not in self.usernames.keys(): # If this username doesn't exist, print something out
+                if user not in self.users: # If this username doesn't exist, print something out
                     print("msg: " + str(sender) + " to non-existent user " + user)
                 else:
-                    self.send_msg_to_user(user, sender, msg_to_send) # Otherwise everything is good and we send messsage
-    
-    def send_msg_to_user(self, user, sender, msg_to_send):
+                    self.send_msg_to_user(user, pkt) # Otherwise everything is good and we send messsage
+
+    def make_forward(self, sender, msg_to_send):
         '''
-        Send a message to a user
+        Build the forward message packet of a msg, ready to be sent to any number of users
 
         '''
-        address, port = self.usernames[user] # Get the stored address of a user
         msg_content = "1 " + sender + " " + msg_to_send
         send_msg_user = util.make_message(msg_type="forward_message", msg_format=4, message=msg_content)
         pkt = util.make_packet(msg=send_msg_user)
         self.logger.debug(pkt)
+        return pkt.encode('utf-8')
+
+    def send_msg_to_user(self, user, pkt):
+        '''
+        Send a message to a user
+
+        '''
+        address, port = self.users.address_of(user) # Get the stored address of a user
         self.logger.debug(address)
         self.logger.debug(port)
-        self.sock.sendto(pkt.encode('utf-8'), (address, port)) # Sent them the packet
+        self.sock.sendto(pkt, (address, port)) # Sent them the packet
 
     def generate_users(self):
         '''
         Generate the list of users that has connected to the server
         
         '''
-        num_users = len(self.usernames)
-        user_string =  ""
-        for name in sorted(self.usernames.keys()):
-            user_string += name + " "
-        if user_string != "": # If we don't have any users (impossible I think), we shouldn't crash from following statement
-            user_string = user_string[:len(user_string) - 1]
-        user_string = str(num_users) + " " + user_string # Concatenate everything together
-        return user_string
+        names = self.users.usernames() # Already in sorted order
+        return str(len(names)) + " " + " ".join(names) # Concatenate everything together
 
     def handle_disconnect(self, name):
         self.logger.debug("[SERVER]: Handling disconnect for user " + name)
-        if name in self.usernames.keys(): # Don't want to crash from disconnecting unconnected user
-            del self.usernames[name]
-        else: # We should print out a message if there was an error
+        if not self.users.remove(name): # We should print out a message if there was an error
             self.logger.debug("[SERVER]: Error, unable to disconnect this user")
         print("disconnected: " + str(name))
 
     def get_username(self, client_address):
-        for username in self.usernames.keys(): # Go through all of the usernames and see if the address/port matches and return the user
-            address, port = self.usernames[username]
-            if address == client_address[0] and port == client_address[1]:
-                return username
-        return ""
+        return self.users.name_of(client_address) # Indexed by address, no need to go through every user
 
 # Do not change below part of code
 
@@ -178,11 +174,12 @@ if __name__ == "__main__":
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
         print("-w WINDOW | --window=WINDOW The window size, default is 3")
+        print("-c CAPACITY | --capacity=CAPACITY The most clients connected at once, default is 10")
         print("-h | --help Print this help")
 
     try:
         OPTS, ARGS = getopt.getopt(sys.argv[1:],
-                                   "p:a:w", ["port=", "address=","window="])
+                                   "p:a:w:c:", ["port=", "address=", "window=", "capacity="])
     except getopt.GetoptError:
         helper()
         exit()
@@ -190,16 +187,19 @@ if __name__ == "__main__":
     PORT = 15000
     DEST = "localhost"
     WINDOW = 3
+    CAPACITY = util.MAX_NUM_CLIENTS
 
     for o, a in OPTS:
-        if o in ("-p", "--port="):
+        if o in ("-p", "--port"):
             PORT = int(a)
-        elif o in ("-a", "--address="):
+        elif o in ("-a", "--address"):
             DEST = a
-        elif o in ("-w", "--window="):
-            WINDOW = a
+        elif o in ("-w", "--window"):
+            WINDOW = int(a)
+        elif o in ("-c", "--capacity"):
+            CAPACITY = int(a)
 
-    SERVER = Server(DEST, PORT,WINDOW)
+    SERVER = Server(DEST, PORT,WINDOW, CAPACITY)
     try:
         SERVER.start()
     except (KeyboardInterrupt, SystemExit):
@@ -1,43 +1,61 @@
 '''
 This module defines the behaviour of server in your Chat Application
 '''
+import asyncio
+import heapq
+import multiprocessing
+import os
+import signal
 import sys
 import getopt
 import socket
 import util
+import registry
 import logging
+import logconfig
+import metrics
 import threading
-import queue
-import time
-import random
+import transport
 
+# Message types counted on their own when dispatched, any other counts as unknown
+MESSAGE_TYPES = {"join", "request_users_list", "send_message", "disconnect", "relay_message", "relay_hello",
+                 "federation_route", "federation_join", "federation_leave", "federation_hello", "federation_sync"}
 
-class Server:
+
+class Server(transport.Endpoint):
     '''
     This is the main Server Class. You will  write Server code inside this class.
     '''
 
-    def __init__(self, dest, port, window):
+    def __init__(self, dest, port, window, mode=transport.SELECTIVE_REPEAT, options=None,
+                 engine=transport.THREADS, capacity=util.MAX_NUM_CLIENTS, ack_delay=0,
+                 congestion=transport.RENO, users=None, inboxes=None, worker=0, peers=None, relays=None, log=None, stats=None,
+                 ack_every=util.DELAYED_ACK_COUNT):
         self.server_addr = dest
         self.server_port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(None)
+        if inboxes is not None:  # Every worker binds the port, the kernel spreads the clients over them
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, util.SOCKET_BUFFER_SIZE)
         self.sock.bind((self.server_addr, self.server_port))
-        self.usernames = dict()
-        self.window = window
+        self.users = users if users is not None else registry.Registry(capacity)
+        self.engine = engine  # Receive thread or asyncio event loop
+        # Queue of every worker of a multi-process server, each takes the forwards to the users homed on it
+        self.inboxes = inboxes
+        self.worker = worker  # Index of this worker in inboxes
+        # Addresses of the other servers of a federation, what comes from them comes over their trunk
+        self.nodes = set((socket.gethostbyname(host), port) for host, port in peers or [])
+        self.remote = registry.RemoteUsers()  # Users homed on those servers
+        # Addresses of the relays we take clients from, relay messages from anyone else are dropped
+        self.relays = set((socket.gethostbyname(host), port) for host, port in relays or [])
         self.logger = logging.getLogger(__name__)
-        logging.basicConfig(filename='./logs/server.log',
-                            encoding='utf-8', level=logging.DEBUG)
-        self.recv_pkts = dict()  # Mappings from seqno to pkts
-        self.pkt_types = dict()  # Mappings from seqno to pkt type
-        self.recv_starts = dict()  # Mappings from seqno to pkts
-        self.recv_ends = dict()  # Mappings from seqno to pkts
-        self.sent_pkts = dict()  # Mappings from seqno to pkts
-        self.recv_acks = set()
-        self.completed_pkts = set()
-        self.queue = queue.Queue()
-        self.mutex = threading.Lock()
+        logconfig.setup(self.logger, './logs/server.log' if inboxes is None else './logs/server_%d.log' % worker, log)
+        transport.Endpoint.__init__(
+            self, self.sock, self.logger, window, mode, options, ack_delay, congestion, ack_every=ack_every)
+        self.stats = stats  # TCP port on localhost or UNIX socket path to serve the metrics on, or None
+        self.dispatched = self.metrics.counter("messages_dispatched", labeled=True)  # By type
+        self.metrics.gauge("users", lambda: len(self.users))
 
     def start(self):
         '''
@@ -46,85 +64,123 @@ class Server:
 
         '''
         self.logger.debug('Starting Server')
+        if self.stats is not None:
+            metrics.serve(self.metrics, self.stats)
+        if self.engine == transport.ASYNCIO:
+            self.start_asyncio()
+            return
         # Create a thread that will handle incoming packets
         T = threading.Thread(target=self.recv_packet)
         T.daemon = True
         T.start()
+        if self.inboxes is not None:
+            self.start_relay(lambda callback, *args: callback(*args))
+        self.greet()
         try:
             while True:
                 self.logger.debug('[SERVER]: Waiting for new packet')
                 # This will get packets after the entire packet has been received
                 data, client_address = self.queue.get()
-                segments = data.split()
-                self.logger.debug('[SERVER]: Received packet:')
-                self.logger.debug(segments)
-                self.logger.debug("FROM: ")
-                self.logger.debug(client_address)
-                msg = segments
-                if msg[0] == "join":
-                    self.logger.debug('[MSG]: Join')
-                    if len(msg) < 3:
-                        self.logger.debug(
-                            '[ERROR]: Join messsage has less than 3 items')
-                        continue
-                    name = msg[2]
-                    # Check if we are at max capacity
-                    if len(self.usernames) == util.MAX_NUM_CLIENTS:
-                        self.logger.debug('[SERVER]: Max clients hit in JOIN')
-                        full_serv_msg = util.make_message(
-                            msg_type="err_server_full", msg_format=2)
-                        self.send_packet(
-                            msg=full_serv_msg, client_address=client_address)
-                        continue
-                    if name in self.usernames.keys():  # Check if username has already been taken
-                        self.logger.debug('[SERVER]: Name found in usernames')
-                        used_msg = util.make_message(
-                            msg_type="err_username_unavailable", msg_format=2)
-                        self.send_packet(
-                            msg=used_msg, client_address=client_address)
-                    else:
-                        # Otherwise, just add to existing usernames and print out statement
-                        self.logger.debug(
-                            'Adding this username to list of usernames')
-                        self.usernames.update({name: client_address})
-                        print("join: " + str(name))
-                elif msg[0] == "request_users_list":
-                    self.logger.debug('[MSG]: Request Users List')
-                    # Get the message we should send in data portion, should be list of users
-                    user_string = self.generate_users()
-                    users_msg = util.make_message(
-                        msg_type="response_users_list", msg_format=3, message=user_string)
-                    self.send_packet(
-                        msg=users_msg, client_address=client_address)
-                    username = self.get_username(client_address=client_address)
-                    print("request_users_list: " + str(username))
-                elif msg[0] == "send_message":
-                    # Send a message to all users
-                    self.send_all_msgs(msg, client_address)
-                elif msg[0] == "disconnect":
-                    # Disconnect a user
-                    self.logger.debug('[MSG]: Disconnect')
-                    if len(msg) < 3: # Protect against some issues from accesssing array, avoid crash
-                        self.logger.debug(
-                            '[ERROR]: Invalid message content for disconnect')
-                        continue
-                    name = msg[2]
-                    self.handle_disconnect(name)
-                else:
-                    # If for some reason we get something we don't know, we should just disconnect that user
-                    self.logger.debug('[MSG]: Unknown Message')
-                    unknown_msg = util.make_message(
-                        msg_type="err_unknown_message", msg_format=2)
-                    self.send_packet(
-                        msg=unknown_msg, client_address=client_address)
-                    username = self.get_username(client_address=client_address)
-                    self.handle_disconnect(username)
-                    print("disconnected: " + username + " sent unknown command")
+                self.handle_message(data, client_address)
         except Exception as e:
             self.logger.debug("[SERVER]: Ending server due to exception.")
             self.logger.debug(e)
             self.sock.close()
 
+    def start_asyncio(self):
+        '''
+        Same as start() but receive, retransmissions and fan-out all run on one asyncio event loop
+        '''
+        engine = transport.DatagramEngine(self, self.handle_message)
+
+        async def serve():
+            if self.inboxes is not None:
+                self.start_relay(asyncio.get_running_loop().call_soon_threadsafe)
+            asyncio.get_running_loop().call_soon(self.greet)
+            await engine.run()
+        try:
+            asyncio.run(serve())
+        except Exception as e:
+            self.logger.debug("[SERVER]: Ending server due to exception.")
+            self.logger.debug(e)
+            self.sock.close()
+
+    def handle_message(self, data, client_address):
+        '''
+        Process one complete message from a Client
+        '''
+        segments = data.split()
+        self.logger.debug('[SERVER]: Received packet:')
+        self.logger.debug(segments)
+        self.logger.debug("FROM: ")
+        self.logger.debug(client_address)
+        msg = segments
+        self.dispatched.inc(msg[0] if msg[0] in MESSAGE_TYPES else "unknown")
+        if (client_address[0], client_address[1]) in self.nodes:
+            self.handle_trunk(data, msg, client_address)
+        elif msg[0] in ("relay_message", "relay_hello"):
+            self.handle_relay(data, msg, client_address)
+        elif msg[0] == "join":
+            self.logger.debug('[MSG]: Join')
+            if len(msg) < 3:
+                self.logger.debug(
+                    '[ERROR]: Join messsage has less than 3 items')
+                return
+            name = msg[2]
+            # Only adds the user if we are not at max capacity and the username is free, on every server
+            joined = registry.TAKEN if name in self.remote else self.users.join(name, client_address)
+            if joined == registry.FULL:
+                self.logger.debug('[SERVER]: Max clients hit in JOIN')
+                full_serv_msg = util.make_message(
+                    msg_type="err_server_full", msg_format=2)
+                self.send_packet(
+                    msg=full_serv_msg, client_address=client_address)
+            elif joined == registry.TAKEN:  # Check if username has already been taken
+                self.logger.debug('[SERVER]: Name found in usernames')
+                used_msg = util.make_message(
+                    msg_type="err_username_unavailable", msg_format=2)
+                self.send_packet(
+                    msg=used_msg, client_address=client_address)
+            else:
+                self.logger.debug(
+                    'Added this username to list of usernames')
+                self.announce(util.make_message("federation_join", 1, name))
+                print("join: " + str(name))
+        elif msg[0] == "request_users_list":
+            self.logger.debug('[MSG]: Request Users List')
+            # Get the message we should send in data portion, should be list of users
+            user_string = self.generate_users()
+            users_msg = util.make_message(
+                msg_type="response_users_list", msg_format=3, message=user_string)
+            self.send_packet(
+                msg=users_msg, client_address=client_address)
+            username = self.get_username(client_address=client_address)
+            print("request_users_list: " + str(username))
+        elif msg[0] == "send_message":
+            # Send a message to all users
+            self.send_all_msgs(msg, client_address)
+        elif msg[0] == "disconnect":
+            # Disconnect a user
+            self.logger.debug('[MSG]: Disconnect')
+            if len(msg) < 3: # Protect against some issues from accesssing array, avoid crash
+                self.logger.debug(
+                    '[ERROR]: Invalid message content for disconnect')
+                return
+            name = msg[2]
+            self.handle_disconnect(name)
+            if not behind_relay(client_address):  # The session of a relay stays up for its other clients
+                self.close_session(client_address)
+        else:
+            # If for some reason we get something we don't know, we should just disconnect that user
+            self.logger.debug('[MSG]: Unknown Message')
+            unknown_msg = util.make_message(
+                msg_type="err_unknown_message", msg_format=2)
+            self.send_packet(
+                msg=unknown_msg, client_address=client_address)
+            username = self.get_username(client_address=client_address)
+            self.handle_disconnect(username)
+            print("disconnected: " + username + " sent unknown command")
+
     def send_all_msgs(self, msg, client_address):
         '''
         Take a msg and the original client_address and send a forward message to all clients that need to receive it
@@ -143,227 +199,273 @@ class Server:
         # Get username of sender
         sender = self.get_username(client_address=client_address)
         print("msg: " + str(sender))
+        # Every recipient gets the same forward message, so it is chunked and encoded only once
+        forward = self.make_forward(sender, msg_to_send)
+        relayed = dict()  # Mappings from worker to the recipients homed on it, when they are not homed here
+        routed = dict()  # Mappings from server to the recipients homed on it, when they joined another server
+        local = []  # Recipients homed here
         for idx in range(0, num_recipients):
             user = recipients[idx]
             if user in sent_to:  # If user has already been sent a message, DONT SEND AGAIN
                 self.logger.debug(
-                    '[Server]: Duplicate address specified, ' + str(user))
+                    '[Server]: Duplicate address specified, %s', user)
                 pass
             else:
                 sent_to.add(user)
-                if user not in self.usernames.keys():  # If we are trying to send to someone that doesn't exist, make note
-                    print("msg: " + str(sender) +
-                          " to non-existent user " + user)
+                if user not in self.users:
+                    node = self.remote.node_of(user)
+                    if node is None:  # If we are trying to send to someone that doesn't exist, make note
+                        print("msg: " + str(sender) +
+                              " to non-existent user " + user)
+                    else:
+                        routed.setdefault(node, []).append(user)
+                elif self.inboxes is not None and self.users.home_of(user) != self.worker:
+                    relayed.setdefault(self.users.home_of(user), []).append(user)
                 else:
-                    # Create a thread that will handle sending the message
-                    T = threading.Thread(
-                        target=self.send_msg_to_user, args=(user, sender, msg_to_send))
-                    T.daemon = True
-                    T.start()
+                    local.append(user)
+        self.send_forward(local, forward)
+        for worker, users in relayed.items():  # Their datagrams only reach their own worker, it sends the forward
+            self.inboxes[worker].put((users, forward.msg))
+        for node, users in routed.items():  # Once per server, which sends the forward to each of them
+            self.send_trunk(node, util.make_message(
+                "federation_route", 4, "%d %s %s" % (len(users), " ".join(users), forward.msg)))
+
+    def make_forward(self, sender, msg_to_send):
+        '''
+        Create the forward message of a msg, ready to be sent to any number of users
+        '''
+        # Msg should always have same structure
+        msg_content = "1 " + sender + " " + msg_to_send
+        send_msg_user = util.make_message(
+            msg_type="forward_message", msg_format=4, message=msg_content)
+        return transport.Payload(send_msg_user)
+
+    def send_forward(self, users, forward):
+        '''
+        Send a forward message to users homed here, once per relay for those behind one
+        '''
+        behind = dict()  # Mappings from relay to the numbers of the recipients behind it
+        for user in users:
+            address = self.users.address_of(user)
+            if address is None:
+                self.logger.debug('[SERVER]: Recipient left, %s', user)
+            elif behind_relay(address):
+                behind.setdefault(address[0], []).append(address[1])
+            else:
+                # Only starts the transfer, the receive thread takes care of it from here
+                self.send_msg_to_user(user, forward)
+        for relay, ids in behind.items():
+            self.send_down(relay, ids, forward)
 
     def send_packet(self, msg, client_address):
         '''
-        Send a packet and wait for the appropriate ACKs
-        '''
-        chunks = []
-        # Create chunks by breaking up the msg into smaller pieces
-        for i in range(0, len(msg), util.CHUNK_SIZE):
-            chunks.append(msg[i:min(i+util.CHUNK_SIZE, len(msg))])
-        # Choose random sequence number start
-        starting_seq_num = random.randint(10000, 10000000)
-        pkts_sent = 0
-        start_pkt = util.make_packet(
-            msg_type="start", msg="", seqno=starting_seq_num + pkts_sent)
-        # Send a START packet and wait for ACK, don't continue until this has happened
-        self.sock.sendto(str(start_pkt).encode('utf-8'),
-                         (client_address[0], client_address[1]))
-        time.sleep(0.05)
-        while starting_seq_num + pkts_sent + 1 not in self.recv_acks:
-            self.sock.sendto(str(start_pkt).encode('utf-8'),
-                             (client_address[0], client_address[1]))
-            time.sleep(0.5)
-        pkts_sent += 1
-        seqs = []  # Keep track of sequence numbers in ACKS that we want
-        self.mutex.acquire()  # Lock to prevent some race conditions
-        for _, chunk in enumerate(chunks):
-            data_pkt = util.make_packet(msg_type="data",
-                                        msg=chunk, seqno=starting_seq_num + pkts_sent)
-            # Mark that we sent this packet
-            self.sent_pkts.update({starting_seq_num + pkts_sent: data_pkt})
-            self.sock.sendto(str(data_pkt).encode('utf-8'),
-                             (client_address[0], client_address[1]))  # Send the packet
-            # Note what sequence number in ACK that we are expecting
-            seqs.append(starting_seq_num + pkts_sent + 1)
-            pkts_sent += 1
-        self.mutex.release()
-        all_found = False
-        time.sleep(0.05)
-        # Want to loop through all ACKs that we are expecting, make sure they are still there
-        while all_found == False:
-            all_found = True
-            for seq in seqs:
-                if seq not in self.recv_acks:  # If we didn't receive one, send request for it again
-                    all_found = False
-                    data_pkt = self.sent_pkts[seq - 1]
-                    self.sock.sendto(str(data_pkt).encode('utf-8'),
-                                     (client_address[0], client_address[1]))
-            if all_found == False:
-                time.sleep(0.5)  # Wait 500ms
-        # Send END packet and then wait for the ACK
-        end_pkt = util.make_packet(msg_type="end",
-                                   msg="", seqno=starting_seq_num + pkts_sent)
-        self.sock.sendto(str(end_pkt).encode('utf-8'),
-                         (client_address[0], client_address[1]))
-        time.sleep(0.05)
-        while starting_seq_num + pkts_sent + 1 not in self.recv_acks:
-            self.sock.sendto(str(end_pkt).encode('utf-8'),
-                             (client_address[0], client_address[1]))
-            time.sleep(0.5)
-
-    def recv_packet(self):
-        '''
-        Handle all incoming packets, will combine them and send to packet handler when the END packet has arrived
-        '''
-        while True:
-            data, client_address = self.sock.recvfrom(2048)
-            self.logger.debug('[PKT]: Received Packet')
-            decoded_msg = data.decode('utf-8')
-            msg_type, seq_no, data, checksum = util.parse_packet(decoded_msg)
-            seq_no = int(seq_no)
-            self.logger.debug(
-                '[PKT]: Checking that packet checksum is valid for ' + str(seq_no))
-            # Validate checksum, otherwise DROP
-            if util.validate_checksum(decoded_msg):
-                self.logger.debug('[PKT]: Packet is valid.')
-                if msg_type == "start":
-                    self.logger.debug(
-                        '[PKT]: Received START Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    # Update that we got this START packet
-                    self.pkt_types.update({seq_no: "start"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    self.send_ack(seq_no + 1, client_address)  # SEND ACK
-                elif msg_type == "data":
-                    self.logger.debug(
-                        '[PKT]: Received DATA Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    # Update that we got this DATA packet
-                    self.pkt_types.update({seq_no: "data"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    self.send_ack(seq_no + 1, client_address)  # SEND ACK
-                elif msg_type == "end":
-                    self.logger.debug(
-                        '[PKT]: Received END Packet' + str(seq_no))
-                    self.mutex.acquire()
-                    # Update that we got this END packet
-                    self.pkt_types.update({seq_no: "end"})
-                    self.recv_pkts.update({seq_no: data})
-                    self.mutex.release()
-                    # Want to get the ENTIRE message sent over a bunch of packets
-                    current_msg = self.get_msg_from_seqs(seq_no)
-                    self.logger.debug('[PKT]: End Packet' + str(seq_no))
-                    if current_msg == "":  # If this happens, we are missing packets, don't send ACK
-                        continue
-                    self.logger.debug(
-                        '[PKT]: Received Full Packet With all ACKS')
-                    self.send_ack(seq_no + 1, client_address)  # SEND ACK
-                    self.queue.put(
-                        (str(current_msg), client_address))  # Notify that we got a packet
-                    self.logger.debug(
-                        "[SERVER]: Completed message, " + str(current_msg))
-                elif msg_type == "ack":
-                    self.logger.debug('[PKT]: Received ACK' + str(seq_no))
-                    self.mutex.acquire()
-                    self.recv_acks.add(seq_no)  # Add that we received an ACK
-                    self.mutex.release()
-
-    def get_msg_from_seqs(self, seq_no):
-        '''
-        From the sequence number of the ACK, reconstruct the data 
-        '''
-        current_msg = ""
-        curr_seq = seq_no
-        self.mutex.acquire()
-        while curr_seq in self.pkt_types.keys():  # While the previous packet was received, concat the data
-            self.logger.debug('[MSG_FROM_SEQS]: Looking for' + str(curr_seq))
-            current_msg = self.recv_pkts[curr_seq] + current_msg
-            if self.pkt_types[curr_seq] == "start":  # When we reach START, we break
-                break
-            curr_seq -= 1
-        # If we don't end on START pkt, we are missing some packets
-        if curr_seq not in self.pkt_types or self.pkt_types[curr_seq] != "start":
-            self.logger.debug('[MSG_FROM_SEQS]: Hmm... missing packets')
-            self.mutex.release()
-            return ""
-        if curr_seq in self.completed_pkts:  # If we already processed this packet, maybe we got duplicate, dont want to send back up again
-            self.logger.debug(
-                '[MSG_FROM_SEQS]: Already have processed this completed packet, will not send upward')
-            self.mutex.release()
-            return ""
-        # Want to note that we got this set of packets
-        self.completed_pkts.add(curr_seq)
-        self.mutex.release()
-        return current_msg
+        Start sending a msg to a client, over the session to its relay when it is behind one
+        '''
+        if behind_relay(client_address):
+            return self.send_down(client_address[0], [client_address[1]], msg)
+        return transport.Endpoint.send_packet(self, msg, client_address)
 
-    def send_ack(self, seqno, client_address):
+    def send_down(self, relay, ids, msg):
         '''
-        Send an ACK for a packet with some sequence number, also will require the address
+        Send a msg (or Payload) to clients behind a relay, once for all of them, returns its Delivery
         '''
-        ack_pkt = util.make_packet(msg_type="ack",
-                                   msg="", seqno=seqno)  # ACK message and packet created and sent
-        self.sock.sendto(str(ack_pkt).encode('utf-8'),
-                         (client_address[0], client_address[1]))
+        text = msg.msg if isinstance(msg, transport.Payload) else msg
+        return self.send_session(transport.Payload(util.make_message(
+            "relay_forward", 4, "%d %s %s" % (len(ids), " ".join(str(idx) for idx in ids), text))), relay)
 
-    def send_msg_to_user(self, user, sender, msg_to_send):
+    def handle_relay(self, data, msg, relay):
         '''
-        Create a msg and actually send the message to the user
+        Process a message that came over the session of a relay
         '''
-        address, port = self.usernames[user]
-        # Msg should always have same structure
-        msg_content = "1 " + sender + " " + msg_to_send
-        send_msg_user = util.make_message(
-            msg_type="forward_message", msg_format=4, message=msg_content)
-        self.send_packet(msg=send_msg_user, client_address=(address, port))
+        if (relay[0], relay[1]) not in self.relays:
+            self.logger.debug('[ERROR]: Relay message from %s, which is not a relay of ours', relay)
+            return
+        if msg[0] == "relay_hello":
+            self.handle_relay_hello(relay)
+            return
+        if len(msg) < 4 or not msg[2].isdigit():
+            self.logger.debug('[ERROR]: Relay message without a client number and a message')
+            return
+        # A client behind a relay, it goes by the relay address and its number there
+        self.handle_message(data.split(" ", 3)[3], ((relay[0], relay[1]), int(msg[2])))
+
+    def handle_relay_hello(self, relay):
+        '''
+        A relay (re)started, so the clients it had are gone and it gets a new session
+        '''
+        relay = (relay[0], relay[1])
+        for name in self.users.usernames():
+            address = self.users.address_of(name)
+            if behind_relay(address) and address[0] == relay:
+                self.handle_disconnect(name)
+        self.reset_trunk(relay)
+
+    def send_msg_to_user(self, user, forward):
+        '''
+        Actually send a forward message to the user
+        '''
+        address, port = self.users.address_of(user)
+        self.send_packet(msg=forward, client_address=(address, port))
+
+    def start_relay(self, call):
+        '''
+        Start a thread taking the forwards other workers relay to the users homed on this one,
+        call(callback, *args) runs the callback where the engine sends from
+        '''
+        def relay():
+            while True:
+                users, msg = self.inboxes[self.worker].get()
+                call(self.send_relayed, users, msg)
+        T = threading.Thread(target=relay)
+        T.daemon = True
+        T.start()
+
+    def send_relayed(self, users, msg):
+        '''
+        Send a forward message another worker relayed to users homed here, unless they left in the meantime
+        '''
+        self.send_forward(users, transport.Payload(msg))
+
+    def handle_trunk(self, data, msg, node):
+        '''
+        Process one message from another server of the federation
+        '''
+        self.logger.debug('[MSG]: Trunk %s', msg[0])
+        if msg[0] == "federation_route":
+            num_users = int(msg[2])
+            # The forward message goes on exactly as the server of the sender built it
+            self.send_relayed(msg[3: 3 + num_users], data.split(" ", 3 + num_users)[-1])
+        elif msg[0] == "federation_join":
+            self.remote.add(msg[2], node)
+        elif msg[0] == "federation_leave":
+            self.remote.remove(msg[2], node)
+        elif msg[0] in ("federation_hello", "federation_sync"):
+            self.remote.sync(node, msg[3:])
+            if msg[0] == "federation_hello":  # It (re)started, so it gets a new trunk and our users in return
+                self.reset_trunk(node)
+                self.send_trunk(node, self.make_presence("federation_sync"))
+        else:
+            self.logger.debug('[ERROR]: Unknown trunk message')
+
+    def greet(self):
+        '''
+        Tell every other server of the federation that we (re)started, and who is on here
+        '''
+        self.announce(self.make_presence("federation_hello"))
+
+    def make_presence(self, msg_type):
+        '''
+        Create a message listing the users homed here, for the other servers of the federation
+        '''
+        names = self.users.usernames()
+        return util.make_message(msg_type, 3, str(len(names)) + " " + " ".join(names))
+
+    def announce(self, msg):
+        '''
+        Send a msg to every other server of the federation
+        '''
+        payload = transport.Payload(msg)
+        for node in self.nodes:
+            self.send_session(payload, node)
+
+    def send_trunk(self, node, msg):
+        '''
+        Send a msg to another server of the federation. The trunk is the session to it, so every message
+        follows the previous one in order over one flow without a handshake of its own.
+        '''
+        self.send_session(transport.Payload(msg), node)
+
+    def reset_trunk(self, node):
+        '''
+        Tear down the trunk to a server or relay that restarted, it would never ACK the rest of the old one
+        '''
+        self.mutex.acquire()
+        session = self.sessions.get(node)
+        if session is not None:
+            session.close()
+        self.mutex.release()
 
     def generate_users(self):
         '''
         Create a string of all users that will be sent back to requester
         '''
-        num_users = len(self.usernames)
-        user_string = ""
-        # Add all names in sorted order to a string
-        for name in sorted(self.usernames.keys()):
-            user_string += name + " "
-        if user_string != "":  # Want to remove that last space
-            user_string = user_string[:len(user_string) - 1]
+        # The registries keep the names in sorted order, and a name is only ever on one server
+        names = list(heapq.merge(self.users.usernames(), self.remote.usernames()))
         # Concatenate in the amount of users
-        user_string = str(num_users) + " " + user_string
-        return user_string
+        return str(len(names)) + " " + " ".join(names)
 
     def handle_disconnect(self, name):
         '''
         Disconnect a user by removing its existence, doesn't send a message
         '''
-        self.logger.debug("[SERVER]: Handling disconnect for user " + name)
-        if name in self.usernames.keys():  # Only want to delete if username is in dict, otherwise do nothing and print error
-            del self.usernames[name]
-        else:
+        self.logger.debug("[SERVER]: Handling disconnect for user %s", name)
+        if not self.users.remove(name):  # Only deletes if username is registered, otherwise print error
             self.logger.debug(
                 "[SERVER]: Error, unable to disconnect this user")
+        else:
+            self.announce(util.make_message("federation_leave", 1, name))
         print("disconnected: " + str(name))
 
     def get_username(self, client_address):
         '''
         Get a username when given a client_address
         '''
-        for username in self.usernames.keys():
-            address, port = self.usernames[username]
-            # Matching the address and port to find username
-            if address == client_address[0] and port == client_address[1]:
-                return username
-        return ""
+        return self.users.name_of(client_address)
+
+
+def behind_relay(address):
+    '''
+    True if a client address is that of a client behind a relay, which is (relay address, its number there)
+    '''
+    return address is not None and isinstance(address[0], tuple)
+
+
+def run_worker(worker, directory, inboxes, log, stats, relays, ack_every, *args):
+    '''
+    Body of one worker process of a multi-process server
+    '''
+    sys.stdout.reconfigure(line_buffering=True)  # The parent goes away without flushing for us
+    users = registry.SharedRegistry(directory, worker)
+    server = Server(*args, users=users, inboxes=inboxes, worker=worker, relays=relays, log=log, ack_every=ack_every,
+                    stats=metrics.worker_address(stats, worker) if stats is not None else None)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_workers(num_workers, dest, port, window, mode=transport.SELECTIVE_REPEAT, options=None,
+                  engine=transport.THREADS, capacity=util.MAX_NUM_CLIENTS, ack_delay=0, congestion=transport.RENO,
+                  log=None, stats=None, relays=None, ack_every=util.DELAYED_ACK_COUNT):
+    '''
+    Serve the port with num_workers Server processes, each bound with SO_REUSEPORT so the kernel spreads
+    the clients over them. A coordinator process keeps the registry they share, and each worker gets an
+    inbox through which the others hand it the forwards to the users homed on it. Each worker serves its metrics
+    on its own port or socket after stats. Returns when they all ended.
+    '''
+    # Exit through the finally below on SIGTERM too, which stops the coordinator and the workers with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    manager = registry.DirectoryManager()
+    manager.start()
+    directory = manager.Directory(capacity)
+    inboxes = [multiprocessing.Queue() for _ in range(num_workers)]
+    workers = []
+    for worker in range(num_workers):
+        process = multiprocessing.Process(target=run_worker, args=(
+            worker, directory, inboxes, log, stats, relays, ack_every, dest, port, window, mode, options, engine, capacity, ack_delay, congestion))
+        process.daemon = True
+        process.start()
+        workers.append(process)
+    if hasattr(signal, "SIGUSR1"):  # Switching the log levels is up to each worker
+        for signum in (signal.SIGUSR1, signal.SIGUSR2):
+            signal.signal(signum, lambda signum, frame: [os.kill(process.pid, signum) for process in workers])
+    try:
+        for process in workers:
+            process.join()
+    finally:
+        for process in workers:
+            process.terminate()
+        manager.shutdown()
 
 # Do not change below part of code
 
@@ -377,11 +479,29 @@ if __name__ == "__main__":
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
         print("-w WINDOW | --window=WINDOW The window size, default is 3")
+        print("-m MODE | --mode=MODE The window mode, gbn or sr, default is sr")
+        print("-b | --binary Offer the binary packet format when sending")
+        print("-k SUM | --checksum=SUM The checksum to offer for binary packets, " + ", ".join(util.CHECKSUMS) + ", default is crc32")
+        print("-s | --sack Offer cumulative and selective ACKs when sending")
+        print("-o | --one Offer single-datagram messages when sending")
+        print("-n | --session Send everything to a peer over one session, set up by a single START")
+        print("-z LEVEL | --compress=LEVEL Offer zlib compression of large messages at LEVEL, 1 (fast) to 9, default is off")
+        print("-x SIZE | --datagram=SIZE Offer packets of up to SIZE payload bytes, auto for the largest on loopback, default is 1400")
+        print("-d DELAY | --delay=DELAY Hold in-order SACK ACKs back for up to DELAY ms, default is 0")
+        print("-y COUNT | --every=COUNT Send held back ACKs at the latest with the COUNT-th packet owed one, default is %d" % util.DELAYED_ACK_COUNT)
+        print("-g CC | --congestion=CC The congestion control, reno, cubic or none, default is reno")
+        print("-c CAPACITY | --capacity=CAPACITY The most clients connected at once, default is 10")
+        print("-e ENGINE | --engine=ENGINE The server engine, threads or asyncio, default is threads")
+        print("-j WORKERS | --workers=WORKERS Serve the port with WORKERS processes, default is 1")
+        print("-f PEERS | --federate=PEERS Federate with the servers at PEERS, comma-separated HOST:PORT, default is none")
+        print("-r RELAYS | --relays=RELAYS Take clients from the relays at RELAYS, comma-separated HOST:PORT, default is none")
+        print("-l SPEC | --log=SPEC How to log, e.g. async,info,packet=warning,sample=100, default is debug")
+        print("-t WHERE | --stats=WHERE Serve the metrics as JSON on TCP port WHERE of localhost, or the UNIX socket at path WHERE")
         print("-h | --help Print this help")
 
     try:
         OPTS, ARGS = getopt.getopt(sys.argv[1:],
-                                   "p:a:w", ["port=", "address=", "window="])
+                                   "p:a:w:m:bk:sonz:x:d:y:g:e:c:j:f:r:l:t:", ["port=", "address=", "window=", "mode=", "binary", "checksum=", "sack", "one", "session", "compress=", "datagram=", "delay=", "every=", "congestion=", "engine=", "capacity=", "workers=", "federate=", "relays=", "log=", "stats="])
     except getopt.GetoptError:
         helper()
         exit()
@@ -389,16 +509,80 @@ if __name__ == "__main__":
     PORT = 15000
     DEST = "localhost"
     WINDOW = 3
+    MODE = transport.SELECTIVE_REPEAT
+    OPTIONS = transport.Options()
+    ENGINE = transport.THREADS
+    CAPACITY = util.MAX_NUM_CLIENTS
+    DELAY = 0
+    ACK_EVERY = util.DELAYED_ACK_COUNT
+    CONGESTION = transport.RENO
+    WORKERS = 1
+    PEERS = []
+    RELAYS = []
+    LOG = logconfig.LogConfig()
+    STATS = None
 
     for o, a in OPTS:
-        if o in ("-p", "--port="):
+        if o in ("-p", "--port"):
             PORT = int(a)
-        elif o in ("-a", "--address="):
+        elif o in ("-a", "--address"):
             DEST = a
-        elif o in ("-w", "--window="):
-            WINDOW = a
+        elif o in ("-w", "--window"):
+            WINDOW = int(a)
+        elif o in ("-m", "--mode"):
+            MODE = a
+        elif o in ("-b", "--binary"):
+            OPTIONS.binary = True
+        elif o in ("-k", "--checksum"):
+            OPTIONS.checksum = a
+        elif o in ("-s", "--sack"):
+            OPTIONS.sack = True
+        elif o in ("-o", "--one"):
+            OPTIONS.single = True
+        elif o in ("-n", "--session"):
+            OPTIONS.session = True
+        elif o in ("-z", "--compress"):
+            OPTIONS.compress = int(a)
+        elif o in ("-x", "--datagram"):
+            OPTIONS.datagram = a if a == transport.AUTO_DATAGRAM else int(a)
+        elif o in ("-d", "--delay"):
+            DELAY = int(a)
+        elif o in ("-y", "--every"):
+            ACK_EVERY = int(a)
+        elif o in ("-g", "--congestion"):
+            CONGESTION = a
+        elif o in ("-e", "--engine"):
+            ENGINE = a
+        elif o in ("-c", "--capacity"):
+            CAPACITY = int(a)
+        elif o in ("-j", "--workers"):
+            WORKERS = int(a)
+        elif o in ("-f", "--federate"):
+            PEERS = [(peer.rsplit(":", 1)[0], int(peer.rsplit(":", 1)[1])) for peer in a.split(",")]
+        elif o in ("-r", "--relays"):
+            RELAYS = [(relay.rsplit(":", 1)[0], int(relay.rsplit(":", 1)[1])) for relay in a.split(",")]
+        elif o in ("-l", "--log"):
+            LOG = logconfig.parse(a)
+        elif o in ("-t", "--stats"):
+            STATS = a
+
+    if MODE not in transport.WINDOW_MODES or ENGINE not in transport.ENGINES or \
+            CONGESTION not in transport.CONGESTION_CONTROLS or OPTIONS.checksum not in util.CHECKSUMS or \
+            not 0 <= OPTIONS.compress <= 9 or \
+            OPTIONS.datagram != transport.AUTO_DATAGRAM and not 0 <= OPTIONS.datagram <= util.MAX_CHUNK_SIZE or \
+            LOG is None or ACK_EVERY < 1 or WORKERS < 1 or WORKERS > 1 and (PEERS or not hasattr(socket, "SO_REUSEPORT")):
+        helper()
+        exit()
+
+    if WORKERS > 1:
+        try:
+            serve_workers(WORKERS, DEST, PORT, WINDOW, MODE, OPTIONS, ENGINE, CAPACITY, DELAY / 1000.0, CONGESTION, LOG, STATS, RELAYS, ACK_EVERY)
+        except (KeyboardInterrupt, SystemExit):
+            exit()
+        exit()
 
-    SERVER = Server(DEST, PORT, WINDOW)
+    SERVER = Server(DEST, PORT, WINDOW, MODE, OPTIONS, ENGINE, CAPACITY, DELAY / 1000.0, CONGESTION, peers=PEERS, relays=RELAYS, log=LOG, stats=STATS,
+                    ack_every=ACK_EVERY)
     try:
         SERVER.start()
     except (KeyboardInterrupt, SystemExit):
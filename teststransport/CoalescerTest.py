@@ -0,0 +1,77 @@
+import time
+import unittest
+import util
+from teststransport.SessionTest import endpoint
+
+
+class CoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = endpoint(coalesce=0.03)
+        self.server = endpoint()
+        self.port = self.server.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.client.sock.close()
+        self.server.sock.close()
+
+    def patient(self):
+        '''
+        A client that holds batches back for longer than any test takes
+        '''
+        client = endpoint(coalesce=60)
+        self.addCleanup(client.sock.close)
+        return client
+
+    def send(self, msgs, address):
+        '''
+        Queue msgs for address and check they all arrive, in order
+        '''
+        batches = [self.client.queue_message(msg, address) for msg in msgs]
+        for batch in batches:
+            self.assertTrue(batch.done.wait(10))
+            self.assertFalse(batch.failed)
+        self.assertEqual([self.server.queue.get(timeout=10)[0] for _ in msgs], msgs)
+        return batches
+
+    def test_hostname(self):
+        # Batches are keyed by the resolved address, the one the ACKs of their transfers come from
+        self.send(["send_message %d hello" % idx for idx in range(5)], ("localhost", self.port))
+        self.assertEqual(self.client.coalescer.in_flight, {})
+        self.assertEqual(self.client.coalescer.waiting, {})
+        self.send(["send_message again"], ("127.0.0.1", self.port))
+
+    def test_first_message_alone_then_batched(self):
+        address = ("127.0.0.1", self.port)
+        self.send(["send_message %d hello" % idx for idx in range(5)], address)
+        # The peer was not known to take batches, the first message went alone and the rest waited for its ACK
+        self.assertEqual(self.client.coalesce_stats(), {"batches": 2, "msgs": 5})
+        self.assertIn(address, self.client.coalescer.batching)
+        self.send(["send_message %d again" % idx for idx in range(3)], address)
+        self.assertEqual(self.client.coalesce_stats(), {"batches": 3, "msgs": 8})
+
+    def test_held_until_flushed(self):
+        client = self.patient()
+        address = ("127.0.0.1", self.port)
+        batch = client.queue_message("send_message hello", address)
+        time.sleep(0.1)
+        self.assertFalse(batch.done.is_set())
+        self.assertIs(client.coalescer.waiting[address], batch)
+        self.assertIsNotNone(batch.timer)
+        # What the timer does once the delay is over
+        client.flush_batch(address)
+        self.assertTrue(batch.done.wait(10))
+        self.assertEqual(self.server.queue.get(timeout=10)[0], "send_message hello")
+        self.assertIsNone(batch.timer)
+        self.assertEqual(client.coalescer.waiting, {})
+
+    def test_full_batch_goes_right_away(self):
+        client = self.patient()
+        address = ("127.0.0.1", self.port)
+        big = "send_message " + "x" * util.MAX_BATCH_SIZE
+        self.assertTrue(client.queue_message(big, address).done.wait(10))
+        msgs = ["send_message %d " % idx + "x" * (util.MAX_BATCH_SIZE // 4) for idx in range(4)]
+        batches = [client.queue_message(msg, address) for msg in msgs]
+        self.assertIs(batches[0], batches[-1])
+        self.assertTrue(batches[0].done.wait(10))
+        self.assertEqual([self.server.queue.get(timeout=10)[0] for _ in range(5)], [big] + msgs)
+        self.assertEqual(client.coalesce_stats(), {"batches": 2, "msgs": 5})
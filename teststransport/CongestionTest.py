@@ -0,0 +1,115 @@
+import time
+import unittest
+import transport
+import util
+
+
+class Waiting:
+    '''
+    Stands in for a transfer blocked on the congestion window
+    '''
+
+    def __init__(self, pumped):
+        self.pumped = pumped
+
+    def pump(self):
+        self.pumped.append(self)
+
+
+class CongestionTest(unittest.TestCase):
+    def setUp(self):
+        self.rtt = transport.RttEstimator()
+        self.rtt.sample(0.1)
+        self.cc = transport.CongestionControl(self.rtt)
+
+    def send(self, cc, num_pkts):
+        for _ in range(num_pkts):
+            cc.sent(time.time(), util.TIMER_TICK)
+
+    def test_slow_start_then_avoidance(self):
+        self.assertEqual(self.cc.cwnd, util.INITIAL_CWND)
+        self.send(self.cc, 4)
+        self.assertEqual(self.cc.available(), 0)
+        self.cc.on_ack(4)
+        self.assertEqual(self.cc.cwnd, 8)
+        self.assertEqual(self.cc.in_flight, 0)
+        # Past ssthresh one more packet per window worth of ACKs
+        self.cc.ssthresh = 8
+        self.cc.on_ack(8)
+        self.assertAlmostEqual(self.cc.cwnd, 9)
+        self.cc.cwnd = util.MAX_CWND
+        self.cc.on_ack(100)
+        self.assertEqual(self.cc.cwnd, util.MAX_CWND)
+
+    def test_loss_halves_once_per_episode(self):
+        self.cc.cwnd = 16
+        self.send(self.cc, 16)
+        self.cc.on_loss()
+        self.assertEqual((self.cc.cwnd, self.cc.ssthresh, self.cc.losses), (8, 8, 1))
+        # More holes of the same window are the same episode
+        self.cc.on_loss()
+        self.assertEqual((self.cc.cwnd, self.cc.losses), (8, 1))
+        self.cc.recovery_end = 0
+        self.cc.on_loss()
+        self.assertEqual((self.cc.cwnd, self.cc.losses), (8, 2))
+
+    def test_timeout_starts_over(self):
+        self.cc.cwnd = 16
+        self.send(self.cc, 10)
+        self.cc.on_timeout()
+        self.assertEqual((self.cc.cwnd, self.cc.ssthresh), (util.MIN_CWND, 5))
+        # A later timeout of the same episode leaves ssthresh alone
+        self.cc.in_flight = 2
+        self.cc.on_timeout()
+        self.assertEqual((self.cc.cwnd, self.cc.ssthresh, self.cc.losses), (util.MIN_CWND, 5, 1))
+        # Slow start back up to ssthresh
+        self.cc.on_ack(2)
+        self.assertEqual(self.cc.cwnd, 3)
+        self.cc.on_ack(10)
+        self.assertEqual(self.cc.cwnd, 5)
+
+    def test_disabled(self):
+        cc = transport.CongestionControl(self.rtt, enabled=False)
+        self.send(cc, 100)
+        self.assertEqual(cc.available(), util.MAX_CWND)
+        self.assertEqual(cc.limit(64), 64)
+        self.assertEqual(cc.pace(time.time()), 0)
+
+    def test_release_wakes_blocked(self):
+        pumped = []
+        first, second = Waiting(pumped), Waiting(pumped)
+        self.send(self.cc, 4)
+        self.cc.blocked[first] = True
+        self.cc.blocked[second] = True
+        self.cc.wake()
+        self.assertEqual(pumped, [])
+        self.cc.release(1)
+        self.assertEqual(pumped, [first, second])
+        self.assertEqual(len(self.cc.blocked), 0)
+
+    def test_cubic(self):
+        cc = transport.Cubic(self.rtt)
+        cc.cwnd = 100
+        self.send(cc, 100)
+        cc.on_loss()
+        self.assertAlmostEqual(cc.cwnd, 70)
+        self.assertAlmostEqual(cc.ssthresh, 70)
+        self.assertEqual(cc.w_max, 100)
+        # Right after the loss the window heads back towards where it was
+        cc.in_flight = 0
+        cc.on_ack(1)
+        self.assertGreater(cc.cwnd, 70)
+        self.assertLess(cc.cwnd, 100)
+        # Long after it, past it
+        k = ((cc.w_max * (1 - cc.BETA)) / cc.C) ** (1.0 / 3)
+        cc.epoch = time.time() - 2 * k
+        for _ in range(200):
+            cc.on_ack(1)
+        self.assertGreater(cc.cwnd, 100)
+        # A timeout remembers the window it happened at
+        cwnd = cc.cwnd
+        cc.recovery_end = 0
+        cc.on_timeout()
+        self.assertEqual(cc.cwnd, util.MIN_CWND)
+        self.assertEqual(cc.w_max, cwnd)
+        self.assertIsNone(cc.epoch)
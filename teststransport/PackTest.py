@@ -0,0 +1,63 @@
+import logging
+import os
+import socket
+import unittest
+import zlib
+import transport
+import util
+
+
+class PackTest(unittest.TestCase):
+    def setUp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        logger = logging.getLogger("teststransport")
+        logger.setLevel(logging.WARNING)
+        self.endpoint = transport.Endpoint(sock, logger, 3, options=transport.Options(compress=6))
+
+    def tearDown(self):
+        self.endpoint.sock.close()
+
+    def packed(self, payload, size=util.CHUNK_SIZE):
+        return b"".join(self.endpoint.pack(payload, size))
+
+    def test_below_threshold(self):
+        payload = transport.Payload("a" * util.COMPRESS_THRESHOLD)
+        self.assertEqual(self.packed(payload), b"-" + payload.data)
+        self.assertEqual(self.endpoint.unpack(self.packed(payload)), payload.data)
+        self.assertEqual(self.endpoint.compress_stats()["compressed"], 0)
+        self.assertEqual(self.endpoint.compress_stats()["skipped"], 0)
+
+    def test_compressed(self):
+        payload = transport.Payload("send_message " + "hello " * 1000)
+        chunks = self.endpoint.pack(payload)
+        self.assertEqual(chunks[0][:1], b"z")
+        self.assertEqual(self.endpoint.unpack(b"".join(chunks)), payload.data)
+        stats = self.endpoint.compress_stats()
+        self.assertEqual((stats["compressed"], stats["skipped"]), (1, 0))
+        self.assertLess(stats["ratio"], util.COMPRESS_MIN_RATIO)
+        # Compressed once per Payload, cut again for another chunk size
+        self.assertIs(self.endpoint.pack(payload), chunks)
+        small = self.endpoint.pack(payload, 10)
+        self.assertTrue(all(len(chunk) <= 10 for chunk in small))
+        self.assertEqual(b"".join(small), b"".join(chunks))
+        self.assertEqual(self.endpoint.compress_stats()["compressed"], 1)
+
+    def test_skipped_when_not_smaller(self):
+        payload = transport.Payload("")
+        payload.data = os.urandom(4 * util.CHUNK_SIZE)  # Nothing zlib can shrink
+        self.assertEqual(self.packed(payload), b"-" + payload.data)
+        stats = self.endpoint.compress_stats()
+        self.assertEqual((stats["compressed"], stats["skipped"]), (0, 1))
+
+    def test_oversized_inflation(self):
+        limit = util.MAX_MESSAGE_SIZE
+        util.MAX_MESSAGE_SIZE = 10000
+        self.addCleanup(setattr, util, "MAX_MESSAGE_SIZE", limit)
+        self.assertEqual(self.endpoint.unpack(b"z" + zlib.compress(b"x" * 10000)), b"x" * 10000)
+        # A small datagram must not inflate to more than any message can be
+        self.assertIsNone(self.endpoint.unpack(b"z" + zlib.compress(b"x" * 10001)))
+
+    def test_corrupt(self):
+        data = zlib.compress(b"x" * 10000)
+        self.assertIsNone(self.endpoint.unpack(b"z" + data[:len(data) // 2]))
+        self.assertIsNone(self.endpoint.unpack(b"znot zlib"))
@@ -0,0 +1,95 @@
+import struct
+import unittest
+import util
+
+PAYLOADS = [b"", b"x", b"hello|world|123", bytes(range(256)) * 5]
+
+
+class PacketTest(unittest.TestCase):
+    def test_binary_round_trip(self):
+        for version, name in util.BINARY_CHECKSUMS.items():
+            with self.subTest(checksum=name):
+                if name not in util.CHECKSUMS:
+                    self.skipTest("%s is not installed" % name)
+                for msg_type in util.PACKET_TYPES:
+                    for payload in PAYLOADS:
+                        packet = util.make_binary_packet(msg_type, 123456, payload, checksum=name)
+                        self.assertEqual(packet[0], version)
+                        self.assertEqual(util.binary_checksum(packet), name)
+                        parsed = util.parse_binary_packet(packet)
+                        self.assertEqual((parsed[0], parsed[1], bytes(parsed[2])), (msg_type, 123456, payload))
+
+    def test_binary_in_receive_buffer(self):
+        packet = util.make_binary_packet("data", 7, b"payload")
+        buf = bytearray(util.RECV_BUFFER_SIZE)
+        buf[:len(packet)] = packet
+        parsed = util.parse_binary_packet(buf, len(packet))
+        self.assertEqual(bytes(parsed[2]), b"payload")
+        self.assertIsNone(util.parse_binary_packet(buf))  # The rest of the buffer is no part of it
+
+    def test_binary_corruption(self):
+        for name in util.CHECKSUMS:
+            packet = util.make_binary_packet("data", 99, b"some payload", checksum=name)
+            for idx in range(1, len(packet)):  # Any bit flipped past the version byte is caught
+                for bit in range(8):
+                    corrupt = bytearray(packet)
+                    corrupt[idx] ^= 1 << bit
+                    self.assertIsNone(util.parse_binary_packet(bytes(corrupt)), (name, idx, bit))
+
+    def test_binary_other_checksum_version(self):
+        # A packet claiming another checksum than the one it was made with does not check out
+        packet = bytearray(util.make_binary_packet("data", 5, b"abc", checksum=util.CRC32))
+        packet[0] = util.BINARY_VERSIONS[util.ADLER32]
+        self.assertIsNone(util.parse_binary_packet(bytes(packet)))
+
+    def test_binary_unavailable_checksum(self):
+        for name in util.BINARY_VERSIONS:
+            if name not in util.CHECKSUMS:
+                header = struct.pack("!BBIH", util.BINARY_VERSIONS[name], 1, 5, 3)
+                self.assertIsNone(util.parse_binary_packet(header + struct.pack("!I", 0) + b"abc"))
+
+    def test_binary_truncation(self):
+        packet = util.make_binary_packet("data", 42, b"0123456789")
+        for cut in range(len(packet)):
+            self.assertIsNone(util.parse_binary_packet(packet[:cut]))
+            self.assertIsNone(util.parse_binary_packet(packet, cut))
+        self.assertIsNone(util.parse_binary_packet(packet + b"x"))
+
+    def test_binary_unknown_type(self):
+        packet = bytearray(util.make_binary_packet("data", 1, b""))
+        packet[1] = len(util.PACKET_TYPES)
+        self.assertIsNone(util.parse_binary_packet(bytes(packet)))
+
+    def test_text_round_trip_corruption_truncation(self):
+        for payload in PAYLOADS[:3] + [b"y" * 1400]:
+            packet = util.make_packet_bytes("data", 77, payload)
+            self.assertFalse(util.is_binary_packet(packet))
+            parsed = util.parse_packet_bytes(packet)
+            self.assertEqual((parsed[0], parsed[1], bytes(parsed[2])), ("data", 77, payload))
+            for idx in range(len(packet)):
+                corrupt = bytearray(packet)
+                corrupt[idx] ^= 1
+                self.assertIsNone(util.parse_packet_bytes(bytes(corrupt)), idx)
+            for cut in range(len(packet)):
+                self.assertIsNone(util.parse_packet_bytes(packet[:cut]), cut)
+
+    def test_batch_round_trip(self):
+        for msgs in [[], [""], ["a"], ["send_message 5 1 bob hi", "12:34", "", "x" * 1000, "héllo wörld"]]:
+            self.assertEqual(util.parse_batch(util.make_batch(msgs)), msgs)
+
+    def test_batch_truncation(self):
+        msgs = ["first", "second", "third"]
+        batch = util.make_batch(msgs)
+        for cut in range(len(batch) + 1):
+            parsed = util.parse_batch(batch[:cut])
+            # Only the entries that are whole, in order
+            self.assertEqual(parsed, msgs[:len(parsed)])
+            self.assertLessEqual(len(util.make_batch(parsed)), cut)
+
+    def test_batch_corruption(self):
+        self.assertEqual(util.parse_batch("5:first6:second"), ["first", "second"])
+        self.assertEqual(util.parse_batch("5:firstx:second"), ["first"])
+        self.assertEqual(util.parse_batch("5:first-1:"), ["first"])
+        self.assertEqual(util.parse_batch("5:first99:second"), ["first"])
+        self.assertEqual(util.parse_batch("5first"), [])
+        self.assertEqual(util.parse_batch(":"), [])
@@ -0,0 +1,52 @@
+import unittest
+import registry
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.users = registry.Registry(3)
+
+    def test_join_and_remove(self):
+        self.assertEqual(self.users.join("bob", ["127.0.0.1", 5001]), registry.JOINED)
+        self.assertEqual(self.users.join("alice", ("127.0.0.1", 5002)), registry.JOINED)
+        self.assertEqual(len(self.users), 2)
+        self.assertIn("bob", self.users)
+        self.assertEqual(self.users.address_of("bob"), ("127.0.0.1", 5001))
+        self.assertEqual(self.users.name_of(["127.0.0.1", 5002]), "alice")
+        self.assertEqual(self.users.usernames(), ["alice", "bob"])
+
+        self.assertTrue(self.users.remove("bob"))
+        self.assertFalse(self.users.remove("bob"))
+        self.assertNotIn("bob", self.users)
+        self.assertIsNone(self.users.address_of("bob"))
+        self.assertEqual(self.users.name_of(("127.0.0.1", 5001)), "")
+        self.assertEqual(self.users.usernames(), ["alice"])
+
+    def test_taken(self):
+        self.users.join("bob", ("127.0.0.1", 5001))
+        self.assertEqual(self.users.join("bob", ("127.0.0.1", 5002)), registry.TAKEN)
+        self.assertEqual(self.users.address_of("bob"), ("127.0.0.1", 5001))
+        self.assertEqual(self.users.name_of(("127.0.0.1", 5002)), "")
+
+    def test_capacity(self):
+        for idx in range(3):
+            self.assertEqual(self.users.join("user%d" % idx, ("127.0.0.1", 5000 + idx)), registry.JOINED)
+        self.assertEqual(self.users.join("late", ("127.0.0.1", 6000)), registry.FULL)
+        # Full is checked first, even a taken name is turned away as full
+        self.assertEqual(self.users.join("user0", ("127.0.0.1", 6000)), registry.FULL)
+        self.users.remove("user1")
+        self.assertEqual(self.users.join("late", ("127.0.0.1", 6000)), registry.JOINED)
+
+    def test_rejoin_from_the_same_address(self):
+        address = ("127.0.0.1", 5001)
+        self.users.join("bob", address)
+        self.assertEqual(self.users.join("robert", address), registry.JOINED)
+        self.assertEqual(self.users.name_of(address), "robert")
+        # Dropping the old name leaves the address to the new one
+        self.assertTrue(self.users.remove("bob"))
+        self.assertEqual(self.users.name_of(address), "robert")
+        self.assertEqual(self.users.usernames(), ["robert"])
+        self.assertTrue(self.users.remove("robert"))
+        self.assertEqual(self.users.name_of(address), "")
+        self.assertEqual(len(self.users), 0)
+
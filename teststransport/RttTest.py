@@ -0,0 +1,89 @@
+import logging
+import socket
+import unittest
+import transport
+import util
+
+
+class RttTest(unittest.TestCase):
+    def test_jacobson_karels(self):
+        rtt = transport.RttEstimator()
+        self.assertEqual(rtt.rto(), util.TIME_OUT)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.srtt, 0.1)
+        self.assertAlmostEqual(rtt.rttvar, 0.05)
+        self.assertAlmostEqual(rtt.rto(), 0.3)
+        rtt.sample(0.2)
+        self.assertAlmostEqual(rtt.srtt, 0.1125)
+        self.assertAlmostEqual(rtt.rttvar, 0.0625)
+        self.assertAlmostEqual(rtt.rto(), 0.3625)
+
+    def test_min_max_rto(self):
+        rtt = transport.RttEstimator()
+        rtt.sample(0.001)
+        self.assertEqual(rtt.rto(), util.MIN_RTO)
+        rtt.sample(100)
+        self.assertEqual(rtt.rto(), util.MAX_RTO)
+
+    def test_backoff_once_per_episode(self):
+        rtt = transport.RttEstimator()
+        self.assertTrue(rtt.timeout())
+        self.assertEqual(rtt.rto(), 2 * util.TIME_OUT)
+        # The other timers of the window run out within the same episode
+        self.assertFalse(rtt.timeout())
+        self.assertFalse(rtt.timeout())
+        self.assertEqual(rtt.rto(), 2 * util.TIME_OUT)
+        self.assertEqual(rtt.timeouts, 3)
+        # Once the episode is over every timeout doubles the RTO again, up to MAX_RTO
+        for expected in [4 * util.TIME_OUT, 8 * util.TIME_OUT, util.MAX_RTO, util.MAX_RTO]:
+            rtt.episode_end = 0
+            self.assertTrue(rtt.timeout())
+            self.assertEqual(rtt.rto(), min(expected, util.MAX_RTO))
+        # A fresh sample ends the backoff
+        rtt.sample(0.1)
+        self.assertEqual(rtt.backoff, 0)
+        self.assertAlmostEqual(rtt.rto(), 0.3)
+
+
+class KarnTest(unittest.TestCase):
+    def setUp(self):
+        # Nothing ever ACKs, the test plays the receiver, and no receive thread fires the timers
+        self.sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sink.bind(("127.0.0.1", 0))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        logger = logging.getLogger("teststransport")
+        logger.setLevel(logging.WARNING)
+        self.endpoint = transport.Endpoint(sock, logger, 3)
+        self.port = self.sink.getsockname()[1]
+
+    def tearDown(self):
+        self.endpoint.sock.close()
+        self.sink.close()
+
+    def start(self, address):
+        transfer = transport.Transfer(self.endpoint, address, transport.Payload("send_message hello"))
+        transfer.pump()
+        return transfer
+
+    def test_sample_sent_once(self):
+        transfer = self.start(("127.0.0.1", self.port))
+        transfer.on_ack(transfer.starting_seq_num + 1)
+        self.assertEqual(transfer.rtt.samples, 1)
+
+    def test_no_sample_of_a_retransmission(self):
+        transfer = self.start(("127.0.0.1", self.port))
+        transfer.on_timeout(transfer.starting_seq_num)
+        self.assertEqual(transfer.rtt.backoff, 1)
+        # The ACK may be for either transmission, it is not timed and the backoff stays
+        transfer.on_ack(transfer.starting_seq_num + 1)
+        self.assertEqual(transfer.phase, 1)
+        self.assertEqual(transfer.rtt.samples, 0)
+        self.assertEqual(transfer.rtt.backoff, 1)
+
+    def test_one_estimator_per_resolved_address(self):
+        by_name = self.start(("localhost", self.port))
+        by_ip = self.start(("127.0.0.1", self.port))
+        self.assertIs(by_name.rtt, by_ip.rtt)
+        self.assertIs(by_name.cc, by_ip.cc)
+        self.assertEqual(list(self.endpoint.rtts), [("127.0.0.1", self.port)])
@@ -0,0 +1,84 @@
+import unittest
+import transport
+import util
+
+
+def window(num_pkts, size, mode, start=100):
+    '''
+    SendWindow over num_pkts packets numbered from start, with every packet that fits sent
+    '''
+    win = transport.SendWindow([(start + idx, "pkt%d" % idx) for idx in range(num_pkts)], size, mode)
+    win.to_send()
+    return win
+
+
+class SackTest(unittest.TestCase):
+    def test_sack_round_trip(self):
+        for received in [[], [0], [1], [1, 0, 1], [0, 0, 0, 1], [1] * util.SACK_BITS,
+                         [idx % 3 == 0 for idx in range(util.SACK_BITS)]]:
+            data = util.make_sack(received)
+            expected = [1001 + idx for idx, got in enumerate(received) if got]
+            self.assertEqual(util.parse_sack(1000, data), expected)
+
+    def test_sack_empty_when_nothing_out_of_order(self):
+        self.assertEqual(util.make_sack(bytearray(8)), "")
+        self.assertEqual(util.parse_sack(1000, ""), [])
+
+    def test_sack_garbage(self):
+        self.assertEqual(util.parse_sack(1000, "xyz"), [])
+
+    def test_flow_ack_for_holes(self):
+        flow = transport.Flow(("127.0.0.1", 1), 100, sack=True)
+        for seqno in [101, 102, 104, 106]:
+            flow.add(seqno, b"x")
+        ackno, data = flow.ack_for(106)
+        self.assertEqual(ackno, 103)
+        self.assertEqual(util.parse_sack(ackno, data), [104, 106])
+
+    def test_ack_cumulative_with_holes(self):
+        win = window(8, 8, transport.SELECTIVE_REPEAT)
+        # 100 and 101 arrived, 102 is missing and 103, 105 arrived after it
+        self.assertEqual(win.ack_cumulative(102, [103, 105]), [100, 101, 103, 105])
+        self.assertEqual(win.base, 2)
+        self.assertEqual(win.in_flight(), 4)
+        self.assertFalse(win.is_acked(102))
+        self.assertTrue(win.is_acked(103))
+        # The same ACK again confirms nothing new
+        self.assertEqual(win.ack_cumulative(102, [103, 105]), [])
+        # The hole is filled, everything below 104 is in along with 105 and 107
+        self.assertEqual(win.ack_cumulative(104, [105, 107]), [102, 107])
+        self.assertEqual(win.base, 4)
+        self.assertEqual(win.ack_cumulative(108), [104, 106])
+        self.assertTrue(win.done())
+
+    def test_ack_cumulative_ignores_what_was_not_sent(self):
+        win = window(8, 4, transport.SELECTIVE_REPEAT)
+        self.assertEqual(win.ack_cumulative(100, [101, 105, 200]), [101])
+        self.assertEqual(win.in_flight(), 3)
+
+    def test_selective_repeat_resends_only_the_expired_packet(self):
+        win = window(6, 6, transport.SELECTIVE_REPEAT)
+        win.ack(100)
+        win.ack(102)
+        self.assertEqual(win.expired(101), [(101, "pkt1")])
+        self.assertEqual(win.expired(103), [(103, "pkt3")])
+        self.assertEqual(win.expired(102), [])  # Already ACKed
+
+    def test_go_back_n_resends_everything_in_flight(self):
+        win = window(6, 4, transport.GO_BACK_N)
+        win.ack(100)
+        win.ack(102)
+        # Only the timer of the oldest packet counts
+        self.assertEqual(win.expired(103), [])
+        self.assertEqual(win.expired(101), [(101, "pkt1"), (103, "pkt3")])
+
+    def test_fast_retransmit_after_threshold(self):
+        for mode in transport.WINDOW_MODES:
+            win = window(8, 8, mode)
+            win.ack_cumulative(101, [102, 103])
+            self.assertEqual(win.lost(3), [])
+            win.ack_cumulative(101, [104])
+            self.assertEqual(win.lost(3), [(101, "pkt1")])
+            # Not reported again until as many packets sent after the resend overtook it
+            win.ack_cumulative(101, [105, 106, 107])
+            self.assertEqual(win.lost(3), [])
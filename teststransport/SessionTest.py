@@ -0,0 +1,65 @@
+import logging
+import socket
+import threading
+import time
+import unittest
+import transport
+import util
+
+
+def endpoint(options=None, **kwargs):
+    '''
+    An Endpoint on a loopback socket of its own, with its receive thread running
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    logger = logging.getLogger("teststransport")
+    logger.setLevel(logging.WARNING)
+    ep = transport.Endpoint(sock, logger, 3, options=options, **kwargs)
+    thread = threading.Thread(target=ep.recv_packet)
+    thread.daemon = True
+    thread.start()
+    return ep
+
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.client = endpoint(transport.Options(session=True))
+        self.server = endpoint()
+        self.address = self.server.sock.getsockname()
+
+    def tearDown(self):
+        self.client.sock.close()
+        self.server.sock.close()
+
+    def send(self, msgs):
+        '''
+        Send msgs over the session and check they all arrive, in order
+        '''
+        deliveries = [self.client.send_packet(msg, self.address) for msg in msgs]
+        for delivery in deliveries:
+            self.assertTrue(delivery.done.wait(10))
+            self.assertFalse(delivery.failed)
+        self.assertEqual([self.server.queue.get(timeout=10)[0] for _ in msgs], msgs)
+
+    def test_reuse_reap_reopen(self):
+        # Short messages and ones of several chunks share the one session and its single START
+        self.send(["send_message %d hello" % idx for idx in range(5)])
+        session = self.client.sessions[self.address]
+        self.send(["send_message %d " % idx + "x" * 3 * util.CHUNK_SIZE for idx in range(3)])
+        self.assertIs(self.client.sessions[self.address], session)
+        self.assertEqual(self.client.packets_out.get("start"), 1)
+
+        # Left idle for long enough, the next sweep tears it down
+        session.last_progress -= util.SESSION_IDLE + 1
+        self.client.timers.schedule(0, self.client.reap)
+        deadline = time.time() + 10
+        while self.address in self.client.sessions and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(self.address, self.client.sessions)
+        self.assertTrue(session.closed)
+
+        # The next message opens a new one, which the receiver takes in place of the old one
+        self.send(["send_message again %d" % idx for idx in range(3)])
+        self.assertIsNot(self.client.sessions[self.address], session)
+        self.assertEqual(self.client.packets_out.get("start"), 2)
@@ -0,0 +1,61 @@
+import unittest
+import transport
+
+
+class TimerTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = transport.TimerWheel(tick=0.01, num_slots=8)
+        self.fired = []
+
+    def schedule(self, delay, name):
+        return self.wheel.schedule(delay, self.fired.append, name)
+
+    def at(self, tick_no):
+        '''
+        A time in the middle of a tick, clear of rounding at its edges
+        '''
+        return (tick_no + 0.5) * self.wheel.tick
+
+    def test_fires_in_deadline_order(self):
+        late = self.schedule(0.05, "late")
+        early = self.schedule(0.02, "early")
+        self.assertEqual(len(self.wheel), 2)
+        # Nothing is due before the tick its deadline falls in
+        self.assertEqual(self.wheel.advance(self.at(early.tick_no - 1)), 0)
+        self.assertEqual(self.wheel.advance(self.at(early.tick_no)), 1)
+        self.assertEqual(self.fired, ["early"])
+        self.assertEqual(self.wheel.advance(self.at(late.tick_no)), 1)
+        self.assertEqual(self.fired, ["early", "late"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel(self):
+        timer = self.schedule(0.02, "cancelled")
+        kept = self.schedule(0.02, "kept")
+        self.wheel.cancel(timer)
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self.wheel.advance(self.at(kept.tick_no)), 1)
+        self.assertEqual(self.fired, ["kept"])
+        # Cancelling a timer that already fired or was cancelled does nothing
+        self.wheel.cancel(timer)
+        self.wheel.cancel(kept)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_longer_than_a_turn(self):
+        # 8 slots of 10ms, a timer 0.2s out shares its slot with earlier ticks and waits for its own
+        timer = self.schedule(0.2, "far")
+        self.assertEqual(self.wheel.advance(self.at(timer.tick_no - 8)), 0)
+        self.assertEqual(self.wheel.advance(self.at(timer.tick_no)), 1)
+        self.assertEqual(self.fired, ["far"])
+
+    def test_falling_behind(self):
+        for delay in [0.01, 0.05, 0.3, 1.0]:
+            self.schedule(delay, delay)
+        self.assertEqual(self.wheel.advance(self.at(self.wheel.current + 500)), 4)
+        self.assertEqual(sorted(self.fired), [0.01, 0.05, 0.3, 1.0])
+
+    def test_callbacks_schedule_more(self):
+        self.wheel.schedule(0.01, lambda: self.schedule(0, "again"))
+        self.wheel.advance(self.at(self.wheel.current + 5))
+        self.assertEqual(len(self.wheel), 1)
+        self.wheel.advance(self.at(self.wheel.current + 5))
+        self.assertEqual(self.fired, ["again"])
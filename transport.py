@@ -0,0 +1,1984 @@
+'''
+This module contains the reliable transport pieces that are shared by the Server and the Client
+'''
+import asyncio
+import collections
+import ipaddress
+import math
+import queue
+import random
+import socket
+import threading
+import time
+import zlib
+import logconfig
+import metrics
+import util
+
+GO_BACK_N = "gbn"
+SELECTIVE_REPEAT = "sr"
+WINDOW_MODES = [GO_BACK_N, SELECTIVE_REPEAT]
+
+RENO = "reno"
+CUBIC = "cubic"
+NO_CONGESTION_CONTROL = "none"
+CONGESTION_CONTROLS = [RENO, CUBIC, NO_CONGESTION_CONTROL]
+
+THREADS = "threads"
+ASYNCIO = "asyncio"
+ENGINES = [THREADS, ASYNCIO]
+
+
+BINARY_OPTION = str(util.BINARY_VERSION & 0x7f)  # Version of the binary packet format we speak
+SACK_OPTION = "1"  # Version of cumulative and selective ACKs we speak
+BATCH_OPTION = "1"  # Version of the multi-message envelope we speak
+MSG_OPTION = "1"  # Version of single-datagram messages we speak
+SESSION_OPTION = "1"  # Version of per-peer sessions we speak
+ZIP_OPTION = "1"  # Version of per-message compression we speak
+AUTO_DATAGRAM = "auto"  # Offer util.MAX_CHUNK_SIZE to peers on the loopback interface, the default size to others
+
+
+class Options:
+    '''
+    Optional transport features. They are negotiated on START, so everything stays on the plain
+    text protocol unless both ends speak the feature and the sender asks for it.
+    '''
+
+    def __init__(self, binary=False, sack=False, single=False, session=False, checksum=util.CRC32, compress=0,
+                 datagram=0):
+        self.binary = binary  # Offer the binary packet format
+        self.checksum = checksum  # Checksum to offer for the binary packets
+        self.compress = compress  # zlib level to compress large messages with, 0 to not offer compression
+        self.datagram = datagram  # Payload bytes per packet to offer, AUTO_DATAGRAM, or 0 for util.CHUNK_SIZE
+        self.sack = sack  # Offer cumulative and selective ACKs
+        self.single = single  # Offer single-datagram messages
+        self.session = session  # Send everything to a peer over one Session, offered by its START only
+
+    def offer(self, address=None):
+        '''
+        Options a sender asks for in the START packets it sends to address
+        '''
+        offer = dict()
+        if self.binary:
+            offer["bin"] = BINARY_OPTION
+            if self.checksum != util.CRC32:
+                offer["sum"] = self.checksum
+        if self.sack:
+            offer["sack"] = SACK_OPTION
+        if self.single:
+            offer["msg"] = MSG_OPTION
+        if self.compress:
+            offer["zip"] = ZIP_OPTION
+        size = self.datagram
+        if size == AUTO_DATAGRAM:
+            size = util.MAX_CHUNK_SIZE if address is not None and is_loopback(address) else 0
+        if size:
+            offer["dgram"] = str(size)
+        return offer
+
+    def accept(self, offer):
+        '''
+        Options a receiver grants from the offer in a START packet
+        '''
+        accepted = dict()
+        if offer.get("bin") == BINARY_OPTION:
+            accepted["bin"] = BINARY_OPTION
+            if offer.get("sum") in util.CHECKSUMS:
+                accepted["sum"] = offer["sum"]
+        if offer.get("sack") == SACK_OPTION:
+            accepted["sack"] = SACK_OPTION
+        if offer.get("batch") == BATCH_OPTION:
+            accepted["batch"] = BATCH_OPTION
+        if offer.get("msg") == MSG_OPTION:
+            accepted["msg"] = MSG_OPTION
+        if offer.get("sess") == SESSION_OPTION:
+            accepted["sess"] = SESSION_OPTION
+        if offer.get("zip") == ZIP_OPTION:
+            accepted["zip"] = ZIP_OPTION
+        if offer.get("dgram", "").isdigit() and int(offer["dgram"]) > 0:
+            accepted["dgram"] = str(min(int(offer["dgram"]), util.MAX_CHUNK_SIZE))
+        return accepted
+
+
+def is_loopback(address):
+    '''
+    Whether a peer address is on the loopback interface, where datagrams are never fragmented or lost on a link
+    '''
+    try:
+        return ipaddress.ip_address(address[0]).is_loopback
+    except ValueError:
+        return address[0] == "localhost"
+
+
+class SendWindow:
+    '''
+    Sliding window over a run of packets of a single message.
+    At most `size` packets are in flight at any time and the window slides forward as ACKs arrive.
+    In Go-Back-N mode only the oldest packet's timer counts and its expiry resends every packet
+    in flight, in Selective-Repeat mode each packet is resent on its own timer.
+    '''
+
+    def __init__(self, pkts, size, mode=SELECTIVE_REPEAT):
+        if mode not in WINDOW_MODES:
+            raise ValueError("Unknown window mode: " + str(mode))
+        self.pkts = pkts  # List of (seqno, pkt) in sending order
+        self.index = dict()  # Mappings from seqno to position in pkts
+        for idx, (seqno, _) in enumerate(pkts):
+            self.index[seqno] = idx
+        self.size = max(1, int(size))
+        self.mode = mode
+        self.base = 0  # Index of the oldest packet that has not been ACKed
+        self.next = 0  # Index of the next packet that has never been sent
+        self.acked = set()  # Indexes of packets that have been ACKed
+        self.marks = dict()  # Mappings from index to the first index whose ACK means it was overtaken
+
+    def done(self):
+        '''
+        True once every packet in the window has been ACKed
+        '''
+        return self.base == len(self.pkts)
+
+    def ack(self, seqno):
+        '''
+        Mark the packet with this seqno as ACKed and slide the window past it.
+        Returns False if the packet was not in flight.
+        '''
+        idx = self.index.get(seqno)
+        if idx is None or idx < self.base or idx >= self.next or idx in self.acked:
+            return False
+        self.acked.add(idx)
+        while self.base < self.next and self.base in self.acked:
+            self.acked.discard(self.base)
+            self.marks.pop(self.base, None)
+            self.base += 1
+        return True
+
+    def lost(self, threshold):
+        '''
+        Return the (seqno, pkt) pairs still in flight that at least threshold packets sent after them
+        overtook, they are resent right away instead of waiting for their timer.
+        A packet is only reported again once as many packets sent after its last transmission overtook it.
+        '''
+        # overtaking[i] is the number of ACKed packets from index base + i on
+        overtaking = [0] * (self.next - self.base + 1)
+        for idx in range(self.next - 1, self.base - 1, -1):
+            overtaking[idx - self.base] = overtaking[idx - self.base + 1] + (idx in self.acked)
+        lost = []
+        for idx in range(self.base, self.next):
+            if idx in self.acked:
+                continue
+            if overtaking[self.marks.get(idx, idx + 1) - self.base] >= threshold:
+                self.marks[idx] = self.next
+                lost.append(self.pkts[idx])
+        return lost
+
+    def ack_cumulative(self, ackno, sacked=()):
+        '''
+        A cumulative ACK confirms every packet below ackno, and the selective part every seqno in sacked.
+        Returns the seqnos that were newly ACKed, in ascending order.
+        '''
+        acked = []
+        for idx in range(self.base, self.next):
+            seqno = self.pkts[idx][0]
+            if seqno >= ackno:
+                break
+            if idx not in self.acked:
+                acked.append(seqno)
+        for seqno in sacked:
+            idx = self.index.get(seqno)
+            if idx is not None and self.base <= idx < self.next and idx not in self.acked \
+                    and seqno not in acked:
+                acked.append(seqno)
+        for seqno in acked:
+            self.ack(seqno)
+        acked.sort()
+        return acked
+
+    def is_acked(self, seqno):
+        '''
+        True if the packet with this seqno does not need to be sent anymore
+        '''
+        idx = self.index.get(seqno)
+        return idx is None or idx < self.base or idx in self.acked
+
+    def extend(self, pkts):
+        '''
+        Add (seqno, pkt) pairs at the end, for windows that keep growing
+        '''
+        for seqno, pkt in pkts:
+            self.index[seqno] = len(self.pkts)
+            self.pkts.append((seqno, pkt))
+
+    def compact(self):
+        '''
+        Forget the packets that are already ACKed, the window starts over at the oldest one that is not
+        '''
+        if self.base == 0:
+            return
+        for seqno, _ in self.pkts[:self.base]:
+            del self.index[seqno]
+        del self.pkts[:self.base]
+        for seqno, idx in self.index.items():
+            self.index[seqno] = idx - self.base
+        self.acked = set(idx - self.base for idx in self.acked)
+        self.marks = dict((idx - self.base, mark - self.base) for idx, mark in self.marks.items())
+        self.next -= self.base
+        self.base = 0
+
+    def can_send(self):
+        '''
+        True if there is a new packet that fits in the window
+        '''
+        return self.next < len(self.pkts) and self.next < self.base + self.size
+
+    def in_flight(self):
+        '''
+        Number of packets sent and not ACKed yet
+        '''
+        return self.next - self.base - len(self.acked)
+
+    def to_send(self, limit=None):
+        '''
+        Return the new (seqno, pkt) pairs that fit in the window, at most limit of them, and mark them as sent
+        '''
+        pkts = []
+        while self.can_send() and (limit is None or len(pkts) < limit):
+            pkts.append(self.pkts[self.next])
+            self.next += 1
+        return pkts
+
+    def expired(self, seqno):
+        '''
+        The timer of a packet ran out, return the (seqno, pkt) pairs that have to be resent
+        '''
+        if self.is_acked(seqno):
+            return []
+        if self.mode == GO_BACK_N:
+            if self.index[seqno] != self.base:
+                return []
+            # Go back and resend everything in flight that is still missing its ACK
+            resend = [idx for idx in range(self.base, self.next) if idx not in self.acked]
+        else:
+            resend = [self.index[seqno]]
+        for idx in resend:
+            self.marks[idx] = self.next
+        return [self.pkts[idx] for idx in resend]
+
+
+class RttEstimator:
+    '''
+    Retransmission timeout for one peer, estimated from measured round trip times the
+    Jacobson/Karels way (RFC 6298). Only packets sent exactly once are sampled (Karn's rule),
+    and every loss episode doubles the RTO until a fresh sample comes in.
+    '''
+    ALPHA = 0.125  # Gain of the smoothed RTT
+    BETA = 0.25  # Gain of the RTT variation
+    K = 4
+
+    def __init__(self, initial=util.TIME_OUT):
+        self.srtt = None
+        self.rttvar = None
+        self.base_rto = initial  # RTO computed from the samples, without backoff
+        self.backoff = 0  # Number of timeouts since the last sample
+        self.episode_end = 0  # Timers running out before this time belong to the episode we already backed off for
+        self.samples = 0
+        self.timeouts = 0
+        self.last_used = time.time()
+
+    def rto(self):
+        '''
+        Current retransmission timeout in seconds, including backoff
+        '''
+        return min(self.base_rto * (2 ** self.backoff), util.MAX_RTO)
+
+    def sample(self, rtt):
+        '''
+        Feed the round trip time of a packet that was only transmitted once
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + \
+                self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.base_rto = min(max(self.srtt + max(util.TIMER_TICK, self.K * self.rttvar),
+                                util.MIN_RTO), util.MAX_RTO)
+        self.backoff = 0
+        self.episode_end = 0
+        self.samples += 1
+
+    def timeout(self):
+        '''
+        A retransmission timer ran out, back off exponentially once per loss episode. The timers of a
+        window all run out within one RTO of the first, a retransmission only after the doubled one.
+        Returns whether this timeout started a new episode.
+        '''
+        self.timeouts += 1
+        now = time.time()
+        if now < self.episode_end:
+            return False
+        self.episode_end = now + self.rto()
+        if self.rto() < util.MAX_RTO:
+            self.backoff += 1
+        return True
+
+    def stats(self):
+        '''
+        Snapshot of the estimator state
+        '''
+        return {"srtt": self.srtt, "rttvar": self.rttvar, "rto": self.rto(),
+                "backoff": self.backoff, "samples": self.samples, "timeouts": self.timeouts}
+
+
+class CongestionControl:
+    '''
+    Congestion window for one peer, shared by every transfer to it, the NewReno way (RFC 5681):
+    slow start up to ssthresh, then one more packet per window worth of ACKs, half the window on a
+    fast retransmit and back to one packet on a timeout. Only new packets are held to the window,
+    retransmissions always go out. Transfers that ran into the window wait in `blocked` until ACKs
+    make room, and when the RTT leaves more than a timer tick between two packets they are paced.
+    '''
+
+    def __init__(self, rtt, enabled=True):
+        self.rtt = rtt  # RttEstimator of the same peer
+        self.enabled = enabled  # When off the window never closes
+        self.cwnd = float(util.INITIAL_CWND)
+        self.ssthresh = float("inf")
+        self.in_flight = 0  # Packets sent and not ACKed yet, across every transfer to the peer
+        self.recovery_end = 0  # Losses before this time belong to the episode we already reacted to
+        self.next_send = 0  # Earliest time the next packet may go out
+        self.blocked = collections.OrderedDict()  # Transfers waiting for room in the window
+        self.losses = 0
+        self.last_used = time.time()
+
+    def available(self):
+        '''
+        Number of new packets the window has room for
+        '''
+        if not self.enabled:
+            return util.MAX_CWND
+        return max(0, int(self.cwnd) - self.in_flight)
+
+    def limit(self, size):
+        '''
+        Most packets a window of this size can have in flight under the congestion window
+        '''
+        if not self.enabled:
+            return size
+        return max(1, min(size, int(self.cwnd)))
+
+    def pace(self, now):
+        '''
+        Seconds to wait before the next packet may go out
+        '''
+        if not self.enabled or self.rtt.srtt is None:
+            return 0
+        return max(0, self.next_send - now)
+
+    def sent(self, now, tick):
+        '''
+        A new packet went out
+        '''
+        self.in_flight += 1
+        self.last_used = now
+        if self.enabled and self.rtt.srtt is not None:
+            interval = self.rtt.srtt / self.cwnd
+            # Spacing packets closer than the timers can fire would only add latency
+            self.next_send = max(self.next_send, now) + interval if interval >= tick else 0
+
+    def on_ack(self, acked):
+        '''
+        acked packets were ACKed, open the window
+        '''
+        self.in_flight = max(0, self.in_flight - acked)
+        self.last_used = time.time()
+        if self.cwnd < self.ssthresh:  # Slow start
+            self.cwnd = min(self.cwnd + acked, self.ssthresh)
+        else:
+            self.increase(acked)
+        self.cwnd = min(self.cwnd, util.MAX_CWND)
+
+    def increase(self, acked):
+        '''
+        Congestion avoidance, one packet per window worth of ACKs
+        '''
+        self.cwnd += float(acked) / self.cwnd
+
+    def on_loss(self):
+        '''
+        A packet was fast-retransmitted, cut the window once per loss episode
+        '''
+        now = time.time()
+        if now < self.recovery_end:
+            return
+        self.losses += 1
+        self.decrease()
+        self.recovery_end = now + (self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto())
+
+    def decrease(self):
+        '''
+        Multiplicative decrease, half the window
+        '''
+        self.ssthresh = max(self.in_flight / 2.0, util.MIN_CWND * 2.0)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        '''
+        A retransmission timer ran out, nothing is getting through, start over from one packet.
+        More timeouts of the same episode leave ssthresh where the first one put it.
+        '''
+        now = time.time()
+        if now >= self.recovery_end:
+            self.losses += 1
+            self.ssthresh = max(self.in_flight / 2.0, util.MIN_CWND * 2.0)
+        self.cwnd = float(util.MIN_CWND)
+        self.recovery_end = now + self.rtt.rto()
+
+    def wake(self):
+        '''
+        Let the transfers that ran into the window go on, for as long as there is room
+        '''
+        while self.blocked and self.available() > 0:
+            transfer, _ = self.blocked.popitem(last=False)
+            transfer.pump()
+
+    def release(self, acked):
+        '''
+        Packets of a transfer that gave up will never be ACKed, they are not in flight anymore
+        and the transfers that ran into the window can have their room
+        '''
+        self.in_flight = max(0, self.in_flight - acked)
+        self.wake()
+
+    def stats(self):
+        '''
+        Snapshot of the congestion state
+        '''
+        return {"cwnd": self.cwnd, "ssthresh": self.ssthresh, "in_flight": self.in_flight,
+                "losses": self.losses, "blocked": len(self.blocked)}
+
+
+class Cubic(CongestionControl):
+    '''
+    CUBIC (RFC 8312): after a loss the window grows along a cubic curve of the time since, back to
+    where the loss happened and then past it, never slower than Reno would.
+    '''
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, rtt, enabled=True):
+        CongestionControl.__init__(self, rtt, enabled)
+        self.w_max = 0.0  # Window when the last loss happened
+        self.epoch = None  # Time the current growth period started
+
+    def increase(self, acked):
+        now = time.time()
+        if self.epoch is None:
+            self.epoch = now
+            self.w_max = max(self.w_max, self.cwnd)
+        rtt = self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto()
+        k = ((self.w_max * (1 - self.BETA)) / self.C) ** (1.0 / 3)
+        elapsed = now - self.epoch + rtt
+        target = self.C * (elapsed - k) ** 3 + self.w_max
+        reno = self.w_max * self.BETA + 3 * (1 - self.BETA) / (1 + self.BETA) * (now - self.epoch) / max(rtt, 1e-6)
+        target = max(target, reno)
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+
+    def decrease(self):
+        self.w_max = self.cwnd
+        self.epoch = None
+        self.cwnd = max(self.cwnd * self.BETA, util.MIN_CWND * 2.0)
+        self.ssthresh = self.cwnd
+
+    def on_timeout(self):
+        if time.time() >= self.recovery_end:
+            self.w_max = self.cwnd
+        self.epoch = None
+        CongestionControl.on_timeout(self)
+
+
+class BufferPool:
+    '''
+    Preallocated receive buffers. A reader recv_into()s one of them and only hands out memoryviews,
+    so the bytes of a datagram are not copied until its payload goes into the reassembly buffer.
+    '''
+
+    def __init__(self, count=2, size=util.RECV_BUFFER_SIZE):
+        self.size = size
+        self.free = [bytearray(size) for _ in range(count)]
+        self.lock = threading.Lock()
+
+    def get(self):
+        '''
+        Take a buffer out of the pool, allocating a new one if it ran dry
+        '''
+        self.lock.acquire()
+        buf = self.free.pop() if self.free else bytearray(self.size)
+        self.lock.release()
+        return buf
+
+    def put(self, buf):
+        '''
+        Give a buffer back once nothing points into it anymore
+        '''
+        self.lock.acquire()
+        self.free.append(buf)
+        self.lock.release()
+
+
+class Timer:
+    '''
+    A single callback scheduled on a TimerWheel
+    '''
+
+    def __init__(self, deadline, tick_no, callback, args):
+        self.deadline = deadline
+        self.tick_no = tick_no  # Absolute tick in which the timer fires
+        self.callback = callback
+        self.args = args
+
+
+class TimerWheel:
+    '''
+    Hashed timer wheel. Time is cut into ticks of `tick` seconds and every timer is hashed into the
+    slot of the tick its deadline falls in, so scheduling and cancelling are O(1) no matter how many
+    timers are outstanding. Whoever owns the wheel calls advance() regularly to fire the due timers.
+    '''
+
+    def __init__(self, tick=util.TIMER_TICK, num_slots=util.TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [set() for _ in range(num_slots)]
+        self.current = int(time.time() / tick)  # Last tick that has been processed
+        self.count = 0  # Number of timers outstanding
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback, *args):
+        '''
+        Call callback(*args) after delay seconds, returns the Timer so it can be cancelled
+        '''
+        deadline = time.time() + delay
+        self.lock.acquire()
+        tick_no = max(int(math.ceil(deadline / self.tick)), self.current + 1)
+        timer = Timer(deadline, tick_no, callback, args)
+        self.slots[tick_no % len(self.slots)].add(timer)
+        self.count += 1
+        self.lock.release()
+        return timer
+
+    def cancel(self, timer):
+        '''
+        Stop a timer from firing, does nothing if it already fired
+        '''
+        self.lock.acquire()
+        slot = self.slots[timer.tick_no % len(self.slots)]
+        if timer in slot:
+            slot.discard(timer)
+            self.count -= 1
+        self.lock.release()
+
+    def advance(self, now):
+        '''
+        Fire every timer whose tick has passed, returns how many fired
+        '''
+        due = []
+        self.lock.acquire()
+        target = int(now / self.tick)
+        # If we fell a whole turn behind, every slot only has to be looked at once
+        last = min(target, self.current + len(self.slots))
+        for tick_no in range(self.current + 1, last + 1):
+            slot = self.slots[tick_no % len(self.slots)]
+            expired = [timer for timer in slot if timer.tick_no <= target]
+            for timer in expired:
+                slot.discard(timer)
+            due.extend(expired)
+        self.count -= len(due)
+        self.current = max(self.current, target)
+        self.lock.release()
+        # Callbacks run without the wheel lock so they are free to schedule new timers
+        for timer in due:
+            timer.callback(*timer.args)
+        return len(due)
+
+
+class LoopTimers:
+    '''
+    Same interface as the TimerWheel on top of the timers of an asyncio event loop.
+    The loop fires them on its own, so there is nothing to advance.
+    '''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.tick = util.TIMER_TICK
+
+    def schedule(self, delay, callback, *args):
+        '''
+        Call callback(*args) after delay seconds, returns the handle so it can be cancelled
+        '''
+        return self.loop.call_later(delay, callback, *args)
+
+    def cancel(self, timer):
+        '''
+        Stop a timer from firing, does nothing if it already fired
+        '''
+        timer.cancel()
+
+    def advance(self, now):
+        '''
+        Nothing to do, the loop already fired whatever was due
+        '''
+        return 0
+
+
+class Flow:
+    '''
+    Receive state of one message from one peer, from its START packet to its END packet.
+    Flows are keyed by (peer address, START seqno) and freed as soon as the message is complete.
+    Payloads go into slots by seqno next to a bitmap of the slots received and a count of the ones
+    still missing, so the packet that fills the last gap completes the flow in O(1).
+    '''
+
+    def __init__(self, address, start_seq, sack=False, batch=False, zip=False):
+        self.address = address
+        self.start_seq = start_seq
+        self.end_seq = None  # Unknown until the END packet arrives
+        self.sack = sack  # The sender takes cumulative and selective ACKs
+        self.batch = batch  # The message is a batch of messages packed by util.make_batch
+        self.zip = zip  # The message starts with the flag byte of Endpoint.pack
+        self.chunks = []  # Payload of every DATA packet, in seqno order
+        self.received = bytearray()  # 1 for every slot of chunks that arrived
+        self.first_missing = 0  # Every slot of chunks below this one arrived
+        self.count = 0  # Number of DATA packets received
+        self.owed = 0  # DATA packets whose ACK is being held back
+        self.ack_timer = None  # Sends the held back ACK once the delay is over
+        self.binary = None  # Checksum of the binary DATA packets, None for text, the ACKs go out in the same
+        self.missing = None  # Number of DATA packets still missing, known once the END arrived
+        self.end_payload = b""
+        self.last_seen = time.time()
+
+    def owns(self, seqno):
+        '''
+        True if a packet with this seqno can belong to this flow
+        '''
+        if self.end_seq is not None:
+            return self.start_seq < seqno <= self.end_seq
+        return self.start_seq < seqno <= self.start_seq + util.MAX_FLOW_CHUNKS
+
+    def add(self, seqno, payload):
+        '''
+        Store the payload of a DATA packet, returns True if it completed the message
+        '''
+        idx = seqno - self.start_seq - 1
+        if idx >= len(self.received):
+            grow = idx + 1 - len(self.received)
+            self.chunks.extend([None] * grow)
+            self.received.extend(bytes(grow))
+        if self.received[idx]:  # Duplicate
+            return False
+        self.received[idx] = 1
+        self.chunks[idx] = payload
+        self.count += 1
+        while self.first_missing < len(self.received) and self.received[self.first_missing]:
+            self.first_missing += 1
+        if self.missing is not None:
+            self.missing -= 1
+        return self.missing == 0
+
+    def ack_for(self, seqno):
+        '''
+        The (ACK number, ACK data) that answers a DATA packet with this seqno.
+        With SACK that is the first seqno still missing, along with a bitmap of what arrived after it.
+        '''
+        if not self.sack:
+            return seqno + 1, ""
+        after = self.first_missing + 1
+        sacked = self.received[after:after + util.SACK_BITS]
+        return self.start_seq + 1 + self.first_missing, util.make_sack(sacked)
+
+    def end(self, seqno, payload):
+        '''
+        The END packet tells how many DATA packets there are, returns True if none are missing
+        '''
+        self.end_seq = seqno
+        self.end_payload = payload
+        self.missing = seqno - self.start_seq - 1 - self.count
+        return self.missing == 0
+
+    def message(self):
+        '''
+        The payload of the whole message, only valid once it is complete
+        '''
+        if self.end_payload:
+            return b"".join(self.chunks + [self.end_payload])
+        return b"".join(self.chunks)
+
+
+class SessionFlow:
+    '''
+    Receive side of a Session, one run of seqnos from a peer that END packets cut into messages.
+    Packets that arrive ahead of the next one in order wait in `ahead` and everything is delivered in order.
+    '''
+
+    def __init__(self, address, start_seq, sack=False, zip=False):
+        self.address = address
+        self.start_seq = start_seq
+        self.next_seq = start_seq + 1  # First seqno that has not arrived in order yet
+        self.sack = sack  # The sender takes cumulative and selective ACKs
+        self.zip = zip  # Every message starts with the flag byte of Endpoint.pack
+        self.ahead = dict()  # Mappings from seqno to (type, payload) of the packets past a gap
+        self.parts = []  # Payloads of the message being received, in order
+        self.last_seen = time.time()
+
+    def owns(self, seqno):
+        '''
+        True if a packet with this seqno can belong to the session
+        '''
+        return self.start_seq < seqno <= self.next_seq + util.MAX_FLOW_CHUNKS
+
+    def add(self, seqno, msg_type, payload):
+        '''
+        Store a DATA or END packet, returns the payloads of the messages it completed
+        '''
+        if seqno < self.next_seq or seqno in self.ahead:  # Duplicate
+            return []
+        self.ahead[seqno] = (msg_type, payload)
+        msgs = []
+        while self.next_seq in self.ahead:
+            msg_type, payload = self.ahead.pop(self.next_seq)
+            self.next_seq += 1
+            self.parts.append(payload)
+            if msg_type == "end":
+                msgs.append(b"".join(self.parts))
+                self.parts = []
+        return msgs
+
+    def ack_for(self, seqno):
+        '''
+        The (ACK number, ACK data) that answers a packet with this seqno, like Flow.ack_for
+        '''
+        if not self.sack:
+            return seqno + 1, ""
+        sacked = bytearray()
+        if self.ahead:
+            span = min(max(self.ahead) - self.next_seq, util.SACK_BITS)
+            sacked = bytearray(self.next_seq + 1 + idx in self.ahead for idx in range(span))
+        return self.next_seq, util.make_sack(sacked)
+
+
+class Payload:
+    '''
+    A message cut into the payloads of its DATA packets and encoded once.
+    The same Payload can go out to any number of peers, only the headers and checksums differ.
+    Chunks are cut from the encoded bytes, a character may straddle two of them since the receiver
+    only decodes the whole message.
+    '''
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.data = msg.encode('utf-8')
+        # Mappings from compression level to the bytes Endpoint.pack made, and from (level, chunk size) to their chunks
+        self.packed = dict()
+        self.sized = dict()  # Mappings from chunk size to the chunks of that size
+        self.chunks = self.chunks_for(util.CHUNK_SIZE)
+
+    def chunks_for(self, size):
+        '''
+        The message cut into chunks of at most size bytes, cut once per size
+        '''
+        chunks = self.sized.get(size)
+        if chunks is None:
+            chunks = [self.data[i:i + size] for i in range(0, len(self.data), size)]
+            self.sized[size] = chunks
+        return chunks
+
+
+class Batch:
+    '''
+    Messages to one peer that a Coalescer packs into a single transfer.
+    The transfer offers the batch option on START, and only if the receiver takes it do the messages go
+    out as one util.make_batch envelope, otherwise the batch must hold a single message that goes out plain.
+    '''
+
+    def __init__(self, msgs=None):
+        self.msgs = msgs if msgs is not None else []
+        self.size = sum(len(msg) for msg in self.msgs)  # Characters of all the messages
+        self.timer = None  # Sends the batch once the coalescing delay is over
+        self.failed = False  # Set when the transfer carrying the batch was given up on
+        self.done = threading.Event()
+
+    def add(self, msg):
+        self.msgs.append(msg)
+        self.size += len(msg)
+
+    def payload(self, batched):
+        '''
+        The Payload to send, batched says whether the receiver took the batch option
+        '''
+        if batched:
+            return Payload(util.make_batch(self.msgs))
+        if len(self.msgs) != 1:
+            raise ValueError("A peer without the batch option takes one message per transfer")
+        return Payload(self.msgs[0])
+
+
+class Coalescer:
+    '''
+    Nagle-style coalescing of messages to the same peer. The first message to an idle peer waits up to
+    `delay` for others to join it, and while a batch is in flight everything new waits until it is ACKed,
+    so there is never more than one batch in flight per peer and messages arrive in the order they were sent.
+    Peers are sent one message per transfer until one of them took the batch option.
+    Everything runs with the endpoint mutex held.
+    '''
+
+    def __init__(self, endpoint, delay):
+        self.endpoint = endpoint
+        self.delay = delay
+        self.waiting = dict()  # Mappings from address to the Batch collecting messages
+        self.in_flight = dict()  # Mappings from address to the Transfer of its batch in flight
+        self.batching = set()  # Addresses of peers that took the batch option
+        self.batches_sent = 0
+        self.msgs_sent = 0
+
+    def add(self, msg, address):
+        '''
+        Queue a message for a peer, returns the Batch it went into
+        '''
+        batch = self.waiting.get(address)
+        if batch is None:
+            batch = Batch()
+            self.waiting[address] = batch
+            if address not in self.in_flight:
+                batch.timer = self.endpoint.timers.schedule(self.delay, self.endpoint.flush_batch, address)
+        batch.add(msg)
+        if batch.size >= util.MAX_BATCH_SIZE and address not in self.in_flight:
+            self.flush(address)  # A full batch has nothing to wait for
+        return batch
+
+    def flush(self, address):
+        '''
+        Send what is waiting for a peer, unless a batch to it is still in flight
+        '''
+        batch = self.waiting.get(address)
+        if batch is None or address in self.in_flight:
+            return
+        if batch.timer is not None:
+            self.endpoint.timers.cancel(batch.timer)
+            batch.timer = None
+        if address in self.batching or len(batch.msgs) == 1:
+            del self.waiting[address]
+            sending = batch
+        else:  # Not known to take batches yet, send the first message alone, the rest waits for its ACK
+            sending = Batch(batch.msgs[:1])
+            batch.msgs = batch.msgs[1:]
+            batch.size -= sending.size
+        transfer = Transfer(self.endpoint, address, sending)
+        self.in_flight[address] = transfer
+        self.batches_sent += 1
+        self.msgs_sent += len(sending.msgs)
+        self.endpoint.transfers.add(transfer)
+        transfer.add_done_callback(lambda transfer: self.on_done(transfer, sending))
+        transfer.pump()
+
+    def on_done(self, transfer, batch):
+        '''
+        The batch in flight to a peer is ACKed (or given up on), what waited for it can go
+        '''
+        del self.in_flight[transfer.address]
+        if transfer.accepted.get("batch") == BATCH_OPTION:
+            self.batching.add(transfer.address)
+        batch.failed = transfer.failed
+        batch.done.set()
+        self.flush(transfer.address)
+
+    def stats(self):
+        return {"batches": self.batches_sent, "msgs": self.msgs_sent}
+
+
+def chunk_size(accepted):
+    '''
+    Payload bytes per packet to a receiver that accepted these options
+    '''
+    return int(accepted.get("dgram", util.CHUNK_SIZE))
+
+
+class Transfer:
+    '''
+    A single message being sent reliably to one address.
+    The message goes out in three phases, the START packet, the DATA packets and the END packet.
+    Each phase is sent through its own SendWindow and only starts once the previous one is fully ACKed.
+    A transfer is driven entirely by ACKs and timers on the receive thread, nothing waits on it
+    unless it chooses to through `done`.
+    A message of at most one chunk to a peer that took single-datagram messages on an earlier START
+    skips all three phases and goes out as one msg packet, in the format and chunk size the peer took back then.
+    '''
+
+    def __init__(self, endpoint, address, payload, session=False):
+        self.endpoint = endpoint
+        self.address = endpoint.resolve(address)  # What its ACKs come from
+        self.payload = payload
+        self.batch = payload if isinstance(payload, Batch) else None
+        # Shared with every other transfer of the same Payload, a batch only knows its chunks after START
+        self.chunks = payload.chunks if isinstance(payload, Payload) else []
+        # Choose random sequence number start
+        self.starting_seq_num = random.randint(10000, 10000000)
+        # The START packet carries the options we would like, its ACK carries the ones the receiver took
+        offer = endpoint.options.offer(address)
+        if self.batch is not None:
+            offer["batch"] = BATCH_OPTION
+        if session:
+            offer["sess"] = SESSION_OPTION
+        start_pkts = [(self.starting_seq_num, util.make_packet(
+            msg_type="start", msg=util.make_options(offer), seqno=self.starting_seq_num).encode('utf-8'))]
+        self.accepted = dict()
+        self.phases = [SendWindow(start_pkts, 1, endpoint.mode)]
+        self.single = False  # Sent as a single msg packet
+        known = endpoint.peers.get(self.address)
+        if known is not None and isinstance(payload, Payload) and len(payload.chunks_for(chunk_size(known))) <= 1:
+            self.single = True
+            self.accepted = known
+            self.chunks = payload.chunks_for(chunk_size(known))
+            msg_pkt = self.make_packet("msg", self.starting_seq_num, self.chunks[0] if self.chunks else b"")
+            self.phases = [SendWindow([(self.starting_seq_num, msg_pkt)], 1, endpoint.mode)]
+        self.phase = 0
+        self.timers = dict()  # Mappings from seqno to its retransmission timer
+        self.sent_at = dict()  # Mappings from seqno to time of first transmission
+        self.resent = set()  # Seqnos that went out more than once, their RTT is ambiguous
+        self.rtt = endpoint.get_rtt(self.address)
+        self.cc = endpoint.get_congestion(self.address)
+        self.pace_timer = None  # Set while pacing holds the next packet back
+        self.started = self.last_progress = time.time()
+        self.failed = False  # Set when the transfer was given up on
+        self.done = threading.Event()
+        self.callbacks = []  # Called with the transfer once it is done
+
+    def make_packet(self, msg_type, seqno, msg=b""):
+        '''
+        Build a packet in the format negotiated on START around an already encoded msg
+        '''
+        if self.accepted.get("bin") == BINARY_OPTION:
+            return util.make_binary_packet(msg_type=msg_type, seqno=seqno, msg=msg,
+                                           checksum=self.accepted.get("sum", util.CRC32))
+        return util.make_packet_bytes(msg_type=msg_type, seqno=seqno, msg=msg)
+
+    def make_phases(self):
+        '''
+        Build the DATA and END phases, only possible once the START ACK settled the packet format.
+        Returns None if the message takes more than util.MAX_FLOW_CHUNKS packets of the size the receiver
+        took, it would drop the ones past that and the transfer would stall.
+        '''
+        payload = self.payload
+        if self.batch is not None:
+            payload = self.batch.payload(self.accepted.get("batch") == BATCH_OPTION)
+        self.chunks = self.chunks_of(payload)
+        if len(self.chunks) > util.MAX_FLOW_CHUNKS:
+            return None
+        data_pkts = []
+        for idx, chunk in enumerate(self.chunks):
+            seqno = self.starting_seq_num + 1 + idx
+            data_pkts.append((seqno, self.make_packet("data", seqno, chunk)))
+        end_seq_num = self.starting_seq_num + 1 + len(self.chunks)
+        end_pkts = [(end_seq_num, self.make_packet("end", end_seq_num))]
+        return [SendWindow(data_pkts, self.endpoint.window, self.endpoint.mode),
+                SendWindow(end_pkts, 1, self.endpoint.mode)]
+
+    def chunks_of(self, payload):
+        '''
+        The chunks a Payload goes out in, as large as the receiver took and packed by the endpoint
+        if the receiver took compression
+        '''
+        if self.accepted.get("zip") == ZIP_OPTION:
+            return self.endpoint.pack(payload, chunk_size(self.accepted))
+        return payload.chunks_for(chunk_size(self.accepted))
+
+    def pump(self):
+        '''
+        Send whatever the current window allows, moving on to the next phase when one is complete
+        '''
+        while self.phase < len(self.phases):
+            window = self.phases[self.phase]
+            self.send_new(window)
+            if not window.done():
+                return
+            self.phase += 1
+            if self.phase == 1 and not self.single:
+                phases = self.make_phases()
+                if phases is None:
+                    self.endpoint.transport_logger.debug(
+                        '[PKT]: Message of %d chunks is too large for %s', len(self.chunks), self.address)
+                    self.abort()
+                    return
+                self.phases.extend(phases)
+        self.endpoint.transport_logger.debug(
+            '[PKT]: Transfer complete to %s', self.address)
+        self.endpoint.transfers.discard(self)
+        self.finish()
+
+    def send_new(self, window):
+        '''
+        Send the new packets of a window that the congestion window and pacing let through
+        '''
+        while window.can_send():
+            now = time.time()
+            delay = self.cc.pace(now)
+            if delay > 0:
+                if self.pace_timer is None:
+                    self.pace_timer = self.endpoint.timers.schedule(delay, self.endpoint.resume, self)
+                return
+            if self.cc.available() <= 0:
+                self.cc.blocked[self] = True  # Woken up once ACKs make room
+                return
+            for seqno, pkt in window.to_send(1):
+                self.cc.sent(now, self.endpoint.timers.tick)
+                self.transmit(seqno, pkt)
+
+    def abort(self):
+        '''
+        Give up on the transfer, the receiver has not ACKed anything for too long
+        '''
+        self.endpoint.transport_logger.debug(
+            '[PKT]: Giving up on transfer to %s', self.address)
+        for timer in self.timers.values():
+            self.endpoint.timers.cancel(timer)
+        self.timers = dict()
+        self.cc.blocked.pop(self, None)  # The room it leaves goes to the others
+        if self.phase < len(self.phases):  # What is still in flight will never be ACKed
+            self.cc.release(self.phases[self.phase].in_flight())
+        self.endpoint.transfers.discard(self)
+        self.failed = True
+        self.finish()
+
+    def finish(self):
+        '''
+        Stop listening for ACKs and wake up whoever waits on the transfer
+        '''
+        for seqno in self.sent_at:
+            if self.endpoint.pending.get((self.address, seqno + 1)) is self:
+                del self.endpoint.pending[(self.address, seqno + 1)]
+        self.cc.blocked.pop(self, None)
+        if self.pace_timer is not None:
+            self.endpoint.timers.cancel(self.pace_timer)
+            self.pace_timer = None
+        if not self.failed and self.payload is not None:  # A session is no message, each of its own is timed
+            self.endpoint.completion.observe((time.time() - self.started) * 1000)
+        self.done.set()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        '''
+        Call callback(transfer) once the transfer is done, right away if it already is
+        '''
+        if self.done.is_set():
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def transmit(self, seqno, pkt):
+        '''
+        Put a packet on the wire and (re)arm its retransmission timer
+        '''
+        self.endpoint.sendto(pkt, self.address)
+        self.endpoint.pending[(self.address, seqno + 1)] = self
+        if seqno in self.sent_at:
+            self.resent.add(seqno)
+        else:
+            self.sent_at[seqno] = time.time()
+        if seqno in self.timers:
+            self.endpoint.timers.cancel(self.timers[seqno])
+        self.timers[seqno] = self.endpoint.timers.schedule(
+            self.rtt.rto(), self.endpoint.retransmit, self, seqno)
+
+    def on_ack(self, ackno, data=""):
+        '''
+        An ACK numbered ackno arrived, cancel the timers of what it confirms and keep the window moving.
+        A plain ACK only confirms ackno - 1, with SACK it confirms everything below ackno
+        and whatever its bitmap says arrived out of order.
+        '''
+        if self.phase >= len(self.phases):
+            return
+        window = self.phases[self.phase]
+        if self.phase > 0 and self.accepted.get("sack") == SACK_OPTION:
+            acked = window.ack_cumulative(ackno, util.parse_sack(ackno, data))
+        elif window.ack(ackno - 1):
+            acked = [ackno - 1]
+        else:
+            return
+        if not acked:
+            return
+        if self.phase == 0 and not self.single:  # ACK of the START packet, the receiver tells us what it accepted
+            self.accepted = util.parse_options(data)
+            self.endpoint.learn(self.address, self.accepted)
+        for seqno in acked:
+            self.endpoint.timers.cancel(self.timers.pop(seqno))
+        self.cc.on_ack(len(acked))
+        self.last_progress = time.time()
+        # Only time the newest packet, the ACK was sent for it, and only if it was sent once (Karn's rule)
+        if acked[-1] not in self.resent:
+            self.rtt.sample(time.time() - self.sent_at[acked[-1]])
+        # Early retransmit, a window too small for DUP_ACK_THRESHOLD packets to overtake a hole lowers it
+        threshold = max(1, min(util.DUP_ACK_THRESHOLD, self.cc.limit(window.size) - 1))
+        lost = window.lost(threshold)
+        if lost:
+            self.cc.on_loss()
+        for resend_seq, pkt in lost:
+            self.endpoint.packet_logger.debug('[PKT]: Fast resending %s', resend_seq)
+            self.endpoint.retransmits.inc("fast")
+            self.transmit(resend_seq, pkt)
+        self.pump()
+        self.cc.wake()  # Room we made in the window can go to other transfers to the peer
+
+    def on_timeout(self, seqno):
+        '''
+        The retransmission timer for seqno ran out
+        '''
+        if self.phase >= len(self.phases) or seqno not in self.timers:
+            return
+        window = self.phases[self.phase]
+        del self.timers[seqno]
+        resend = window.expired(seqno)
+        if resend and self.rtt.timeout():
+            self.cc.on_timeout()
+        for resend_seq, pkt in resend:
+            self.endpoint.packet_logger.debug('[PKT]: Resending %s', resend_seq)
+            self.endpoint.retransmits.inc("timeout")
+            self.transmit(resend_seq, pkt)
+        if seqno not in self.timers and not window.is_acked(seqno):
+            # Go-Back-N only times the oldest packet, keep the others armed until they get there
+            self.timers[seqno] = self.endpoint.timers.schedule(
+                self.rtt.rto(), self.endpoint.retransmit, self, seqno)
+
+
+class Delivery:
+    '''
+    A message sent over a Session, `done` is set once all of it is ACKed or the session was torn down
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.failed = False  # Set when the session went down before the message got through
+        self.done = threading.Event()
+        self.callbacks = []  # Called with the delivery once it is done
+
+    def finish(self, failed=False):
+        '''
+        Wake up whoever waits on the message
+        '''
+        self.failed = failed
+        self.done.set()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        '''
+        Call callback(delivery) once the message is done, right away if it already is
+        '''
+        if self.done.is_set():
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+
+class Session(Transfer):
+    '''
+    One reliable stream to a peer that every message to it goes through.
+    The START handshake happens once, after that the packets of all messages share one run of seqnos
+    and one window, and every message ends with an END packet carrying its last chunk. Messages are
+    pipelined back to back, each costs a single round trip, and the receiver delivers them in order.
+    Messages sent before the START is ACKed wait for it, and if the peer does not take the session
+    they go out as transfers of their own.
+    '''
+
+    def __init__(self, endpoint, address):
+        Transfer.__init__(self, endpoint, address, None, session=True)
+        self.next_seq = self.starting_seq_num + 1  # Seqno of the next packet of a message
+        self.waiting = []  # (Payload, Delivery) of the messages sent before the START was ACKed
+        self.deliveries = collections.deque()  # (END seqno, Delivery) of the messages not fully ACKed yet
+        self.refused = False  # The peer does not take sessions
+        self.closed = False
+
+    def send(self, payload):
+        '''
+        Add a Payload to the stream, returns its Delivery
+        '''
+        delivery = Delivery()
+        if self.phase == 0:
+            self.waiting.append((payload, delivery))
+        else:
+            self.append(payload, delivery)
+            self.pump()
+        return delivery
+
+    def idle(self):
+        '''
+        True when there is nothing left to send or to wait for
+        '''
+        return not self.waiting and not self.deliveries
+
+    def append(self, payload, delivery):
+        '''
+        Cut a message into packets at the end of the stream, the last chunk goes in its END
+        '''
+        chunks = self.chunks_of(payload) or [b""]
+        pkts = []
+        for idx, chunk in enumerate(chunks):
+            msg_type = "end" if idx == len(chunks) - 1 else "data"
+            pkts.append((self.next_seq, self.make_packet(msg_type, self.next_seq, chunk)))
+            self.next_seq += 1
+        self.phases[1].extend(pkts)
+        self.deliveries.append((self.next_seq - 1, delivery))
+        self.last_progress = time.time()  # An idle session is not stuck, only from now on
+
+    def pump(self):
+        '''
+        Send whatever the window allows and let every message that is fully ACKed know
+        '''
+        if self.closed:
+            return
+        if self.phase == 0:
+            self.send_new(self.phases[0])
+            if not self.phases[0].done():
+                return
+            self.phase = 1
+            if self.accepted.get("sess") != SESSION_OPTION:
+                self.refuse()
+                return
+            # The window of a transfer holds one message, in a session the congestion window is the limit
+            self.phases.append(SendWindow([], util.MAX_CWND, self.endpoint.mode))
+            waiting, self.waiting = self.waiting, []
+            for payload, delivery in waiting:
+                self.append(payload, delivery)
+        window = self.phases[1]
+        self.send_new(window)
+        first_unacked = window.pkts[window.base][0] if window.base < len(window.pkts) else self.next_seq
+        while self.deliveries and self.deliveries[0][0] < first_unacked:
+            delivery = self.deliveries.popleft()[1]
+            self.endpoint.completion.observe((time.time() - delivery.started) * 1000)
+            delivery.finish()
+        if window.base >= util.SESSION_COMPACT:
+            self.compact(first_unacked)
+
+    def compact(self, first_unacked):
+        '''
+        Forget the packets that are ACKed, only the ACK number first_unacked has to keep finding us
+        '''
+        window = self.phases[1]
+        for seqno, _ in window.pkts[:window.base]:
+            self.sent_at.pop(seqno, None)
+            self.resent.discard(seqno)
+            for ackno in (seqno, seqno + 1):
+                key = (self.address, ackno)
+                if ackno != first_unacked and self.endpoint.pending.get(key) is self:
+                    del self.endpoint.pending[key]
+        window.compact()
+
+    def refuse(self):
+        '''
+        The peer did not take the session, what waited for it goes out as transfers of their own
+        '''
+        self.endpoint.transport_logger.debug('[PKT]: No session with %s', self.address)
+        self.refused = True
+        self.endpoint.transfers.discard(self)
+        self.finish()
+        waiting, self.waiting = self.waiting, []
+        for payload, delivery in waiting:
+            transfer = Transfer(self.endpoint, self.address, payload)
+            self.endpoint.transfers.add(transfer)
+            transfer.add_done_callback(lambda transfer, delivery=delivery: delivery.finish(transfer.failed))
+            transfer.pump()
+
+    def close(self):
+        '''
+        Tear the session down, messages that are not fully ACKed yet count as failed
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        if self.endpoint.sessions.get(self.address) is self:
+            del self.endpoint.sessions[self.address]
+        if self.refused:
+            return
+        self.endpoint.transport_logger.debug('[PKT]: Closing session with %s', self.address)
+        Transfer.abort(self)
+        for _, delivery in self.waiting:
+            delivery.finish(True)
+        while self.deliveries:
+            self.deliveries.popleft()[1].finish(True)
+
+    def abort(self):
+        self.close()
+
+    def finish(self):
+        for key in [key for key, transfer in self.endpoint.pending.items() if transfer is self]:
+            del self.endpoint.pending[key]
+        Transfer.finish(self)
+
+
+class Endpoint:
+    '''
+    Reliable message delivery over a UDP socket, this is the part the Server and the Client have in common.
+    A receive thread runs recv_packet(), which reassembles incoming messages into `queue`, hands ACKs to
+    the transfers waiting on them and drives the retransmission timer wheel.
+    '''
+
+    def __init__(self, sock, logger, window, mode=SELECTIVE_REPEAT, options=None, ack_delay=0,
+                 congestion=RENO, coalesce=0, ack_every=util.DELAYED_ACK_COUNT):
+        self.sock = sock
+        self.logger = logger
+        # Subsystems with levels of their own, every packet is logged to the second, which may sample them
+        self.transport_logger = logconfig.transport_logger(logger)
+        self.packet_logger = logconfig.packet_logger(logger)
+        self.options = options if options is not None else Options()
+        self.window = int(window)
+        self.mode = mode  # Go-Back-N or Selective-Repeat
+        self.ack_delay = ack_delay  # Seconds an in-order DATA ACK may be held back, 0 to ACK right away
+        self.ack_every = ack_every  # Held back ACKs go out at the latest every this many packets
+        self.acks_sent = 0
+        self.acks_saved = 0  # DATA packets whose ACK was folded into a later one
+        self.zip_stats = {"compressed": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0,
+                          "compress_time": 0.0, "decompressed": 0, "decompress_time": 0.0}
+        self.flows = dict()  # Mappings from (address, START seqno) to the Flow being received
+        self.peer_flows = dict()  # Mappings from address to its Flows by START seqno
+        self.finished = collections.OrderedDict()  # Mappings from (address, END seqno) of completed flows to completion time
+        self.flow_ttl = util.FLOW_TTL
+        self.loop_transport = None  # Set while a DatagramEngine runs the endpoint on an event loop
+        self.transfers = set()  # Transfers that are still going
+        # Mappings from (peer address, expected ACK seqno) to transfer, for every packet it sent,
+        # so an ACK only ever reaches a transfer to the peer it came from
+        self.pending = dict()
+        self.hosts = dict()  # Mappings from host name to its IP address
+        self.rtts = dict()  # Mappings from peer address to its RttEstimator
+        self.peers = dict()  # Mappings from peer address to the options it took, if that includes single-datagram messages
+        self.sessions = dict()  # Mappings from peer address to the Session our messages to it go through
+        self.sessions_in = dict()  # Mappings from peer address to the SessionFlow of its messages to us
+        self.congestion = congestion  # Congestion control algorithm, Reno, CUBIC or none
+        self.controls = dict()  # Mappings from peer address to its CongestionControl
+        self.timers = TimerWheel()
+        # Holds messages back for up to coalesce seconds to send them together, 0 to send each on its own
+        self.coalescer = Coalescer(self, coalesce) if coalesce > 0 else None
+        self.buffers = BufferPool()
+        self.queue = queue.Queue()
+        self.metrics = metrics.Metrics()
+        self.packets_in = self.metrics.counter("packets_in", labeled=True)  # By type
+        self.packets_out = self.metrics.counter("packets_out", labeled=True)  # By type, resent ones included
+        self.checksum_failures = self.metrics.counter("checksum_failures")
+        # Packets resent "fast" because later ones overtook them, or after their "timeout" ran out
+        self.retransmits = self.metrics.counter("retransmits", labeled=True)
+        # END and msg packets of messages that already went up, their ACK got lost
+        self.duplicate_ends = self.metrics.counter("duplicate_ends", labeled=True)
+        # Milliseconds from sending a message until all of it is ACKed
+        self.completion = self.metrics.histogram("completion_ms", util.COMPLETION_BUCKETS)
+        self.metrics.gauge("queue_depth", self.queue.qsize)
+        self.metrics.gauge("flows", lambda: len(self.flows) + len(self.sessions_in))
+        self.metrics.gauge("transfers", lambda: len(self.transfers))
+        self.metrics.gauge("threads", threading.active_count)
+        self.metrics.gauge("acks", self.ack_stats)
+        self.metrics.gauge("compression", self.compress_stats)
+        self.mutex = threading.Lock()
+        # Wake up every tick even when nothing arrives so the timers keep firing
+        self.sock.settimeout(self.timers.tick)
+        self.timers.schedule(util.REAP_INTERVAL, self.reap)
+
+    def send_packet(self, msg, client_address):
+        '''
+        Start sending a msg and return its Transfer right away, wait on transfer.done for the last ACK.
+        msg can also be a Payload, to send the same message to many peers without encoding it again.
+        '''
+        payload = msg if isinstance(msg, Payload) else Payload(msg)
+        if self.options.session:
+            return self.send_session(payload, client_address)
+        self.mutex.acquire()
+        try:
+            transfer = Transfer(self, client_address, payload)
+            self.transfers.add(transfer)
+            transfer.pump()
+        finally:
+            self.mutex.release()
+        return transfer
+
+    def send_session(self, payload, client_address):
+        '''
+        Send a Payload over the session to a peer, opening it first if there is none.
+        Returns its Delivery, or its Transfer if the peer does not take sessions.
+        '''
+        address = self.resolve(client_address)
+        self.mutex.acquire()
+        try:
+            session = self.sessions.get(address)
+            if session is None:
+                session = Session(self, address)
+                self.sessions[address] = session
+                self.transfers.add(session)
+                session.pump()
+            if session.refused:
+                transfer = Transfer(self, address, payload)
+                self.transfers.add(transfer)
+                transfer.pump()
+                return transfer
+            return session.send(payload)
+        finally:
+            self.mutex.release()
+
+    def close_session(self, client_address):
+        '''
+        Tear down both directions of the session with a peer, messages still going to it fail
+        '''
+        address = self.resolve(client_address)
+        self.mutex.acquire()
+        try:
+            session = self.sessions.get(address)
+            if session is not None:
+                session.close()
+        finally:
+            self.mutex.release()
+        # The receive side belongs to whoever handles packets, it goes on their next timer tick
+        self.timers.schedule(0, self.drop_session, address)
+
+    def drop_session(self, address):
+        '''
+        Forget the SessionFlow of a peer, remembering its last seqno to re-ACK a duplicate of its last END
+        '''
+        session = self.sessions_in.pop(address, None)
+        if session is not None:
+            self.remember_finished(address, session.next_seq - 1)
+
+    def find_session(self, address, seqno):
+        '''
+        Get the SessionFlow from this address a DATA or END packet belongs to, or None
+        '''
+        session = self.sessions_in.get((address[0], address[1]))
+        if session is not None and session.owns(seqno):
+            return session
+        return None
+
+    def queue_message(self, msg, client_address):
+        '''
+        Hand a msg to the coalescer and return the Batch it went into, wait on batch.done for its last ACK.
+        Messages to the same peer are delivered in the order they were queued.
+        '''
+        self.mutex.acquire()
+        try:
+            # Keyed like the transfers of its batches, which go by the resolved address
+            return self.coalescer.add(msg, self.resolve(client_address))
+        finally:
+            self.mutex.release()
+
+    def flush_batch(self, address):
+        '''
+        Timer wheel callback for a batch whose coalescing delay is over
+        '''
+        self.mutex.acquire()
+        try:
+            batch = self.coalescer.waiting.get(address)
+            if batch is not None:
+                batch.timer = None
+            self.coalescer.flush(address)
+        finally:
+            self.mutex.release()
+
+    def coalesce_stats(self):
+        '''
+        Number of batches sent and of messages they carried
+        '''
+        if self.coalescer is None:
+            return {"batches": 0, "msgs": 0}
+        return self.coalescer.stats()
+
+    def sendto(self, pkt, address):
+        '''
+        Put a datagram on the wire, through the event loop when there is one
+        '''
+        self.packets_out.inc(util.packet_type(pkt))
+        if self.loop_transport is not None:
+            self.loop_transport.sendto(pkt, (address[0], address[1]))
+        else:
+            self.sock.sendto(pkt, (address[0], address[1]))
+
+    def resolve(self, address):
+        '''
+        (IP address, port) of a peer address that may name its host, the address its datagrams come from
+        '''
+        host = self.hosts.get(address[0])
+        if host is None:
+            host = socket.gethostbyname(address[0])
+            self.hosts[address[0]] = host
+        return (host, address[1])
+
+    def get_rtt(self, address):
+        '''
+        Get the RTT estimator of a peer, creating it on first contact
+        '''
+        address = (address[0], address[1])
+        if address not in self.rtts:
+            self.rtts[address] = RttEstimator()
+        rtt = self.rtts[address]
+        rtt.last_used = time.time()
+        return rtt
+
+    def ack_stats(self):
+        '''
+        Number of ACKs sent and of ACKs saved by holding them back
+        '''
+        return {"sent": self.acks_sent, "saved": self.acks_saved}
+
+    def retransmit_stats(self):
+        '''
+        Number of packets resent by fast retransmit and after a timeout
+        '''
+        return {"fast": self.retransmits.get("fast"), "timeout": self.retransmits.get("timeout")}
+
+    def learn(self, address, accepted):
+        '''
+        Remember whether a peer takes single-datagram messages from the options it accepted on START
+        '''
+        address = (address[0], address[1])
+        if accepted.get("msg") == MSG_OPTION:
+            self.peers[address] = accepted
+        else:
+            self.peers.pop(address, None)
+
+    def pack(self, payload, size=util.CHUNK_SIZE):
+        '''
+        The chunks of at most size bytes of a Payload for a peer that took compression. They start with a flag
+        byte, z if the rest is the message compressed with zlib or - if it is the message as it is. Only messages
+        longer than COMPRESS_THRESHOLD are compressed, and only when it saves at least 1 - COMPRESS_MIN_RATIO
+        of the bytes. Every Payload is compressed once, whatever the number of peers it goes to.
+        '''
+        level = self.options.compress or zlib.Z_DEFAULT_COMPRESSION
+        chunks = payload.packed.get((level, size))
+        if chunks is not None:
+            return chunks
+        packed = payload.packed.get(level)  # Packed already for a peer that took another chunk size
+        if packed is None:
+            data = payload.data
+            packed = b"-" + data
+            if len(data) > util.COMPRESS_THRESHOLD:
+                start = time.thread_time()
+                compressed = zlib.compress(data, level)
+                self.zip_stats["compress_time"] += time.thread_time() - start
+                if len(compressed) <= len(data) * util.COMPRESS_MIN_RATIO:
+                    packed = b"z" + compressed
+                    self.zip_stats["compressed"] += 1
+                    self.zip_stats["bytes_in"] += len(data)
+                    self.zip_stats["bytes_out"] += len(compressed)
+                else:
+                    self.zip_stats["skipped"] += 1
+            payload.packed[level] = packed
+        chunks = [packed[i:i + size] for i in range(0, len(packed), size)]
+        payload.packed[(level, size)] = chunks
+        return chunks
+
+    def unpack(self, data):
+        '''
+        Inverse of pack, returns None for a message that does not inflate to at most util.MAX_MESSAGE_SIZE
+        '''
+        if data[:1] != b"z":
+            return data[1:]
+        start = time.thread_time()
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(data[1:], util.MAX_MESSAGE_SIZE)
+        except zlib.error:
+            return None
+        self.zip_stats["decompress_time"] += time.thread_time() - start
+        self.zip_stats["decompressed"] += 1
+        if inflater.unconsumed_tail or not inflater.eof:
+            return None
+        return data
+
+    def compress_stats(self):
+        '''
+        Messages compressed and skipped, overall compression ratio, and CPU microseconds per message
+        spent compressing and decompressing
+        '''
+        stats = self.zip_stats
+        tried = stats["compressed"] + stats["skipped"]
+        return {"compressed": stats["compressed"], "skipped": stats["skipped"],
+                "ratio": stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 1.0,
+                "compress_us": stats["compress_time"] / tried * 1e6 if tried else 0.0,
+                "decompress_us": stats["decompress_time"] / stats["decompressed"] * 1e6
+                if stats["decompressed"] else 0.0}
+
+    def get_congestion(self, address):
+        '''
+        Get the congestion window of a peer, creating it on first contact
+        '''
+        address = (address[0], address[1])
+        if address not in self.controls:
+            if self.congestion == CUBIC:
+                self.controls[address] = Cubic(self.get_rtt(address))
+            else:
+                self.controls[address] = CongestionControl(
+                    self.get_rtt(address), self.congestion != NO_CONGESTION_CONTROL)
+        return self.controls[address]
+
+    def congestion_stats(self):
+        '''
+        Snapshot of the congestion window of every peer, keyed by address
+        '''
+        self.mutex.acquire()
+        stats = dict()
+        for address, control in list(self.controls.items()):
+            stats[address] = control.stats()
+        self.mutex.release()
+        return stats
+
+    def rtt_stats(self):
+        '''
+        Snapshot of the RTT estimator state of every peer, keyed by address
+        '''
+        self.mutex.acquire()
+        stats = dict()
+        for address, rtt in list(self.rtts.items()):
+            stats[address] = rtt.stats()
+        self.mutex.release()
+        return stats
+
+    def reap(self):
+        '''
+        Timer wheel callback that frees flows, transfers and RTT estimates nobody has heard of in flow_ttl
+        '''
+        now = time.time()
+        for flow in list(self.flows.values()):
+            if now - flow.last_seen > self.flow_ttl:
+                self.transport_logger.debug('[PKT]: Dropping abandoned flow %s', flow.start_seq)
+                self.drop_flow(flow)
+        while self.finished and now - next(iter(self.finished.values())) > self.flow_ttl:
+            self.finished.popitem(last=False)  # Oldest first
+        for address, session in list(self.sessions_in.items()):
+            if now - session.last_seen > self.flow_ttl:
+                self.drop_session(address)
+        self.mutex.acquire()
+        try:
+            for session in list(self.sessions.values()):
+                # Well before the receiver gives up on it, so nothing is ever sent into a session it forgot
+                if session.idle() and now - session.last_progress > util.SESSION_IDLE:
+                    session.close()
+            for transfer in list(self.transfers):
+                if now - transfer.last_progress > self.flow_ttl:
+                    transfer.abort()
+            for address, control in list(self.controls.items()):
+                if now - control.last_used > self.flow_ttl and not control.blocked:
+                    del self.controls[address]
+            for address, rtt in list(self.rtts.items()):
+                if now - rtt.last_used > self.flow_ttl and address not in self.controls:
+                    del self.rtts[address]
+                    self.peers.pop(address, None)
+        finally:
+            self.mutex.release()
+        self.timers.schedule(util.REAP_INTERVAL, self.reap)
+
+    def find_flow(self, address, seqno):
+        '''
+        Get the flow from this address a DATA or END packet belongs to, or None
+        '''
+        found = None
+        for flow in self.peer_flows.get(address, {}).values():
+            if flow.owns(seqno) and (found is None or flow.start_seq > found.start_seq):
+                found = flow
+        return found
+
+    def drop_flow(self, flow):
+        '''
+        Forget everything about a flow
+        '''
+        if flow.ack_timer is not None:
+            self.timers.cancel(flow.ack_timer)
+            flow.ack_timer = None
+        del self.flows[(flow.address, flow.start_seq)]
+        peer = self.peer_flows[flow.address]
+        del peer[flow.start_seq]
+        if not peer:
+            del self.peer_flows[flow.address]
+
+    def finish_flow(self, flow):
+        '''
+        Free a completed flow, only remembering its END seqno to re-ACK duplicates
+        '''
+        self.drop_flow(flow)
+        self.remember_finished(flow.address, flow.end_seq)
+
+    def remember_finished(self, address, seqno):
+        '''
+        Remember the last seqno of a completed message, so a duplicate of it is ACKed but not sent up again
+        '''
+        now = time.time()
+        self.finished[(address, seqno)] = now
+        # Oldest first, so expired entries are always at the front
+        while len(self.finished) > util.MAX_FINISHED_FLOWS or \
+                now - next(iter(self.finished.values())) > self.flow_ttl:
+            self.finished.popitem(last=False)
+
+    def resume(self, transfer):
+        '''
+        Timer wheel callback for a transfer that pacing held back
+        '''
+        self.mutex.acquire()
+        try:
+            transfer.pace_timer = None
+            if not transfer.done.is_set():
+                transfer.pump()
+        finally:
+            self.mutex.release()
+
+    def retransmit(self, transfer, seqno):
+        '''
+        Timer wheel callback for a packet whose ACK did not come back in time
+        '''
+        self.mutex.acquire()
+        try:
+            transfer.on_timeout(seqno)
+        finally:
+            self.mutex.release()
+
+    def recv_packet(self):
+        '''
+        Handle all incoming packets, will combine them and send to packet handler when the END packet has arrived
+        '''
+        self.transport_logger.debug('[PKT]: Starting to read in packets')
+        buf = self.buffers.get()  # Every datagram is read into this same buffer
+        try:
+            while True:
+                try:
+                    nbytes, client_address = self.sock.recvfrom_into(buf)
+                except socket.timeout:
+                    self.timers.advance(time.time())
+                    continue
+                except OSError:
+                    self.transport_logger.debug('[PKT]: Socket closed, stop reading packets')
+                    return
+                self.handle_packet(buf, client_address, nbytes)
+                self.timers.advance(time.time())
+        finally:
+            self.buffers.put(buf)
+
+    def handle_packet(self, data, client_address, nbytes=None):
+        '''
+        Process a single datagram, made of the first nbytes of data (all of it by default).
+        Nothing is decoded here, payloads are sliced out of data and copied once into the reassembly buffer.
+        '''
+        self.packet_logger.debug('[PKT]: Received Packet')
+        binary = util.binary_checksum(data)  # Checksum of a binary packet, None for text
+        if binary:
+            parsed = util.parse_binary_packet(data, nbytes)
+        else:
+            parsed = util.parse_packet_bytes(data, nbytes)
+        if parsed is None:  # Validate checksum, otherwise DROP
+            self.packet_logger.debug('[PKT]: Dropping packet with invalid checksum')
+            self.checksum_failures.inc()
+            return
+        msg_type, seq_no, payload = parsed
+        self.packets_in.inc(msg_type)
+        self.packet_logger.debug('[PKT]: Packet is valid, %s', seq_no)
+        if msg_type in ("data", "end"):
+            session = self.find_session(client_address, seq_no)
+            if session is not None:
+                self.session_packet(session, msg_type, seq_no, payload, binary)
+                return
+        if msg_type == "start":
+            self.packet_logger.debug('[PKT]: Received START Packet%s', seq_no)
+            # The START data is the sender's offer, what we take goes back in the ACK
+            offer = util.parse_options(bytes(payload).decode('utf-8', 'replace'))
+            accepted = self.options.accept(offer)
+            key = (client_address, seq_no)
+            if "sess" in accepted:
+                session = self.sessions_in.get(client_address)
+                if session is None or session.start_seq != seq_no:  # A new session replaces the old one
+                    self.transport_logger.debug('[PKT]: Opening session with %s', client_address)
+                    session = SessionFlow(client_address, seq_no, "sack" in accepted, "zip" in accepted)
+                    self.sessions_in[client_address] = session
+                session.last_seen = time.time()
+            else:
+                if key not in self.flows:  # Could be a resent START we already have
+                    flow = Flow(client_address, seq_no, "sack" in accepted, "batch" in accepted, "zip" in accepted)
+                    self.flows[key] = flow
+                    self.peer_flows.setdefault(client_address, dict())[seq_no] = flow
+                self.flows[key].last_seen = time.time()
+            self.send_ack(seq_no + 1, client_address, util.make_options(accepted))  # SEND ACK
+        elif msg_type == "data":
+            self.packet_logger.debug('[PKT]: Received DATA Packet%s', seq_no)
+            flow = self.find_flow(client_address, seq_no)
+            if flow is None:  # A late copy for a message we already completed
+                self.send_ack(seq_no + 1, client_address, binary=binary)  # SEND ACK
+                return
+            flow.last_seen = time.time()
+            flow.binary = binary
+            # Only an ACK for the next packet in order, with nothing out of order around it, may wait
+            in_order = flow.count == flow.first_missing and seq_no == flow.start_seq + 1 + flow.count
+            complete = flow.add(seq_no, bytes(payload))  # The one copy of the payload
+            flow.owed += 1
+            if complete:
+                # Filled the last gap after the END came in, which we can ACK now
+                self.flush_ack(flow, seq_no)
+                self.complete_flow(flow, binary)
+            elif in_order and flow.sack and self.ack_delay > 0 and flow.owed < self.ack_every:
+                if flow.ack_timer is None:
+                    flow.ack_timer = self.timers.schedule(self.ack_delay, self.flush_ack, flow, seq_no)
+            else:
+                self.flush_ack(flow, seq_no)
+        elif msg_type == "end":
+            self.packet_logger.debug('[PKT]: Received END Packet%s', seq_no)
+            if (client_address, seq_no) in self.finished:
+                # Our ACK got lost, ACK again but don't send the message up twice
+                self.packet_logger.debug('[PKT]: Duplicate END Packet%s', seq_no)
+                self.duplicate_ends.inc("end")
+                self.send_ack(seq_no + 1, client_address, binary=binary)
+                return
+            flow = self.find_flow(client_address, seq_no)
+            if flow is None:
+                return
+            flow.last_seen = time.time()
+            if not flow.end(seq_no, bytes(payload)):
+                # We are missing packets, don't send ACK
+                self.packet_logger.debug('[PKT]: Missing %d packets', flow.missing)
+                return
+            self.complete_flow(flow, binary)
+        elif msg_type == "msg":
+            self.packet_logger.debug('[PKT]: Received MSG Packet%s', seq_no)
+            self.send_ack(seq_no + 1, client_address, binary=binary)  # SEND ACK
+            if (client_address, seq_no) in self.finished:
+                # Our ACK got lost, it was ACKed again but the message must not go up twice
+                self.packet_logger.debug('[PKT]: Duplicate MSG Packet%s', seq_no)
+                self.duplicate_ends.inc("msg")
+                return
+            self.remember_finished(client_address, seq_no)
+            self.queue.put((bytes(payload).decode('utf-8'), client_address))  # Notify that we got a packet
+        elif msg_type == "ack":
+            self.packet_logger.debug('[PKT]: Received ACK%s', seq_no)
+            self.mutex.acquire()
+            try:
+                # Whoever sent the packet right below the ACK number, until that transfer is done
+                transfer = self.pending.get(((client_address[0], client_address[1]), seq_no))
+                if transfer is not None:  # Late or duplicate ACKs have nobody waiting on them
+                    # Only START ACKs and SACKs carry data, everything else stays undecoded
+                    transfer.on_ack(seq_no, bytes(payload).decode('utf-8') if len(payload) else "")
+            finally:
+                self.mutex.release()
+
+    def flush_ack(self, flow, seqno):
+        '''
+        Send the ACK of a flow for the DATA packet seqno, along with every one that was held back
+        '''
+        if flow.ack_timer is not None:
+            self.timers.cancel(flow.ack_timer)
+            flow.ack_timer = None
+        ackno, sack = flow.ack_for(seqno)
+        self.send_ack(ackno, flow.address, sack, flow.binary)  # SEND ACK
+        self.acks_saved += flow.owed - 1
+        flow.owed = 0
+
+    def session_packet(self, session, msg_type, seqno, payload, binary=False):
+        '''
+        A DATA or END packet of a session, ACK it and send up every message it completed
+        '''
+        session.last_seen = time.time()
+        msgs = session.add(seqno, msg_type, bytes(payload))  # The one copy of the payload
+        ackno, sack = session.ack_for(seqno)
+        self.send_ack(ackno, session.address, sack, binary)  # SEND ACK
+        for msg in msgs:
+            if session.zip:
+                msg = self.unpack(msg)
+                if msg is None:
+                    self.transport_logger.debug('[PKT]: Dropping message that does not decompress')
+                    continue
+            self.queue.put((msg.decode('utf-8'), session.address))  # Notify that we got a packet
+
+    def complete_flow(self, flow, binary=False):
+        '''
+        Every packet of a flow is in, ACK its END and send the message up
+        '''
+        current_msg = self.get_msg_from_seqs(flow)
+        self.packet_logger.debug('[PKT]: Received Full Packet With all ACKS')
+        self.finish_flow(flow)
+        self.send_ack(flow.end_seq + 1, flow.address, binary=binary)  # SEND ACK
+        if current_msg is None:
+            self.transport_logger.debug('[PKT]: Dropping message that does not decompress')
+            return
+        if flow.batch:  # Every message of a batch goes up on its own, in the order it was sent
+            for msg in util.parse_batch(current_msg):
+                self.queue.put((msg, flow.address))
+        else:
+            self.queue.put((current_msg, flow.address))  # Notify that we got a packet
+        self.transport_logger.debug("[PKT]: Completed message, %s", current_msg)
+
+    def get_msg_from_seqs(self, flow):
+        '''
+        Reconstruct the data of a complete flow, the payloads are joined and decoded once.
+        Returns None if a compressed message does not inflate.
+        '''
+        data = flow.message()
+        if flow.zip:
+            data = self.unpack(data)
+            if data is None:
+                return None
+        return data.decode('utf-8')
+
+    def send_ack(self, seqno, client_address, msg="", binary=False):
+        '''
+        Send an ACK for a packet with some sequence number, also will require the address.
+        Packets that came in binary are ACKed in binary, binary being the checksum they came with.
+        '''
+        if binary:
+            ack_pkt = util.make_binary_packet(msg_type="ack", seqno=seqno, msg=msg.encode('utf-8'), checksum=binary)
+        else:
+            ack_pkt = util.make_packet(msg_type="ack",
+                                       msg=msg, seqno=seqno).encode('utf-8')  # ACK message and packet created and sent
+        self.sendto(ack_pkt, client_address)
+        self.acks_sent += 1
+
+
+class DatagramEngine(asyncio.DatagramProtocol):
+    '''
+    Runs an Endpoint on an asyncio event loop instead of a receive thread. Datagrams are handled as
+    they arrive, retransmission timers are loop callbacks and every completed message is handed to
+    on_message(msg, address) on the loop as well, so nothing ever blocks or needs another thread.
+    '''
+
+    def __init__(self, endpoint, on_message):
+        self.endpoint = endpoint
+        self.on_message = on_message
+        self.closed = None  # Future that is done once the engine stopped
+
+    async def run(self):
+        '''
+        Serve the endpoint socket until it is closed or on_message raises
+        '''
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.endpoint.timers = LoopTimers(loop)
+        self.endpoint.timers.schedule(util.REAP_INTERVAL, self.endpoint.reap)
+        datagrams, _ = await loop.create_datagram_endpoint(lambda: self, sock=self.endpoint.sock)
+        try:
+            await self.closed
+        finally:
+            datagrams.close()
+
+    def connection_made(self, transport):
+        self.endpoint.loop_transport = transport
+
+    def connection_lost(self, exc):
+        self.endpoint.loop_transport = None
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def datagram_received(self, data, addr):
+        if self.closed.done():
+            return
+        self.endpoint.handle_packet(data, addr)
+        while not self.endpoint.queue.empty():  # Only this loop fills it, get_nowait() cannot fail
+            msg, address = self.endpoint.queue.get_nowait()
+            try:
+                self.on_message(msg, address)
+            except Exception as e:
+                self.closed.set_exception(e)
+                return
+
+    def error_received(self, exc):
+        self.endpoint.transport_logger.debug('[PKT]: Socket error, %s', exc)
@@ -2,21 +2,76 @@
 This file contains basic utility functions that you can use and can also make your helper functions here
 '''
 import binascii
+import struct
+import zlib
+
+try:  # Optional, only offered when installed
+    import crc32c
+except ImportError:
+    crc32c = None
+try:  # Optional, only offered when installed
+    import xxhash
+except ImportError:
+    xxhash = None
 
 MAX_NUM_CLIENTS = 10
-TIME_OUT = 0.5 # 500ms
-CHUNK_SIZE = 1400 # 1400 Bytes
+TIME_OUT = 0.5 # 500ms, retransmission timeout until the first RTT sample arrives
+MIN_RTO = 0.03 # 30ms, a few timer ticks
+MAX_RTO = 8.0 # 8s, ceiling for the exponential backoff
+FLOW_TTL = 60.0 # 60s without hearing from a peer before its flows and transfers are given up
+REAP_INTERVAL = 5.0 # 5s between two sweeps for abandoned flows
+MAX_FINISHED_FLOWS = 65536 # Completed flows remembered to re-ACK a duplicate END
+MAX_FLOW_CHUNKS = 65536 # Most DATA packets a single message can have
+CHUNK_SIZE = 1400 # 1400 Bytes of payload per packet, unless the peer took a larger datagram size
+MAX_CHUNK_SIZE = 65000 # Bytes, the largest payload per packet a receiver takes, a UDP datagram tops out at 65507
+SMALL_PACKET = 512 # Bytes, text datagrams up to this size are parsed from a copy, cheaper than slicing memoryviews
+RECV_BUFFER_SIZE = 65536 # Bytes, size of a preallocated receive buffer, fits any datagram
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024 # Bytes, kernel receive buffer asked for, room for a window of large datagrams
+TIMER_TICK = 0.01 # 10ms granularity of the retransmission timer wheel
+TIMER_SLOTS = 512 # Slots in the timer wheel, one turn covers ~5s
+SACK_BITS = 256 # Packets past the cumulative ACK that a SACK bitmap covers
+DELAYED_ACK_COUNT = 2 # A held back ACK goes out at the latest with the 2nd packet, like TCP
+DUP_ACK_THRESHOLD = 3 # Packets overtaking a hole before it is resent without waiting for its timer
+INITIAL_CWND = 4 # Packets, congestion window of a peer we never sent to (RFC 3390)
+MIN_CWND = 1 # Packets, congestion window after a timeout
+MAX_CWND = 1024 # Packets, the congestion window stops growing there
+MAX_BATCH_SIZE = 1400 # Characters, a coalesced batch goes out as soon as it holds this much
+SESSION_IDLE = 30.0 # 30s, a sender tears down a session it did not use for this long, well before FLOW_TTL
+SESSION_COMPACT = 1024 # Packets ACKed before a session forgets them
+COMPLETION_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000] # ms, bounds of the message completion time histogram
+COMPRESS_THRESHOLD = 1400 # Bytes, a message that fits in one chunk has no packets to save
+COMPRESS_MIN_RATIO = 0.9 # A compressed message goes out only if it is at most 90% of the original
+MAX_MESSAGE_SIZE = MAX_FLOW_CHUNKS * CHUNK_SIZE # Bytes, the most a compressed message may inflate to
+
+# Binary packet format: version, type, seqno, payload length, checksum, then the payload.
+# The version byte has its high bit set, which can never start a text packet, and its low bits tell the checksum.
+BINARY_VERSION = 0x81
+BINARY_HEADER = struct.Struct("!BBIHI")
+CRC32 = "crc32"
+ADLER32 = "adler32"
+CRC32C = "crc32c"
+XXH32 = "xxh32"
+# Mappings from version byte to the checksum of the binary packets that start with it
+BINARY_CHECKSUMS = {BINARY_VERSION: CRC32, 0x82: ADLER32, 0x83: CRC32C, 0x84: XXH32}
+BINARY_VERSIONS = dict((name, version) for version, name in BINARY_CHECKSUMS.items())
+# Checksums that can be used here, CRC32 and Adler-32 always, CRC32C and xxHash32 when they are installed
+CHECKSUMS = [CRC32, ADLER32] + [CRC32C] * (crc32c is not None) + [XXH32] * (xxhash is not None)
+# A msg packet is a whole single-chunk message, START, DATA and END in one
+PACKET_TYPES = ["start", "data", "end", "ack", "msg"]
+PACKET_TYPE_CODES = {"start": 0, "data": 1, "end": 2, "ack": 3, "msg": 4}
+TEXT_PACKET_TYPES = {b"start": "start", b"data": "data", b"end": "end", b"ack": "ack", b"msg": "msg"}
 
 def validate_checksum(message):
     '''
-    Validates Checksum of a message and returns true/false
+    Validates Checksum of a message and returns true/false.
+    The message can also be the raw bytes, which are checked as they are without decoding anything.
     '''
-    try:
-        msg, checksum = message.rsplit('|', 1)
-        msg += '|'
-        return generate_checksum(msg.encode()) == checksum
-    except BaseException:
+    if isinstance(message, str):
+        message = message.encode()
+    last = message.rfind(b'|')
+    if last < 0:
         return False
+    return b"%d" % (binascii.crc32(memoryview(message)[:last + 1]) & 0xffffffff) == message[last + 1:]
 
 
 def generate_checksum(message):
@@ -30,7 +85,7 @@ def make_packet(msg_type="data", seqno=0, msg=""):
     '''
     This will add the header to your message.
     The formats is `<message_type> <sequence_number> <body> <checksum>`
-    msg_type can be data, ack, end, start
+    msg_type can be data, ack, end, start, msg
     seqno is a packet sequence number (integer)
     msg is the actual message string
     '''
@@ -40,6 +95,16 @@ def make_packet(msg_type="data", seqno=0, msg=""):
     return packet
 
 
+def make_packet_bytes(msg_type="data", seqno=0, msg=b""):
+    '''
+    Same packet as make_packet(...).encode(), built around a msg that is already encoded.
+    The checksum runs over the header and then carries on over msg, no text body is built and encoded.
+    '''
+    header = b"%s|%d|" % (msg_type.encode(), seqno)
+    checksum = binascii.crc32(b"|", binascii.crc32(msg, binascii.crc32(header))) & 0xffffffff
+    return b"".join((header, msg, b"|", b"%d" % checksum))
+
+
 def parse_packet(message):
     '''
     This function will parse the packet in the same way it was made in the above function.
@@ -66,3 +131,193 @@ def make_message(msg_type, msg_format, message=None):
         msg_len = len(message)
         return "%s %d %s" % (msg_type, msg_len, message)
     return ""
+
+
+def checksum_of(name, header, payload):
+    '''
+    The 32 bit checksum of header followed by payload, carried on from one to the other without joining them
+    '''
+    if name == CRC32:
+        return binascii.crc32(payload, binascii.crc32(header)) & 0xffffffff
+    if name == ADLER32:
+        return zlib.adler32(payload, zlib.adler32(header)) & 0xffffffff
+    if name == CRC32C:
+        return crc32c.crc32c(payload, crc32c.crc32c(header))
+    hasher = xxhash.xxh32(header)
+    hasher.update(payload)
+    return hasher.intdigest()
+
+
+def make_binary_packet(msg_type="data", seqno=0, msg=b"", checksum=CRC32):
+    '''
+    Binary counterpart of make_packet, msg is the payload as bytes.
+    The checksum covers the header (with the checksum field left out) followed by the payload.
+    '''
+    header = struct.pack("!BBIH", BINARY_VERSIONS[checksum],
+                         PACKET_TYPE_CODES[msg_type], seqno, len(msg))
+    return header + struct.pack("!I", checksum_of(checksum, header, msg)) + msg
+
+
+def is_binary_packet(packet):
+    '''
+    True if the raw datagram uses the binary packet format
+    '''
+    return len(packet) > 0 and packet[0] in BINARY_CHECKSUMS
+
+
+def binary_checksum(packet):
+    '''
+    The checksum of a binary datagram, None if it is a text one
+    '''
+    return BINARY_CHECKSUMS.get(packet[0]) if len(packet) > 0 else None
+
+
+def packet_type(packet):
+    '''
+    Type of a packet we built, text or binary, read off its first bytes without checking anything
+    '''
+    if binary_checksum(packet):
+        return PACKET_TYPES[packet[1]] if packet[1] < len(PACKET_TYPES) else "unknown"
+    return TEXT_PACKET_TYPES.get(bytes(packet[:packet.find(b"|", 0, 6)]), "unknown")
+
+
+def parse_binary_packet(packet, nbytes=None):
+    '''
+    Parse and validate a binary packet from the first nbytes of the raw datagram.
+    Returns (msg_type, seqno, payload) with the payload as a memoryview into packet,
+    or None if the packet is malformed or the checksum is wrong.
+    '''
+    if nbytes is None:
+        nbytes = len(packet)
+    if nbytes < BINARY_HEADER.size:
+        return None
+    version, type_code, seqno, length, checksum = BINARY_HEADER.unpack_from(packet)
+    name = BINARY_CHECKSUMS.get(version)
+    if name not in CHECKSUMS or type_code >= len(PACKET_TYPES) or nbytes != BINARY_HEADER.size + length:
+        return None
+    view = memoryview(packet)
+    payload = view[BINARY_HEADER.size:nbytes]
+    if checksum_of(name, view[:BINARY_HEADER.size - 4], payload) != checksum:
+        return None
+    return PACKET_TYPES[type_code], seqno, payload
+
+
+def parse_packet_bytes(packet, nbytes=None):
+    '''
+    Parse and validate a text packet from the first nbytes of the raw datagram, without decoding it.
+    Returns (msg_type, seqno, data) with the data as a memoryview into packet, or as bytes for
+    datagrams of up to SMALL_PACKET bytes, or None if the packet is malformed or the checksum is wrong.
+    '''
+    if nbytes is None:
+        nbytes = len(packet)
+    if nbytes <= SMALL_PACKET:
+        return parse_small_packet(bytes(packet[:nbytes]))
+    first = packet.find(b'|', 0, nbytes)
+    second = packet.find(b'|', first + 1, nbytes)
+    last = packet.rfind(b'|', 0, nbytes)
+    if first < 0 or second < 0 or last <= second:
+        return None
+    view = memoryview(packet)
+    try:
+        if binascii.crc32(view[:last + 1]) & 0xffffffff != int(view[last + 1:nbytes]):
+            return None
+        seqno = int(view[first + 1:second])
+    except ValueError:
+        return None
+    msg_type = TEXT_PACKET_TYPES.get(bytes(view[:first]))
+    if msg_type is None:
+        return None
+    return msg_type, seqno, view[second + 1:last]
+
+
+def parse_small_packet(packet):
+    '''
+    parse_packet_bytes of a short datagram copied out as bytes, where splitting the copy
+    costs less than making memoryviews and slicing them
+    '''
+    try:
+        msg_type, seqno, rest = packet.split(b'|', 2)
+        data, bar, checksum = rest.rpartition(b'|')
+        if not bar or b"%d" % binascii.crc32(packet[:len(packet) - len(checksum)]) != checksum:
+            return None
+        seqno = int(seqno)
+    except ValueError:
+        return None
+    msg_type = TEXT_PACKET_TYPES.get(msg_type)
+    if msg_type is None:
+        return None
+    return msg_type, seqno, data
+
+
+def make_options(options):
+    '''
+    Format a dict of negotiated options as `key=value;key=value`, carried in START packets and their ACKs
+    '''
+    return ";".join("%s=%s" % (key, options[key]) for key in sorted(options))
+
+
+def parse_options(data):
+    '''
+    Inverse of make_options, anything that does not look like an option is ignored
+    '''
+    options = dict()
+    for item in data.split(";"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            options[key] = value
+    return options
+
+
+def make_sack(received):
+    '''
+    Format the SACK bitmap of an ACK as hex, received[i] is true if the packet i + 1 after the ACK number arrived.
+    Empty when nothing arrived out of order, so a cumulative ACK alone looks like a plain one.
+    '''
+    bits = 0
+    for idx, got in enumerate(received):
+        if got:
+            bits |= 1 << idx
+    return "%x" % bits if bits else ""
+
+
+def parse_sack(ackno, data):
+    '''
+    Inverse of make_sack, returns the seqnos the bitmap of the ACK numbered ackno says arrived
+    '''
+    try:
+        bits = int(data, 16) if data else 0
+    except ValueError:
+        return []
+    seqnos = []
+    seqno = ackno + 1
+    while bits:
+        if bits & 1:
+            seqnos.append(seqno)
+        bits >>= 1
+        seqno += 1
+    return seqnos
+
+
+def make_batch(msgs):
+    '''
+    Pack several messages into one as `len:msg` for each of them, len being the number of characters of msg
+    '''
+    return "".join("%d:%s" % (len(msg), msg) for msg in msgs)
+
+
+def parse_batch(data):
+    '''
+    Inverse of make_batch, stops at the first entry that does not fit
+    '''
+    msgs = []
+    pos = 0
+    while pos < len(data):
+        colon = data.find(":", pos)
+        if colon < 0 or not data[pos:colon].isdigit():
+            break
+        end = colon + 1 + int(data[pos:colon])
+        if end > len(data):
+            break
+        msgs.append(data[colon + 1:end])
+        pos = end
+    return msgs